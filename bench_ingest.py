@@ -0,0 +1,125 @@
+import argparse
+import csv
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+# Замер загрузки большой выгрузки водителей: потоковое чтение (ingest.read_index) против
+# pandas + VuIndex.from_dataframe для CSV, XLSX и Parquet. Каждая загрузка идёт в отдельном
+# процессе, чтобы пиковый RSS одного способа не влиял на другой.
+# Пример: python bench_ingest.py --rows 1000000 --formats csv,parquet
+CITIES = ["Алматы", "Астана", "Шымкент", "Караганда", "Актобе", "Тараз", "Павлодар", "Усть-Каменогорск",
+          "Семей", "Атырау", "Костанай", "Кызылорда", "Уральск", "Петропавловск", "Актау", "Туркестан"]
+HEADER = ["ВУ номер", "Имя", "Город", "Количество заказов", "Количество купонов", "Номер купона"]
+
+
+def synthetic_rows(count, seed=1):
+    rng = random.Random(seed)
+    next_coupon = 1
+    for i in range(count):
+        orders = rng.randint(0, 1200)
+        coupons = orders // 100
+        numbers = ",".join(f"{number:04d}" for number in range(next_coupon, next_coupon + min(coupons, 5)))
+        next_coupon += coupons
+        yield [f"KZ{i:08d}", f"Водитель {i}", rng.choice(CITIES), orders, coupons, numbers]
+
+
+def generate(path, count):
+    extension = os.path.splitext(path)[1]
+    if extension == ".csv":
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(HEADER)
+            writer.writerows(synthetic_rows(count))
+    elif extension == ".xlsx":
+        from openpyxl import Workbook
+
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        sheet.append(HEADER)
+        for row in synthetic_rows(count):
+            sheet.append(row)
+        workbook.save(path)
+    elif extension == ".parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        writer = None
+        batch = []
+        for row in synthetic_rows(count):
+            batch.append(row)
+            if len(batch) == 100000 or len(batch) == count:
+                table = pa.table({name: column for name, column in zip(HEADER, zip(*batch))})
+                writer = writer or pq.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+                count -= len(batch)
+                batch = []
+        writer.close()
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # Linux: килобайты
+
+
+# Загрузка в дочернем процессе: печатает JSON с числом записей, временем и RSS
+def child(method, path):
+    if method == "pandas":
+        import pandas as pd
+        from vu_index import VuIndex
+
+        readers = {".csv": pd.read_csv, ".xlsx": pd.read_excel, ".parquet": pd.read_parquet}
+        load = lambda: VuIndex.from_dataframe(readers[os.path.splitext(path)[1]](path))  # noqa: E731
+    else:
+        from ingest import read_index
+
+        load = lambda: read_index(path)  # noqa: E731
+    before = peak_rss_mb()
+    started = time.perf_counter()
+    index = load()
+    elapsed = time.perf_counter() - started
+    print(json.dumps({"records": len(index), "seconds": elapsed, "rss_before": before, "rss_peak": peak_rss_mb()}))
+
+
+def run_child(method, path):
+    result = subprocess.run([sys.executable, __file__, "--child", method, path], capture_output=True, text=True)
+    if result.returncode != 0:
+        return None, result.stderr.strip().splitlines()[-1] if result.stderr else f"код {result.returncode}"
+    return json.loads(result.stdout), None
+
+
+def main(args):
+    os.makedirs(args.dir, exist_ok=True)
+    print(f"{'формат':8} {'способ':10} {'записей':>9} {'строк/с':>10} {'пик RSS':>10} {'прирост':>10}")
+    for extension in args.formats.split(","):
+        path = os.path.join(args.dir, f"drivers_{args.rows}.{extension}")
+        if not os.path.exists(path):
+            started = time.perf_counter()
+            try:
+                generate(path, args.rows)
+            except ImportError as e:
+                print(f"{extension:8} пропущен: {e}")
+                continue
+            print(f"{extension:8} сгенерирован {path} за {time.perf_counter() - started:.1f} с")
+        for method in args.methods.split(","):
+            result, error = run_child(method, path)
+            if error:
+                print(f"{extension:8} {method:10} ошибка: {error}")
+                continue
+            print(f"{extension:8} {method:10} {result['records']:>9} {args.rows / result['seconds']:>10.0f} "
+                  f"{result['rss_peak']:>7.0f} МБ {result['rss_peak'] - result['rss_before']:>7.0f} МБ")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--child":
+        child(sys.argv[2], sys.argv[3])
+        sys.exit(0)
+    parser = argparse.ArgumentParser(description="Скорость и память загрузки таблиц водителей по форматам")
+    parser.add_argument("--rows", type=int, default=1000000, help="строк в синтетической выгрузке")
+    parser.add_argument("--formats", default="csv,xlsx,parquet", help="форматы через запятую")
+    parser.add_argument("--methods", default="streaming,pandas", help="способы загрузки через запятую")
+    parser.add_argument("--dir", default="bench_data", help="каталог для сгенерированных файлов")
+    main(parser.parse_args())
@@ -0,0 +1,247 @@
+import argparse
+import asyncio
+import gc
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+# Нагрузочный тест: синтетические водители проходят сценарий /start -> выбор языка -> ввод ВУ номера
+# через настоящие обработчики bot3, Bot API заменён FakeTelegram с задержкой ответа и ответами 429.
+# Отчёт: пропускная способность, p50/p99 задержки по шагам, процессорное время на обновление и прирост памяти
+# в пересчёте на 10 тыс. пользователей. FakeTelegram работает в том же процессе и делит с ботом процессор,
+# поэтому пропускная способность — оценка снизу; для сравнения между версиями важны одинаковые параметры запуска.
+# В режиме cluster бот запускается отдельными процессами (cluster.py, --workers рабочих процессов),
+# процессорное время и RSS считаются по всему дереву процессов кластера.
+# --blip имитирует сетевой сбой: Bot API несколько секунд отвечает 502, в отчёт попадает время восстановления
+os.environ.setdefault("BOT_TOKEN", "1:fake")
+os.environ.setdefault("SESSION_STORE", "memory")
+os.environ.setdefault("OUTBOUND_GLOBAL_RATE", "100000")
+os.environ.setdefault("METRICS_PORT", "0")
+
+import bot3  # noqa: E402
+from fake_telegram import FakeTelegram  # noqa: E402
+from lifecycle import RECOVERY, poll_updates  # noqa: E402
+from vu_index import current_index  # noqa: E402
+from webhook import WebhookServer  # noqa: E402
+
+SECRET = "bench-secret"
+CHAT_BASE = 10_000_000
+STEPS = ("start", "language", "lookup")
+
+
+# Текущий RSS процесса в байтах (на Linux — из /proc, иначе пиковый RSS)
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# Ожидание ответов бота: шаг сценария завершается, когда в чат пришло нужное число сообщений
+class ReplyWaiter:
+    def __init__(self):
+        self._pending = {}  # chat_id -> [сколько ещё ждать, future]
+
+    def expect(self, chat_id, count):
+        future = asyncio.get_running_loop().create_future()
+        self._pending[chat_id] = [count, future]
+        return future
+
+    def on_send(self, chat_id, method, params, received):
+        entry = self._pending.get(chat_id)
+        if entry is None:
+            return
+        entry[0] -= 1
+        if entry[0] == 0:
+            del self._pending[chat_id]
+            if not entry[1].done():
+                entry[1].set_result(received)
+
+
+async def run_session(fake, waiter, chat_id, vu_number, language, latencies, timeout):
+    steps = (
+        (fake.message_update(chat_id, "/start"), 1),
+        (fake.callback_update(chat_id, language), 2),  # Подтверждение выбора и меню
+        (fake.message_update(chat_id, vu_number), 1),
+    )
+    for name, (update, replies) in zip(STEPS, steps):
+        future = waiter.expect(chat_id, replies)
+        started = time.monotonic()
+        await fake.push_update(update)
+        latencies[name].append(await asyncio.wait_for(future, timeout) - started)
+
+
+async def run_load(fake, waiter, args):
+    keys = list(current_index().entries) or ["NV000216"]
+    rng = random.Random(args.seed)
+    latencies = {name: [] for name in STEPS}
+    slots = asyncio.Semaphore(args.concurrency)
+    errors = 0
+
+    async def session(i):
+        nonlocal errors
+        vu_number = f"ZZ{i:06d}" if rng.random() < args.miss_ratio else rng.choice(keys)
+        language = rng.choice(("lang_russian", "lang_kazakh"))
+        async with slots:
+            try:
+                await run_session(fake, waiter, CHAT_BASE + i, vu_number, language, latencies, args.timeout)
+            except asyncio.TimeoutError:
+                errors += 1
+
+    started, cpu_started = time.monotonic(), time.process_time()
+    await asyncio.gather(*(session(i) for i in range(args.users)))
+    return latencies, errors, time.monotonic() - started, time.process_time() - cpu_started
+
+
+# Процессорное время (с) и RSS (байт) процесса и всех его потомков по /proc
+def process_tree_usage(pid):
+    ticks, page = os.sysconf("SC_CLK_TCK"), os.sysconf("SC_PAGE_SIZE")
+    cpu = rss = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/stat") as stat:
+                fields = stat.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{current}/task/{current}/children") as children:
+                pending.extend(int(child) for child in children.read().split())
+        except OSError:
+            continue
+        cpu += (int(fields[11]) + int(fields[12])) / ticks  # utime + stime
+        rss += int(fields[21]) * page
+    return cpu, rss
+
+
+# Кластер в отдельных процессах; рабочие данные (индекс, сессии, логи) — во временном каталоге
+def start_cluster(fake, workers):
+    directory = tempfile.mkdtemp(prefix="bench_cluster_")
+    env = {**os.environ, "BOT_API_URL": fake.base_url, "BOT_MODE": "polling", "CLUSTER_WORKERS": str(workers),
+           "CLUSTER_PORT": str(fake.port + 1), "PACKED_INDEX": os.path.join(directory, "coupons.idx"),
+           "SESSION_DB": os.path.join(directory, "sessions.db"), "LOG_FILE": os.path.join(directory, "bot.log")}
+    return subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "cluster.py")],
+                            env=env), directory
+
+
+async def start_application(fake, mode, workers=1):
+    if mode == "cluster":
+        return start_cluster(fake, workers)
+    application = bot3.build_application(base_url=fake.base_url)
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    if mode == "webhook":
+        server = WebhookServer(application, "/telegram", SECRET, max_pending=bot3.WEBHOOK_MAX_PENDING)
+        port = await server.start("127.0.0.1", 0)
+        await application.bot.set_webhook(f"http://127.0.0.1:{port}/telegram", secret_token=SECRET)
+        return application, server
+    # Polling так же, как в bot3.run_bot: свой цикл getUpdates с переподключением по Backoff
+    stopped = asyncio.Event()
+    return application, (stopped, asyncio.create_task(poll_updates(application, stopped)))
+
+
+# intake — каталог кластера, сервер вебхука или (событие остановки, задача polling)
+async def stop_application(application, intake):
+    if isinstance(application, subprocess.Popen):
+        application.terminate()
+        await asyncio.to_thread(application.wait)
+        print(f"журналы и данные кластера: {intake}")
+        return
+    if isinstance(intake, tuple):
+        stopped, poller = intake
+        stopped.set()
+        await poller
+    else:
+        await application.bot.delete_webhook()
+        await intake.stop()
+    await application.stop()
+    await application.post_stop(application)
+    await application.shutdown()
+
+
+def _percentile(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))] * 1000 if values else float("nan")
+
+
+def report(args, latencies, errors, elapsed, cpu, fake, rss_growth):
+    where = f"кластер из {args.workers} процессов" if args.mode == "cluster" else "бот и FakeTelegram вместе"
+    total = sum(len(values) for values in latencies.values())
+    print(f"режим {args.mode}: {args.users} пользователей, параллельно {args.concurrency}, задержка API "
+          f"{args.latency * 1000:.0f} мс, доля 429 {args.flood_rate:g} (получено {fake.flooded})")
+    print(f"время {elapsed:.2f} с, сессий/с {args.users / elapsed:.1f}, обновлений/с {total / elapsed:.1f}, "
+          f"не дождались ответа {errors}")
+    print(f"процессор {cpu:.2f} с, {cpu / total * 1000:.2f} мс на обновление ({where})")
+    everything = []
+    for name in STEPS:
+        values = sorted(latencies[name])
+        everything.extend(values)
+        print(f"  {name:9} p50={_percentile(values, 0.5):.2f} мс  p99={_percentile(values, 0.99):.2f} мс")
+    everything.sort()
+    print(f"  {'всего':9} p50={_percentile(everything, 0.5):.2f} мс  p99={_percentile(everything, 0.99):.2f} мс")
+    sessions = "" if args.mode == "cluster" else f" (сессий в памяти {len(bot3.session_store)})"
+    if args.blip:
+        recovery = f"{RECOVERY.sum / RECOVERY.count:.2f} с в среднем за {RECOVERY.count}" if RECOVERY.count else "нет данных"
+        if args.mode == "cluster":
+            recovery = "см. vu_bot_telegram_recovery_seconds рабочих процессов"
+        print(f"сбой {args.blip:g} с через {args.blip_at:g} с после начала (отклонено запросов {fake.failed}), "
+              f"восстановление связи: {recovery}")
+    print(f"память: +{rss_growth / 2 ** 20:.1f} МБ RSS, {rss_growth / args.users * 10000 / 2 ** 20:.1f} МБ на 10 тыс. "
+          f"пользователей{sessions}")
+
+
+# Кластер готов, когда каждый рабочий процесс ответил на /start своего чата
+async def warm_up_cluster(fake, waiter, args):
+    chats = [CHAT_BASE - args.workers + i for i in range(args.workers)]
+    futures = [waiter.expect(chat_id, 1) for chat_id in chats]
+    for chat_id in chats:
+        await fake.push_update(fake.message_update(chat_id, "/start"))
+    await asyncio.wait_for(asyncio.gather(*futures), 120)
+
+
+async def main(args):
+    waiter = ReplyWaiter()
+    fake = FakeTelegram(on_send=waiter.on_send, latency=args.latency, jitter=args.jitter, flood_rate=args.flood_rate,
+                        retry_after=args.retry_after, record_sent=False, seed=args.seed)
+    await fake.start()
+    application, intake = await start_application(fake, args.mode, args.workers)
+    if args.blip:
+        asyncio.get_running_loop().call_later(args.blip_at, fake.outage, args.blip)
+    try:
+        if args.mode == "cluster":
+            await warm_up_cluster(fake, waiter, args)
+            cpu_before, rss_before = process_tree_usage(application.pid)
+            latencies, errors, elapsed, _ = await run_load(fake, waiter, args)
+            cpu_after, rss_after = process_tree_usage(application.pid)
+            cpu, rss_growth = cpu_after - cpu_before, rss_after - rss_before
+        else:
+            gc.collect()
+            rss_before = rss_bytes()
+            latencies, errors, elapsed, cpu = await run_load(fake, waiter, args)
+            gc.collect()
+            rss_growth = rss_bytes() - rss_before
+    finally:
+        await stop_application(application, intake)
+        await fake.stop()
+    report(args, latencies, errors, elapsed, cpu, fake, rss_growth)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота на локальном FakeTelegram")
+    parser.add_argument("-u", "--users", type=int, default=2000, help="количество синтетических водителей")
+    parser.add_argument("-c", "--concurrency", type=int, default=200, help="сколько сессий идёт одновременно")
+    parser.add_argument("--mode", choices=("polling", "webhook", "cluster"), default="polling")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="рабочих процессов в режиме cluster")
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка ответа Bot API на отправку, с")
+    parser.add_argument("--jitter", type=float, default=0.02, help="случайная добавка к задержке, с")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="доля отправок с ответом 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429, с")
+    parser.add_argument("--miss-ratio", type=float, default=0.2, help="доля несуществующих ВУ номеров")
+    parser.add_argument("--timeout", type=float, default=30, help="сколько ждать ответа на шаг, с")
+    parser.add_argument("--blip", type=float, default=0, help="длительность имитации сетевого сбоя, с")
+    parser.add_argument("--blip-at", type=float, default=2, help="через сколько секунд после начала случится сбой")
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,71 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+
+# Замер ответа на ВУ номер: обычный путь handle_message (поиск в индексе, отбор идущих акций,
+# форматирование шаблонов) против кэша готовых ответов (reply_cache, один поиск по mmap).
+# Индекс — синтетическая выгрузка bench_ingest на --rows водителей в первой акции campaigns.json.
+# Пример: python bench_replies.py --rows 1000000 --lookups 200000
+os.environ.setdefault("BOT_TOKEN", "1:fake")
+os.environ.setdefault("SESSION_STORE", "memory")
+os.environ.setdefault("METRICS_PORT", "0")
+os.environ["REPLY_CACHE"] = ""  # Кэш собирается ниже, по синтетическому индексу
+
+import bot3  # noqa: E402
+from bench_ingest import HEADER, synthetic_rows  # noqa: E402
+from reply_cache import build_reply_cache  # noqa: E402
+from vu_index import CampaignIndex, VuIndex, current_index, publish_index  # noqa: E402
+
+
+# Обычный путь: то, что делает handle_message для найденного номера без кэша
+def uncached(key, language):
+    entries = bot3.find_data_by_vu(key)
+    return bot3.generate_message(entries, language) if entries else None
+
+
+def measure(function, keys, languages):
+    started = time.perf_counter()
+    for key, language in zip(keys, languages):
+        function(key, language)
+    return (time.perf_counter() - started) / len(keys)
+
+
+def main(args):
+    campaign = next(iter(bot3.campaigns))
+    started = time.perf_counter()
+    publish_index(CampaignIndex({campaign.id: VuIndex.from_rows(HEADER, synthetic_rows(args.rows), campaign.columns,
+                                                                campaign.vu_column, campaign.orders_per_coupon)}))
+    index = current_index()
+    print(f"индекс: {len(index)} ВУ номеров за {time.perf_counter() - started:.1f} с")
+
+    path = os.path.join(tempfile.mkdtemp(prefix="bench-replies-"), "replies.cache")
+    started = time.perf_counter()
+    cache = build_reply_cache(path, index, bot3.campaigns, bot3.templates)
+    cache.generation = index.generation
+    bot3.reply_cache = cache
+    print(f"кэш ответов: {len(cache)} ВУ номеров, {os.path.getsize(path) / 1024 / 1024:.0f} МБ, "
+          f"сборка {time.perf_counter() - started:.1f} с")
+
+    rng = random.Random(1)
+    keys = rng.choices(list(index.entries), k=args.lookups)
+    languages = rng.choices(bot3.templates.languages, k=args.lookups)
+    for key, language in zip(keys[:1000], languages[:1000]):
+        if bot3.cached_reply(key, language) != uncached(key, language):
+            raise SystemExit(f"Ответ из кэша для {key} ({language}) не совпадает с обычным путём")
+
+    cache.prefetch()
+    measure(uncached, keys[:1000], languages[:1000])
+    plain = measure(uncached, keys, languages)
+    cached = measure(bot3.cached_reply, keys, languages)
+    print(f"обычный путь: {plain * 1e6:.2f} мкс на ответ")
+    print(f"кэш ответов:  {cached * 1e6:.2f} мкс на ответ, быстрее в {plain / cached:.1f} раза")
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Скорость ответа: кэш готовых ответов против сборки при запросе")
+    parser.add_argument("--rows", type=int, default=200000, help="водителей в синтетической выгрузке")
+    parser.add_argument("--lookups", type=int, default=100000, help="запросов в замере")
+    main(parser.parse_args())
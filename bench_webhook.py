@@ -0,0 +1,88 @@
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+# Замер задержки доставки обновлений: long polling против вебхука на локальном FakeTelegram.
+# Бот работает с настоящими обработчиками bot3, задержка — от отправки обновления до получения ответа
+os.environ.setdefault("BOT_TOKEN", "1:fake")
+os.environ.setdefault("SESSION_STORE", "memory")
+os.environ.setdefault("OUTBOUND_GLOBAL_RATE", "100000")
+os.environ.setdefault("METRICS_PORT", "0")
+
+import bot3  # noqa: E402
+from fake_telegram import FakeTelegram  # noqa: E402
+from webhook import WebhookServer  # noqa: E402
+
+SECRET = "bench-secret"
+
+
+async def _measure(fake, count, chat_base):
+    replies = {}
+    fake.on_send = lambda chat_id, method, params, received: replies[chat_id].set_result(received)
+    latencies = []
+    for i in range(count):
+        chat_id = chat_base + i
+        replies[chat_id] = asyncio.get_running_loop().create_future()
+        started = time.monotonic()
+        await fake.push_update(fake.message_update(chat_id, "NV000216"))
+        latencies.append(await asyncio.wait_for(replies[chat_id], 10) - started)
+    return latencies
+
+
+async def bench_polling(fake, count):
+    application = bot3.build_application(base_url=fake.base_url)
+    await application.initialize()
+    await application.post_init(application)
+    await application.updater.start_polling(poll_interval=0, timeout=10)
+    await application.start()
+    try:
+        return await _measure(fake, count, 1_000_000)
+    finally:
+        await application.updater.stop()
+        await application.stop()
+        await application.post_stop(application)
+        await application.shutdown()
+
+
+async def bench_webhook(fake, count):
+    application = bot3.build_application(base_url=fake.base_url)
+    server = WebhookServer(application, "/telegram", SECRET)
+    await application.initialize()
+    await application.post_init(application)
+    port = await server.start("127.0.0.1", 0)
+    await application.start()
+    await application.bot.set_webhook(f"http://127.0.0.1:{port}/telegram", secret_token=SECRET)
+    try:
+        return await _measure(fake, count, 2_000_000)
+    finally:
+        await application.bot.delete_webhook()
+        await server.stop()
+        await application.stop()
+        await application.post_stop(application)
+        await application.shutdown()
+
+
+def _report(name, latencies):
+    latencies = sorted(latencies)
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(f"{name:8} n={len(latencies)}  mean={statistics.mean(latencies) * 1000:.2f} мс  "
+          f"p50={p50:.2f} мс  p99={p99:.2f} мс")
+
+
+async def main(count):
+    fake = FakeTelegram()
+    await fake.start()
+    try:
+        _report("polling", await bench_polling(fake, count))
+        _report("webhook", await bench_webhook(fake, count))
+    finally:
+        await fake.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сравнение задержки polling и вебхука")
+    parser.add_argument("-n", "--count", type=int, default=200, help="количество обновлений")
+    asyncio.run(main(parser.parse_args().count))
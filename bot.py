@@ -1,16 +1,16 @@
-import pandas as pd
-import re
 import asyncio  # Для отслеживания времени
 from datetime import datetime, timedelta
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
+from vu_index import VU_PATTERN, current_index, normalize_vu, publish_index
+from snapshot import load_index
 
-# Загрузка данных из Excel
+# Загрузка данных из Excel (через бинарный снимок, если он актуален)
 try:
-    data = pd.read_excel("result_with_ids.xlsx")
+    publish_index(load_index("result_with_ids.xlsx"))
 except FileNotFoundError:
     print("Ошибка: Файл result_with_ids.xlsx не найден. Убедитесь, что он находится в той же папке, что и код.")
-    data = pd.DataFrame()  # Заглушка, чтобы бот продолжал работать
+    # Индекс остаётся пустым, чтобы бот продолжал работать
 
 # Переменные для хранения языка пользователя
 user_languages = {}  # Словарь для хранения языка пользователей (по chat_id)
@@ -38,17 +38,16 @@ messages = {
     }
 }
 
-# Функция для поиска данных по ВУ номеру
+# Функция для поиска данных по ВУ номеру (принимает нормализованный ключ)
 def find_data_by_vu(vu_number):
-    user_data = data[data["ВУ номер"] == vu_number]
-    if not user_data.empty:
-        result = user_data.to_dict(orient="records")[0]
+    record = current_index().get_normalized(vu_number)
+    if record is not None:
         return {
-            "Имя": result['Имя'],
-            "Город": result['Город'],
-            "Количество заказов": result['Количество заказов'],
-            "Количество купонов": result['Количество купонов'],
-            "Номера купонов": result['Номер купона'],
+            "Имя": record.name,
+            "Город": record.city,
+            "Количество заказов": record.orders,
+            "Количество купонов": record.coupons,
+            "Номера купонов": record.coupon_numbers,
         }
     else:
         return None
@@ -170,11 +169,10 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     language = user_languages.get(chat_id, "ru")  # По умолчанию русский язык
     user_message = update.message.text.strip()
 
-    # Проверка формата ВУ (содержит буквы и цифры)
-    vu_pattern = re.compile(r'^(?=.*[A-Za-z])(?=.*\d).+$')
+    vu_key = normalize_vu(user_message)
 
-    if vu_pattern.match(user_message):  # Если формат сообщения соответствует номеру ВУ
-        user_data = find_data_by_vu(user_message)
+    if VU_PATTERN.match(vu_key):  # Если формат сообщения соответствует номеру ВУ
+        user_data = find_data_by_vu(vu_key)
         if user_data:
             response = generate_message(user_data, language)
             await update.message.reply_text(response)
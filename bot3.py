@@ -1,210 +1,354 @@
-import pandas as pd
-import re
+import math
+import time
+import datetime
 import asyncio
-from datetime import datetime, timedelta
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
+import atexit
+import threading
+from telegram import Bot, Update
+from telegram.ext import Application, ApplicationHandlerStop, CommandHandler, CallbackQueryHandler, MessageHandler, TypeHandler, filters, ContextTypes
+from vu_index import VU_PATTERN, CampaignEntry, DriverRecord, current_index, normalize_vu, publish_index
+from config import (BOT_API_URL, CAMPAIGNS_FILE, TEMPLATES_FILE, WEBHOOK_LISTEN, WEBHOOK_MAX_PENDING, WEBHOOK_PORT,
+                    WEBHOOK_SECRET, WEBHOOK_URL, campaigns, load_campaign_index, templates,
+                    webhook_ssl_context)
+from reloader import stop_watching, watch_campaign_files
+from session_store import create_session_store
+from inactivity import InactivityScheduler
+from outbound import LANES, PRIORITY_NUDGE, OutboundDispatcher
+from broadcast import Broadcast, load_checkpoint
+from webhook import HttpServer, WebhookServer
+from update_processor import ChatOrderedUpdateProcessor, worker_for
+from packed_index import PackedIndex, reopen_if_stale
+from reply_cache import ReplyCache, active_until, build_reply_cache, open_reply_cache, render_found, source_files
+from metrics import handler_latency, registry, timed
+from ratelimit import RateLimiter
+from probe_guard import ProbeGuard
 import os
+import signal
+from urllib.parse import urlsplit
 from dotenv import load_dotenv
 import logging
-from logging.handlers import RotatingFileHandler
-from telegram.error import NetworkError, RetryAfter, TimedOut
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
+from log_pipeline import setup_logging
+from lifecycle import RECOVERY, Backoff, ConnectionMonitor, MonitoredRequest, call_with_retry, poll_updates
 
-# Настройка логирования
-handler = RotatingFileHandler("bot.log", maxBytes=5000000, backupCount=3)  # 5 MB на лог-файл, сохраняется 3 копии
-logging.basicConfig(level=logging.INFO, handlers=[handler],
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+# Загрузка переменных окружения
+load_dotenv()
+BOT_TOKEN = os.getenv('BOT_TOKEN')
+
+# Настройка логирования: JSON-строки в UTF-8 через очередь, запись в файл в отдельном потоке
+log_handler = setup_logging(secrets=[BOT_TOKEN])
+
+ADMIN_ID = 8025906752  # Укажите Telegram ID администратора
 
 # Уведомление администратора
-async def notify_admin(context: ContextTypes.DEFAULT_TYPE, message: str) -> None:
-    admin_id = 8025906752  # Укажите Telegram ID администратора
+async def notify_admin(bot: Bot, message: str) -> None:
     try:
-        await context.bot.send_message(chat_id=admin_id, text=message)
+        await bot.send_message(chat_id=ADMIN_ID, text=message)
     except Exception as e:
         logging.error(f"Не удалось отправить сообщение администратору: {e}")
 
-# Загрузка переменных окружения
-load_dotenv()
-BOT_TOKEN = os.getenv('BOT_TOKEN')
-
 if not BOT_TOKEN:
     logging.critical("Токен бота не найден! Проверьте файл .env.")
     exit(1)
 
-# Загрузка данных из Excel
-try:
-    data = pd.read_excel("result_with_ids.xlsx")
-    logging.info("Данные успешно загружены из файла result_with_ids.xlsx")
-except FileNotFoundError:
-    logging.error("Файл result_with_ids.xlsx не найден. Бот продолжит работать с пустой базой данных.")
-    data = pd.DataFrame()
-
-# Переменные для хранения информации о пользователях
-user_languages = {}
-user_last_activity = {}
-user_requests = {}
-
-# Функция для поиска данных по ВУ номеру
-def find_data_by_vu(vu_number):
+# Режим получения обновлений: polling (по умолчанию) или webhook (параметры вебхука — в config.py)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+
+if BOT_MODE == "webhook" and not WEBHOOK_URL:
+    logging.critical("Для режима webhook нужен WEBHOOK_URL. Проверьте файл .env.")
+    exit(1)
+
+# Режим worker: процесс кластера (см. cluster.py) получает обновления своих чатов от ingress
+# на 127.0.0.1:WORKER_PORT и читает индекс из упакованного файла PACKED_INDEX
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", 0))
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", 1))
+WORKER_PORT = int(os.getenv("WORKER_PORT", 8600))
+WORKER_SECRET = os.getenv("WORKER_SECRET", "")
+PACKED_INDEX = os.getenv("PACKED_INDEX")
+
+if BOT_MODE == "worker" and not (PACKED_INDEX and WORKER_SECRET):
+    logging.critical("Режим worker запускается из cluster.py: нужны PACKED_INDEX и WORKER_SECRET.")
+    exit(1)
+
+# Чаты этого процесса (вне кластера — все)
+def owns_chat(chat_id):
+    return worker_for(chat_id, WORKER_COUNT) == WORKER_INDEX
+
+# Общий индекс: таблицы всех акций реестра (config.load_campaign_index) или упакованный файл в кластере
+if BOT_MODE == "worker":
+    publish_index(PackedIndex(PACKED_INDEX))
+else:
+    load_campaign_index()
+
+# Хранилище информации о пользователях (язык, последняя активность);
+# процесс кластера поднимает в память только свои чаты, остальные читаются с диска по запросу
+session_store = create_session_store(owns=owns_chat)
+atexit.register(session_store.close)
+
+# Лимиты Telegram на исходящие сообщения: всего в секунду и в секунду на один чат
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", 30))
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", 1))
+# Одновременных запросов к Telegram: при задержке API L секунд отправка ограничена OUTBOUND_WORKERS / L в секунду
+OUTBOUND_WORKERS = int(os.getenv("OUTBOUND_WORKERS", 8))
+
+# Сколько обновлений из разных чатов обрабатывается одновременно (внутри чата — строго по порядку)
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", 16))
+
+# Сколько секунд при остановке ждать отправки уже поставленных в очередь сообщений
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", 10))
+
+# Через сколько секунд бездействия пользователю отправляется напоминание
+INACTIVITY_TIMEOUT = 15 * 60
+
+# Локальная страница метрик в формате Prometheus (0 — не запускать)
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9108))
+
+# Метрики горячего пути: запись — несколько операций со словарём, без блокировок
+LOOKUPS = registry.counter("vu_bot_lookups_total", "Поиск по ВУ номеру по языку и результату", ("language", "result"))
+LOOKUP_DURATION = registry.histogram("vu_bot_lookup_duration_seconds", "Время поиска по индексу ВУ номеров",
+                                     buckets=(1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 1e-3)).labels()
+NUDGES = registry.counter("vu_bot_inactivity_nudges_total", "Отправленные напоминания о неактивности")
+
+# Лимиты запросов от одного чата: (количество, период в секундах, допустимый всплеск)
+rate_limiter = RateLimiter({
+    "lookup": (10, 60, 5),  # Поиск по ВУ номеру
+    "callback": (30, 60, 10),  # Нажатия кнопок
+    "unknown": (10, 60, 5),  # Текст, который не похож на ВУ номер
+    "command": (10, 60, 5),  # /start и другие команды
+})
+
+# Защита от перебора ВУ номеров
+probe_guard = ProbeGuard()
+
+# Время восстановления связи с Bot API после сетевых сбоев (метрики vu_bot_telegram_*)
+connection_monitor = ConnectionMonitor()
+
+# Кнопки выбора языка (тексты и клавиатуры — config.templates)
+LANGUAGE_CALLBACKS = {"lang_russian": "ru", "lang_kazakh": "kz"}
+
+# Кэш готовых ответов (reply_cache.py): путь к файлу, пусто — ответ собирается при каждом запросе.
+# Собирается при запуске (или берётся собранный заранее python reply_cache.py), после каждой перезагрузки
+# таблицы и при смене набора идущих акций; в кластере его собирает ingress
+REPLY_CACHE = os.getenv("REPLY_CACHE")
+reply_cache = None
+_reply_cache_lock = threading.Lock()
+
+# Пересборка кэша по текущему общему индексу; reuse — сначала попробовать открыть уже собранный файл.
+# Пока кэш не собран по текущему поколению индекса, ответы собираются обычным путём
+def rebuild_reply_cache(_published=None, reuse=False):
+    global reply_cache
+    with _reply_cache_lock:
+        index = current_index()
+        build = open_reply_cache if reuse else build_reply_cache
+        try:
+            cache = build(REPLY_CACHE, index, campaigns, templates, source_files(campaigns, CAMPAIGNS_FILE, TEMPLATES_FILE))
+        except Exception as e:
+            logging.error(f"Не удалось собрать кэш ответов {REPLY_CACHE}: {e}")
+            return
+        cache.generation = index.generation
+        reply_cache = cache
+
+# После перезагрузки таблицы акции: готовые ответы собираются заново
+def on_index_published(published):
+    reset_not_found_replies()
+    if REPLY_CACHE:
+        rebuild_reply_cache(published)
+
+# Процесс кластера открывает кэш, собранный ingress; кэш используется, только если собран
+# по тому же файлу упакованного индекса, что открыт сейчас
+def attach_reply_cache():
+    global reply_cache
+    if reply_cache is None:
+        try:
+            cache = ReplyCache(REPLY_CACHE)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logging.error(f"Не удалось открыть кэш ответов {REPLY_CACHE}: {e}")
+            return
+    else:
+        cache = reopen_if_stale(reply_cache) or reply_cache
+    index = current_index()
+    if cache.meta.get("index") == list(index.signature):
+        cache.generation = index.generation
+    reply_cache = cache
+
+if REPLY_CACHE:
+    if BOT_MODE == "worker":
+        attach_reply_cache()
+    else:
+        rebuild_reply_cache(reuse=True)
+
+# Функция для поиска данных по ВУ номеру (принимает нормализованный ключ): записи водителя
+# во всех идущих сейчас акциях или пустой кортеж.
+# Промахи учитываются для защиты от перебора; недавний промах по тому же номеру (в том же поколении
+# индекса) не ищется и не логируется заново
+def find_data_by_vu(vu_number, chat_id=None):
+    started = time.perf_counter()
     try:
-        user_data = data[data["ВУ номер"] == vu_number]
-        if not user_data.empty:
-            result = user_data.to_dict(orient="records")[0]
-            return {
-                "Имя": result['Имя'],
-                "Город": result['Город'],
-                "Количество заказов": result['Количество заказов'],
-                "Количество купонов": result['Количество купонов'],
-                "Номера купонов": result['Номер купона'],
-            }
-        else:
+        index = current_index()
+        known_miss = probe_guard.is_known_miss(vu_number, index.generation)
+        entries = () if known_miss else index.lookup(vu_number)
+        if entries:
+            today = datetime.date.today()
+            entries = tuple(entry for entry in entries if campaigns[entry.campaign_id].is_active(today))
+        if entries:
+            return entries
+        if not known_miss:
             logging.warning(f"Данные для ВУ номера {vu_number} не найдены.")
-            return None
+        if chat_id is not None and probe_guard.record_miss(chat_id, vu_number, index.generation):
+            report_probing(chat_id)
+        return ()
     except Exception as e:
         logging.error(f"Ошибка при поиске данных по ВУ: {e}")
+        return ()
+    finally:
+        LOOKUP_DURATION.observe(time.perf_counter() - started)
+
+# Готовый ответ из кэша (один поиск по mmap) или None, если кэша нет, он собран по другому поколению
+# индекса или набор идущих акций уже сменился — тогда ответ собирается обычным путём
+def cached_reply(vu_number, language):
+    cache = reply_cache
+    if cache is None or cache.generation != current_index().generation or not cache.is_current():
         return None
+    started = time.perf_counter()
+    try:
+        return cache.reply(vu_number, language)
+    except Exception as e:
+        logging.error(f"Ошибка при чтении кэша ответов: {e}")
+        return None
+    finally:
+        LOOKUP_DURATION.observe(time.perf_counter() - started)
 
-# Лимит запросов от пользователей
-def is_request_allowed(user_id):
-    current_time = datetime.now()
-    if user_id not in user_requests:
-        user_requests[user_id] = current_time
-        return True
-    elif (current_time - user_requests[user_id]).seconds > 60:  # Лимит: 1 запрос в минуту
-        user_requests[user_id] = current_time
-        return True
-    return False
-
-# Генерация персонального сообщения для найденного ВУ с учётом языка
-def generate_message(user_data, language):
+# Уведомление администратора о чате, который перебирает ВУ номера
+def report_probing(chat_id):
+    logging.warning(f"Чат {chat_id} заблокирован на {probe_guard.block_for} с за перебор ВУ номеров.")
+    if dispatcher is not None:
+        dispatcher.send_message(
+            ADMIN_ID,
+            f"Похоже на перебор ВУ номеров: чат {chat_id} ввёл больше {probe_guard.max_distinct_misses} "
+            f"разных несуществующих номеров за {probe_guard.window // 60} мин и заблокирован на {probe_guard.block_for // 60} мин.",
+            priority=PRIORITY_NUDGE
+        )
+
+# Вид запроса для ограничения частоты: определяется до любой работы с базой и шаблонами
+def classify_update(update: Update) -> str:
+    if update.callback_query is not None:
+        return "callback"
+    text = update.message.text if update.message is not None else None
+    if not text:
+        return "other"
+    if text.startswith("/"):
+        return "command"
+    if VU_PATTERN.match(normalize_vu(text)):
+        return "lookup"
+    return "unknown"
+
+# Отбрасывание запросов сверх лимита: выполняется раньше всех обработчиков (группа -1).
+# Сессия принятого обновления заранее поднимается с диска вне цикла событий,
+# поэтому обработчики работают только с памятью
+async def shed_over_limit(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    chat = update.effective_chat
+    if chat is None:
+        return
+    if not rate_limiter.allow(classify_update(update), chat.id):
+        raise ApplicationHandlerStop
+    await session_store.preload(chat.id)
+
+# Генерация персонального сообщения для найденного ВУ с учётом языка: по разделу на каждую акцию
+def generate_message(entries, language):
     try:
-        if language == "ru":
-            return (f"Здравствуйте, уважаемый {user_data['Имя']}!🤝\n\n"
-                    f"🕋 Мы проводим розыгрыш путёвки в УМРУ!\n"
-                    f"🏆 Для участия в розыгрыше необходимо выполнять заказы.\n"
-                    f"🎟 За каждые 100 выполненных заказов = 1 купон.\n\n"
-                    f"📅 Заказы нужно было выполнять в следующие периоды:\n"
-                    f"21.02.2025 - 28.02.2025\n"
-                    f"01.03.2025 - 07.03.2025\n\n"
-                    f"У вас выполнено {user_data['Количество заказов']} заказов, поэтому у вас есть {user_data['Количество купонов']} купонов.\n"
-                    f"Номера ваших купонов: {user_data['Номера купонов']}.\n\n"                
-                    f"Если у вас есть вопросы или нужна помощь, свяжитесь с нами:\n"
-                    f"📞 +7 777 777 65 00\n\n"
-                    f"С уважением, таксопарк \"Автопартнёр\"!")
-        elif language == "kz":
-            return (f"Сәлеметсіз бе, Құрметті {user_data['Имя']}!🤝\n\n"
-                    f"🕋 Біз УМРАҒА жолдама ұтыс ойынын өткіземіз!\n"
-                    f"🏆 Ұтысқа қатысу үшін тапсырыстар орындау қажет.\n"
-                    f"🎟 Әрбір 100 орындалған тапсырысқа = 1 купон.\n\n"
-                    f"📅 Мына кезеңдерде тапсырыстарды орындау қажет болды:\n"
-                    f"21.02.2025 - 28.02.2025\n"
-                    f"01.03.2025 - 07.03.2025\n\n"
-                    f"Сізде {user_data['Количество заказов']} тапсырыс орындалғандықтан, сізде {user_data['Количество купонов']} купон бар.\n"
-                    f"Сіздің купон сандарыңыз: {user_data['Номера купонов']}.\n\n"                    
-                    f"Егер сұрақтарыңыз болса немесе көмек қажет болса, бізге хабарласыңыз:\n"
-                    f"📞 +7 777 777 65 00\n\n"
-                    f"Құрметпен, \"Автопартнер\" таксопаркі!")
+        return render_found(entries, language, campaigns, templates)
     except Exception as e:
         logging.error(f"Ошибка при генерации сообщения: {e}")
         return None
 
-# Функция для второго сообщения (когда ВУ номер не найден)
+# Ответ «не найден» зависит только от языка и набора идущих акций, поэтому собирается один раз
+# на язык и хранится до смены набора (начало или конец акции) или до перезагрузки таблицы:
+# промахи, в том числе при переборе номеров, его не собирают. (время Unix окончания, язык -> текст)
+_not_found_replies = (0.0, {})
+
+def reset_not_found_replies():
+    global _not_found_replies
+    _not_found_replies = (0.0, {})
+
+# Функция для второго сообщения (когда ВУ номер не найден): условия всех идущих сейчас акций
 def generate_not_found_message(language):
-    if language == "ru":
-        return ("Здравствуйте, уважаемый водитель!🤝\n\n"
-                "Вашего ВУ номера нет в нашей базе. Это означает, что вы ещё не выполнили 100 заказов.\n\n"
-                "🕋 Мы проводим розыгрыш путёвки в УМРУ!\n"
-                "🏆 За каждые 100 выполненных заказов = 1 купон.\n\n"
-                "📅 Заказы нужно было выполнять в следующие периоды:\n"
-                "21.02.2025 - 28.02.2025\n"
-                "01.03.2025 - 07.03.2025\n\n"
-                "Ещё есть время! Выполняйте заказы, и мы добавим вас в список участников! 💪\n\n"
-                "Если у вас есть вопросы или нужна помощь, свяжитесь с нами:\n"
-                "📞 +7 777 777 65 00 (WhatsApp)\n\n"
-                "С уважением, таксопарк \"Автопартнёр\"!")
-    elif language == "kz":
-        return ("Сәлеметсіз бе, Құрметті жүргізуші!🤝\n\n"
-                "Сіздің ВУ нөміріңіз қазіргі уақытта біздің базада жоқ. Бұл сіз әлі 100 тапсырысты орындамағаныңызды білдіреді.\n\n"
-                "🕋 Біз УМРАҒА жолдама ұтыс ойынын өткіземіз!\n"
-                "🏆 Ұтысқа қатысу үшін әрбір 100 орындалған тапсырыстан 1 купон беріледі.\n\n"
-                "📅 Мына кезеңдерде тапсырыстарды орындау қажет болды:\n"
-                "21.02.2025 - 28.02.2025\n"
-                "01.03.2025 - 07.03.2025\n\n"
-                "Әлі де уақыт бар! Тапсырыстарыңызды орындаңыз және біз сіздің атыңызды тізімге қосуды күтеміз! 💪\n\n"
-                "Егер сұрақтарыңыз болса немесе көмек қажет болса, бізге хабарласыңыз:\n"
-                "📞 +7 777 777 65 00 (WhatsApp)\n\n"
-                "Құрметпен, \"Автопартнер\" таксопаркі!")
+    global _not_found_replies
+    expires, replies = _not_found_replies
+    if time.time() >= expires:
+        today = datetime.date.today()
+        until = active_until(campaigns, today)
+        expires = time.mktime((until + datetime.timedelta(days=1)).timetuple()) if until else math.inf
+        replies = {}
+        _not_found_replies = (expires, replies)
+    reply = replies.get(language)
+    if reply is None:
+        sections = [campaign.not_found(language) for campaign in campaigns.active()] or [templates.text("no_campaigns", language)]
+        reply = "\n\n".join([templates.text("not_found_header", language), *sections, templates.text("not_found_footer", language)])
+        replies[language] = reply
+    return reply
+
 # Обработка команды /start
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    keyboard = [
-        [InlineKeyboardButton("🇷🇺 Русский", callback_data="lang_russian")],
-        [InlineKeyboardButton("🇰🇿 Қазақша", callback_data="lang_kazakh")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text("Выберите язык / Тілді таңдаңыз:", reply_markup=reply_markup)
+    session_store.register(update.message.chat_id)  # Запоминаем чат для рассылок
+    await dispatcher.send_message(
+        update.message.chat_id,
+        templates.text("choose_language", "ru"),
+        reply_markup=templates.keyboard("choose_language", "ru")
+    )
 
 # Установка языка
 async def set_language(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     chat_id = query.message.chat_id
+    language = LANGUAGE_CALLBACKS.get(query.data)
+    if language is None:
+        return
 
-    if query.data == "lang_russian":
-        user_languages[chat_id] = "ru"
-        await query.edit_message_text("Вы выбрали русский язык.")
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text="Сәлеметсіз бе! Выберите опцию ниже:",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("Узнать о купонах", callback_data="check_coupons")],
-                [InlineKeyboardButton("Наш WhatsApp", url="https://wa.me/77777776500")],
-                [InlineKeyboardButton("Помощь", callback_data="help")]
-            ])
-        )
-    elif query.data == "lang_kazakh":
-        user_languages[chat_id] = "kz"
-        await query.edit_message_text("Сіз қазақ тілін таңдадыңыз.")
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text="Сәлеметсіз бе! Опцияны таңдаңыз:",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("Купондарды білу", callback_data="check_coupons")],
-                [InlineKeyboardButton("Біздің WhatsApp", url="https://wa.me/77777776500")],
-                [InlineKeyboardButton("Көмек", callback_data="help")]
-            ])
-        )
+    session_store.set_language(chat_id, language)
+    await dispatcher.submit(chat_id, query.edit_message_text, templates.text("language_selected", language))
+    await dispatcher.send_message(
+        chat_id,
+        templates.text("menu", language),
+        reply_markup=templates.keyboard("menu", language)
+    )
 
 # Обработка текстовых сообщений
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     try:
         chat_id = update.message.chat_id
-        user_last_activity[chat_id] = datetime.now()  # Обновляем время активности
-        language = user_languages.get(chat_id, "ru")  # По умолчанию русский язык
+        session_store.touch(chat_id)  # Обновляем время активности
+        inactivity_scheduler.touch(chat_id)
+        language = session_store.get_language(chat_id, "ru")  # По умолчанию русский язык
         user_message = update.message.text.strip()
 
-        # Проверка формата ВУ (содержит буквы и цифры)
-        vu_pattern = re.compile(r'^(?=.*[A-Za-z])(?=.*\d).+$')
+        vu_key = normalize_vu(user_message)
 
-        if vu_pattern.match(user_message):  # Если формат сообщения соответствует номеру ВУ
-            user_data = find_data_by_vu(user_message)
+        if VU_PATTERN.match(vu_key):  # Если формат сообщения соответствует номеру ВУ
+            if probe_guard.is_blocked(chat_id):
+                LOOKUPS.inc(language, "blocked")
+                await dispatcher.send_message(chat_id, templates.text("too_many_attempts", language))
+                return
+            response = cached_reply(vu_key, language)
+            if response is not None:
+                LOOKUPS.inc(language, "hit")
+                await dispatcher.send_message(chat_id, response)
+                return
+            user_data = find_data_by_vu(vu_key, chat_id)
+            LOOKUPS.inc(language, "hit" if user_data else "miss")
             if user_data:
                 response = generate_message(user_data, language)
-                await update.message.reply_text(response)
+                await dispatcher.send_message(chat_id, response)
             else:
                 response = generate_not_found_message(language)
-                await update.message.reply_text(response)
+                await dispatcher.send_message(chat_id, response)
         else:
             # Сообщение для текста, который не является номером ВУ
-            keyboard = [
-                [InlineKeyboardButton("Узнать о купонах", callback_data="check_coupons")],
-                [InlineKeyboardButton("Наш WhatsApp", url="https://wa.me/77777776500")],
-                [InlineKeyboardButton("Помощь", callback_data="help")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await update.message.reply_text(
-                "Извините, я не совсем понимаю ваш запрос. Попробуйте использовать кнопки ниже или введите ваш ВУ номер.",
-                reply_markup=reply_markup
+            await dispatcher.send_message(
+                chat_id,
+                templates.text("unknown_request", language),
+                reply_markup=templates.keyboard("menu", language)
             )
     except Exception as e:
         logging.error(f"Ошибка в handle_message: {e}")
@@ -213,92 +357,321 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     try:
         query = update.callback_query
         chat_id = query.message.chat_id
-        language = user_languages.get(chat_id, "ru")  # По умолчанию русский язык
+        language = session_store.get_language(chat_id, "ru")  # По умолчанию русский язык
 
         if query.data == "check_coupons":
-            await query.message.reply_text("Введите ваш ВУ номер, чтобы узнать информацию о купонах.")
+            await dispatcher.send_message(chat_id, templates.text("enter_vu", language))
         elif query.data == "help":
-            await query.message.reply_text("Если у вас есть вопросы или нужна помощь, напишите нам на WhatsApp: 📞 +7 777 777 65 00.")
+            await dispatcher.send_message(chat_id, templates.text("help", language))
     except Exception as e:
         logging.error(f"Ошибка в button_callback: {e}")
 
-# Проверка времени активности пользователей
-async def check_user_activity(context: ContextTypes.DEFAULT_TYPE) -> None:
+# Рассылка всем водителям, которые когда-либо писали боту: /broadcast <текст> (только администратор)
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if update.effective_user is None or update.effective_user.id != ADMIN_ID:
+        return
+    parts = update.message.text.split(maxsplit=1)
+    if len(parts) < 2:
+        await dispatcher.send_message(update.message.chat_id, "Использование: /broadcast <текст сообщения>")
+        return
+    if any(task.get_name() == "broadcast" and not task.done() for task in background_tasks):
+        await dispatcher.send_message(update.message.chat_id, "Рассылка уже идёт, дождитесь её завершения.")
+        return
+    broadcast = Broadcast(session_store, dispatcher)
+    start_broadcast(context.application, broadcast, broadcast.new_state(parts[1]))
+    await dispatcher.send_message(update.message.chat_id, "Рассылка запущена. Отчёт придёт по завершении.")
+
+def start_broadcast(application: Application, broadcast: Broadcast, state: dict) -> None:
+    async def run():
+        try:
+            report = await broadcast.run(state)
+            await notify_admin(application.bot, f"Рассылка завершена: отправлено {report['sent']}, ошибок {report['failed']}, "
+                                            f"{report['elapsed']:.0f} с, {report['rate']:.1f} сообщений/с.")
+        except asyncio.CancelledError:
+            logging.warning("Рассылка прервана, она продолжится после перезапуска.")
+            raise
+        except Exception as e:
+            logging.error(f"Ошибка при рассылке: {e}")
+            await notify_admin(application.bot, f"Ошибка при рассылке: {e}. Она продолжится после перезапуска.")
+
+    task = asyncio.create_task(run(), name="broadcast")
+    task.add_done_callback(background_tasks.remove)
+    background_tasks.append(task)
+
+dispatcher = None  # Очередь исходящих сообщений, создаётся при запуске приложения
+background_tasks = []
+
+# Напоминание о неактивности: вызывается планировщиком в момент истечения дедлайна пользователя,
+# само сообщение уходит через очередь исходящих с низким приоритетом и не ожидается
+def nudge_inactive_user(chat_id):
+    session_store.clear_activity(chat_id)  # Больше не напоминаем до следующей активности
+    if dispatcher is None:
+        return
+    language = session_store.get_language(chat_id, "ru")
+    NUDGES.inc()
+    dispatcher.send_message(
+        chat_id,
+        templates.text("inactive", language),
+        priority=PRIORITY_NUDGE,
+        reply_markup=templates.keyboard("restart", language)
+    )
+
+inactivity_scheduler = InactivityScheduler(INACTIVITY_TIMEOUT, nudge_inactive_user)
+
+update_processor = None  # Обработчик обновлений работающего приложения (для метрик)
+metrics_server = None
+
+# Метрики, которые считываются только при запросе /metrics
+def _lanes(attribute):
+    if dispatcher is None:
+        return {}
+    return {LANES[priority]: value for priority, value in getattr(dispatcher, attribute).items()}
+
+registry.gauge("vu_bot_outbound_queue_depth", "Запросы в очереди исходящих", lambda: _lanes("depth"), ("lane",))
+registry.register("vu_bot_send_duration_seconds", "histogram", "Время от постановки ответа в очередь до ответа Telegram",
+                  ("lane",), lambda: _lanes("latency"))
+registry.register("vu_bot_sent_total", "counter", "Успешно отправленные запросы к Telegram", ("lane",),
+                  lambda: _lanes("sent"))
+registry.register("vu_bot_send_failed_total", "counter", "Запросы к Telegram, завершившиеся ошибкой", ("lane",),
+                  lambda: _lanes("failed"))
+registry.gauge("vu_bot_updates_in_progress", "Чаты, обновления которых ждут или обрабатываются",
+               lambda: len(update_processor) if update_processor else 0)
+registry.gauge("vu_bot_sessions", "Сессии в памяти", lambda: len(session_store))
+registry.gauge("vu_bot_inactivity_pending", "Пользователи, ожидающие напоминания", lambda: len(inactivity_scheduler))
+registry.gauge("vu_bot_index_records", "Записи в индексе ВУ номеров", lambda: len(current_index()))
+registry.gauge("vu_bot_index_generation", "Поколение индекса ВУ номеров", lambda: current_index().generation)
+registry.gauge("vu_bot_campaign_records", "Записи в таблице акции",
+               lambda: current_index().campaign_sizes(), ("campaign",))
+registry.register("vu_bot_rate_limited_total", "counter", "Запросы, отклонённые ограничением частоты", ("kind",),
+                  lambda: rate_limiter.rejected)
+registry.register("vu_bot_probe_blocks_total", "counter", "Блокировки чатов за перебор ВУ номеров", (),
+                  lambda: probe_guard.blocked_total)
+registry.gauge("vu_bot_log_queue_depth", "Записи в очереди логов", lambda: log_handler.queue.qsize())
+registry.register("vu_bot_log_dropped_total", "counter", "Записи логов, отброшенные при переполнении очереди", (),
+                  lambda: log_handler.dropped)
+
+# Запуск фоновых задач в цикле событий приложения
+async def on_startup(application: Application) -> None:
+    global dispatcher, update_processor, metrics_server
+    dispatcher = OutboundDispatcher(application.bot, workers=OUTBOUND_WORKERS, global_rate=OUTBOUND_GLOBAL_RATE,
+                                    chat_rate=OUTBOUND_CHAT_RATE)
+    dispatcher.start()
+    update_processor = application.update_processor
+    if METRICS_PORT and metrics_server is None:
+        metrics_server = HttpServer(registry.serve)
+        await metrics_server.start(METRICS_LISTEN, METRICS_PORT)
+        logging.info(f"Метрики доступны на http://{METRICS_LISTEN}:{METRICS_PORT}/metrics")
+    # Восстанавливаем дедлайны пользователей, активных до перезапуска
+    for chat_id, last_activity in session_store.activities():
+        if owns_chat(chat_id):
+            inactivity_scheduler.touch(chat_id, last_activity)
+    background_tasks.append(asyncio.create_task(inactivity_scheduler.run()))
+    logging.info(f"Планировщик напоминаний запущен, ожидают напоминания: {len(inactivity_scheduler)}")
+    # Продолжаем рассылку, прерванную падением или перезапуском
+    # (в кластере — процесс, которому принадлежит чат администратора)
+    broadcast = Broadcast(session_store, dispatcher)
+    state = load_checkpoint(broadcast.checkpoint_path) if owns_chat(ADMIN_ID) else None
+    if state is not None:
+        logging.info(f"Продолжение рассылки после chat_id {state['last_chat_id']}")
+        start_broadcast(application, broadcast, state)
+
+async def on_stop(application: Application) -> None:
+    global metrics_server
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    # Напоминания и ответы, уже стоящие в очереди, отправляются до выхода
+    left = await dispatcher.drain(SHUTDOWN_DRAIN_TIMEOUT)
+    if left:
+        logging.warning(f"Остановка: не отправлено сообщений из очереди: {left}")
+    await dispatcher.stop()
+    if metrics_server is not None:
+        await metrics_server.stop()
+        metrics_server = None
+
+# Вытеснение из памяти давно неактивных сессий
+async def evict_sessions(context: ContextTypes.DEFAULT_TYPE) -> None:
     try:
-        current_time = datetime.now()
-        for chat_id, last_activity in list(user_last_activity.items()):
-            if current_time - last_activity > timedelta(minutes=15):  # Если пользователь был неактивен 15 минут
-                keyboard = [[InlineKeyboardButton("Начать сначала", callback_data="restart")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                try:
-                    await context.bot.send_message(
-                        chat_id, 
-                        "Вы долго не были активны. Нажмите 'Начать сначала', чтобы продолжить.", 
-                        reply_markup=reply_markup
-                    )
-                    del user_last_activity[chat_id]  # Удаляем пользователя из словаря
-                except Exception as e:
-                    logging.error(f"Ошибка при отправке уведомления об активности для {chat_id}: {e}")
+        evicted = session_store.evict_expired()
+        if evicted:
+            logging.info(f"Вытеснено неактивных сессий: {evicted}, в памяти осталось {len(session_store)}")
     except Exception as e:
-        logging.error(f"Ошибка в check_user_activity: {e}")
-
-# Наблюдатель за обновлением файла Excel
-class ExcelUpdateHandler(FileSystemEventHandler):
-    def on_modified(self, event):
-        if event.src_path.endswith("result_with_ids.xlsx"):
-            global data
-            try:
-                data = pd.read_excel("result_with_ids.xlsx")
-                logging.info("Файл result_with_ids.xlsx обновлён и перезагружен.")
-            except Exception as e:
-                logging.error(f"Ошибка при обновлении данных: {e}")
-
-def watch_excel_file():
-    observer = Observer()
-    event_handler = ExcelUpdateHandler()
-    observer.schedule(event_handler, path=".", recursive=False)
-    observer.start()
+        logging.error(f"Ошибка в evict_sessions: {e}")
+
+# Очистка устаревших счётчиков лимитов и защиты от перебора, отчёт об отклонённых запросах
+async def prune_limits(context: ContextTypes.DEFAULT_TYPE) -> None:
+    try:
+        rate_limiter.prune()
+        probe_guard.prune()
+        rejected = {kind: count for kind, count in rate_limiter.rejected.items() if count}
+        if rejected:
+            logging.info(f"Отклонено запросов сверх лимита (всего): {rejected}, отслеживается ключей: {len(rate_limiter)}")
+    except Exception as e:
+        logging.error(f"Ошибка в prune_limits: {e}")
+
+# Процесс кластера открывает заново упакованный индекс, когда ingress его пересобрал
+async def refresh_packed_index(context: ContextTypes.DEFAULT_TYPE) -> None:
+    index = reopen_if_stale(current_index())
+    if index is not None:
+        published = publish_index(index)
+        logging.info(f"Упакованный индекс {PACKED_INDEX} открыт заново: {len(index)} ключей, поколение {published.generation}")
+    if REPLY_CACHE:
+        attach_reply_cache()
+
+# Пересборка кэша ответов, когда сменился набор идущих акций (начало или конец акции)
+async def refresh_reply_cache(context: ContextTypes.DEFAULT_TYPE) -> None:
+    cache = reply_cache
+    if cache is None or not cache.is_current():
+        await asyncio.to_thread(rebuild_reply_cache)
+
+# Статистика времени выполнения обработчиков (для подбора MAX_CONCURRENT_UPDATES)
+async def log_handler_latency(context: ContextTypes.DEFAULT_TYPE) -> None:
+    for (name,), histogram in handler_latency.items():
+        if histogram.count:
+            logging.info(f"Обработчик {name}: {histogram.count} вызовов, среднее {histogram.sum / histogram.count * 1000:.1f} мс, "
+                         f"p50 ≤ {histogram.quantile(0.5) * 1000:g} мс, p99 ≤ {histogram.quantile(0.99) * 1000:g} мс")
+    if log_handler.dropped:
+        logging.warning(f"Очередь логов переполнялась, отброшено записей: {log_handler.dropped}")
+
+# Создание приложения и регистрация обработчиков; base_url позволяет направить бота на локальный сервер
+def build_application(token=None, base_url=None) -> Application:
+    builder = Application.builder().token(token or BOT_TOKEN).post_init(on_startup).post_stop(on_stop)
+    builder = builder.request(MonitoredRequest(connection_monitor, connection_pool_size=256))
+    builder = builder.get_updates_request(MonitoredRequest(connection_monitor, connection_pool_size=1))
+    builder = builder.concurrent_updates(ChatOrderedUpdateProcessor(MAX_CONCURRENT_UPDATES))
+    if base_url or BOT_API_URL:
+        builder = builder.base_url(base_url or BOT_API_URL)
+    application = builder.build()
+
+    # Ограничение частоты запросов до всех остальных обработчиков
+    application.add_handler(TypeHandler(Update, shed_over_limit), group=-1)
+
+    # Регистрация обработчиков (с замером времени выполнения каждого)
+    application.add_handler(CommandHandler("start", timed(start)))
+    application.add_handler(CommandHandler("broadcast", timed(broadcast_command)))
+    application.add_handler(CallbackQueryHandler(timed(set_language), pattern="lang_.*"))
+    application.add_handler(CallbackQueryHandler(timed(button_callback), pattern="check_coupons|help"))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, timed(handle_message)))
+
+    # Запуск фоновой задачи для вытеснения неактивных сессий
+    if application.job_queue:
+        application.job_queue.run_repeating(evict_sessions, interval=600)  # Задача каждые 10 минут
+        application.job_queue.run_repeating(log_handler_latency, interval=300)  # Задача каждые 5 минут
+        application.job_queue.run_repeating(prune_limits, interval=60)  # Задача каждую минуту
+        if BOT_MODE == "worker":
+            application.job_queue.run_repeating(refresh_packed_index, interval=5)
+        elif REPLY_CACHE:
+            application.job_queue.run_repeating(refresh_reply_cache, interval=60)
+        logging.info("Фоновые задачи для вытеснения сессий и статистики запущены.")
+    else:
+        logging.warning("JobQueue не была инициализирована, фоновые задачи не будут работать.")
+    return application
+
+# Прогрев до приёма обновлений: страницы индекса читаются заранее, шаблоны ответов всех акций
+# и языков пробно форматируются, так что ошибка в шаблоне видна при запуске, а не в ответе водителю
+def warm_up():
+    started = time.perf_counter()
+    index = current_index()
+    index.prefetch()
+    index.lookup("")
+    if reply_cache is not None:
+        reply_cache.prefetch()
+    sample = DriverRecord("", "", 0, 0, "")
+    entries = tuple(CampaignEntry(campaign.id, sample) for campaign in campaigns)
+    for language in LANGUAGE_CALLBACKS.values():
+        generate_not_found_message(language)
+        if entries and generate_message(entries, language) is None:
+            raise ValueError(f"Шаблоны ответа для языка {language} не форматируются")
+    logging.info(f"Прогрев завершён за {time.perf_counter() - started:.3f} с: индекс {len(index)} ключей, "
+                 f"акций {len(campaigns)}, готовых ответов {len(reply_cache) if reply_cache is not None else 0}")
+
+# Приём обновлений в выбранном режиме; возвращает (сервер или None, задача polling или None)
+async def start_intake(application: Application, stopped: asyncio.Event, backoff: Backoff):
+    if BOT_MODE == "worker":
+        # Процесс кластера: обновления своих чатов от ingress, ответ «обработано» — после обработки
+        server = WebhookServer(application, "/update", WORKER_SECRET, max_pending=WEBHOOK_MAX_PENDING, wait_processed=True)
+        await server.start("127.0.0.1", WORKER_PORT)
+        logging.info(f"Рабочий процесс {WORKER_INDEX} из {WORKER_COUNT} принимает обновления на порту {WORKER_PORT}")
+        return server, None
+    if BOT_MODE == "webhook":
+        server = WebhookServer(application, urlsplit(WEBHOOK_URL).path or "/", WEBHOOK_SECRET, max_pending=WEBHOOK_MAX_PENDING)
+        await server.start(WEBHOOK_LISTEN, WEBHOOK_PORT, webhook_ssl_context())
+        if await call_with_retry(lambda: application.bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET,
+                                                                     allowed_updates=Update.ALL_TYPES),
+                                 "Установка вебхука", stopped, backoff):
+            logging.info(f"Вебхук установлен: {WEBHOOK_URL}")
+        return server, None
+    await call_with_retry(application.bot.delete_webhook, "Отключение вебхука", stopped, backoff)
+    return None, asyncio.create_task(poll_updates(application, stopped, backoff))
+
+# Жизненный цикл бота в одном цикле событий: прогрев, подключение к Telegram с паузами Backoff,
+# приём обновлений до SIGTERM/SIGINT, затем остановка: приём прекращается, принятые обновления
+# дорабатываются, очередь исходящих отправляется, наблюдение за таблицами останавливается,
+# сессии записываются на диск.
+# Возвращает False, если работа завершилась критической ошибкой (администратор получает уведомление)
+async def run_bot(application: Application) -> bool:
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopped.set)
+    backoff = Backoff()
+    server = poller = watcher = None
+    ok = True
+    try:
+        warm_up()
+        if not await call_with_retry(application.initialize, "Подключение к Telegram", stopped, backoff):
+            return True
+        await application.post_init(application)
+        await application.start()
+        server, poller = await start_intake(application, stopped, backoff)
+        if BOT_MODE != "worker":
+            watcher = watch_campaign_files(campaigns, on_publish=on_index_published)
+        logging.info(f"Бот запущен в режиме {BOT_MODE}.")
+        waiter = asyncio.create_task(stopped.wait())
+        await asyncio.wait([waiter, poller] if poller else [waiter], return_when=asyncio.FIRST_COMPLETED)
+        waiter.cancel()
+        if poller is not None and poller.done():
+            poller.result()  # Polling завершился сам — только из-за ошибки
+    except Exception as e:
+        ok = False
+        logging.critical(f"Критическая ошибка: {e}", exc_info=True)
+        await notify_admin(application.bot, f"Критическая ошибка: {e}. Бот останавливается.")
+    finally:
+        stopped.set()
+        logging.info("Остановка: приём обновлений прекращён, дорабатываем принятые.")
+        if server is not None:
+            await server.stop()
+        if poller is not None:
+            await asyncio.gather(poller, return_exceptions=True)
+        if application.running:
+            await application.stop()
+        if dispatcher is not None:
+            await application.post_stop(application)  # Отправка очереди исходящих
+        if watcher is not None:
+            await asyncio.to_thread(stop_watching, watcher)
+        await application.shutdown()
+        session_store.close()
+        if RECOVERY.count:
+            logging.info(f"Потерь связи с Telegram: {RECOVERY.count}, среднее время восстановления "
+                         f"{connection_monitor.mean_recovery:.1f} с.")
+        logging.info("Бот остановлен.")
+    return ok
+
+# Уведомление администратора, когда приложение не удалось даже создать
+async def report_startup_crash(message: str) -> None:
+    async with Bot(BOT_TOKEN, **({"base_url": BOT_API_URL} if BOT_API_URL else {})) as bot:
+        await notify_admin(bot, message)
+
 # Основная функция запуска бота
 def main():
     try:
-        # Создаём приложение с токеном из окружения
-        application = Application.builder().token(BOT_TOKEN).build()
-
-        # Регистрация обработчиков
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(CallbackQueryHandler(set_language, pattern="lang_.*"))
-        application.add_handler(CallbackQueryHandler(button_callback, pattern="check_coupons|help"))
-        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-
-        # Запуск наблюдателя за файлом Excel
-        watch_excel_file()
-        logging.info("Наблюдение за обновлением файла Excel запущено.")
-
-        # Запуск фоновой задачи для проверки активности пользователей
-        if application.job_queue:
-            application.job_queue.run_repeating(check_user_activity, interval=60)  # Задача каждые 60 секунд
-            logging.info("Фоновая задача для проверки активности запущена.")
-        else:
-            logging.warning("JobQueue не была инициализирована, фоновые задачи не будут работать.")
-
-        # Запуск Polling с обработкой сетевых ошибок
-        while True:
-            try:
-                logging.info("Запуск бота...")
-                application.run_polling()
-            except (NetworkError, RetryAfter, TimedOut) as e:
-                logging.warning(f"Проблема с подключением к Telegram: {e}. Попытка переподключения...")
-                continue
-            except Exception as e:
-                logging.critical(f"Критическая ошибка: {e}")
-                context = application.bot.create_context()
-                asyncio.run(notify_admin(context, f"Критическая ошибка: {e}"))  # Уведомляем администратора
-                break
+        application = build_application()
     except Exception as e:
-        logging.critical(f"Критическая ошибка при запуске бота: {e}")
-        # Создаём контекст и отправляем уведомление админу
-        context = application.bot.create_context()
-        asyncio.run(notify_admin(context, f"Критическая ошибка при запуске: {e}"))
+        logging.critical(f"Критическая ошибка при запуске бота: {e}", exc_info=True)
+        asyncio.run(report_startup_crash(f"Критическая ошибка при запуске: {e}"))
+        exit(1)
+    if not asyncio.run(run_bot(application)):
         exit(1)
 
 if __name__ == "__main__":
@@ -0,0 +1,67 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+from outbound import PRIORITY_BROADCAST
+
+
+def _write_json(path, state):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+# Рассылка всем известным чатам: получатели читаются из хранилища сессий порциями,
+# сообщения отправляются через очередь исходящих с низким приоритетом и темпом не выше rate в секунду.
+# После каждой порции прогресс сохраняется в файл, чтобы после падения продолжить с того же места
+class Broadcast:
+    def __init__(self, store, dispatcher, checkpoint_path="broadcast_checkpoint.json", chunk_size=500, rate=20):
+        self.store = store
+        self.dispatcher = dispatcher
+        self.checkpoint_path = checkpoint_path
+        self.chunk_size = chunk_size
+        self.interval = 1 / rate
+
+    def new_state(self, text):
+        return {"text": text, "started": time.time(), "last_chat_id": None, "sent": 0, "failed": 0}
+
+    async def run(self, state):
+        started = time.monotonic()
+        sent_before = state["sent"] + state["failed"]
+        await asyncio.to_thread(_write_json, self.checkpoint_path, state)
+        while True:
+            chat_ids = await asyncio.to_thread(self.store.chat_ids, state["last_chat_id"], self.chunk_size)
+            if not chat_ids:
+                break
+            futures = []
+            for chat_id in chat_ids:
+                futures.append(self.dispatcher.send_message(chat_id, state["text"], priority=PRIORITY_BROADCAST))
+                await asyncio.sleep(self.interval)
+            results = await asyncio.gather(*futures, return_exceptions=True)
+            failed = sum(1 for result in results if isinstance(result, BaseException))
+            state["sent"] += len(results) - failed
+            state["failed"] += failed
+            state["last_chat_id"] = chat_ids[-1]
+            await asyncio.to_thread(_write_json, self.checkpoint_path, state)
+            logging.info(f"Рассылка: отправлено {state['sent']}, ошибок {state['failed']}, последний chat_id {chat_ids[-1]}")
+
+        elapsed = time.monotonic() - started
+        processed = state["sent"] + state["failed"] - sent_before
+        await asyncio.to_thread(os.remove, self.checkpoint_path)
+        return {
+            "sent": state["sent"],
+            "failed": state["failed"],
+            "elapsed": elapsed,
+            "rate": processed / elapsed if elapsed > 0 else 0.0,
+        }
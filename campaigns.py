@@ -0,0 +1,91 @@
+import datetime
+import functools
+import json
+
+from vu_index import VU_COLUMN
+
+
+def _date(value):
+    return datetime.date.fromisoformat(value) if value else None
+
+
+# Акция с собственной таблицей: колонки таблицы, периоды выполнения заказов, правило купонов,
+# окно показа (active.from / active.until) и тексты ответа по языкам.
+# Постоянные части текстов (периоды, правило купонов) подставляются один раз при загрузке
+class Campaign:
+    def __init__(self, campaign_id, data, default_language):
+        self.id = campaign_id
+        self.source = data["source"]
+        self.vu_column = data.get("vu_column", VU_COLUMN)
+        self.columns = data.get("columns")  # None — стандартные колонки vu_index.COLUMNS
+        self.orders_per_coupon = data.get("orders_per_coupon")
+        self.periods = [(_date(start), _date(end)) for start, end in data.get("periods", [])]
+        active = data.get("active") or {}
+        self.active_from = _date(active.get("from"))
+        self.active_until = _date(active.get("until"))
+
+        constants = {
+            "periods": "\n".join(f"{start:%d.%m.%Y} - {end:%d.%m.%Y}" for start, end in self.periods),
+            "orders_per_coupon": self.orders_per_coupon,
+        }
+        templates = data["templates"]
+        default = templates[default_language]
+        self.default_language = default_language
+        self.constants = constants
+        self._found_templates = {}
+        self._found = {}
+        self._not_found = {}
+        for language, texts in templates.items():
+            texts = {**default, **texts}
+            self._found_templates[language] = texts["found"]
+            self._found[language] = functools.partial(texts["found"].format, **constants)
+            self._not_found[language] = texts["not_found"].format(**constants)
+
+    # Параметры разбора таблицы для snapshot.load_index
+    @property
+    def index_options(self):
+        return {"columns": self.columns, "vu_column": self.vu_column, "orders_per_coupon": self.orders_per_coupon}
+
+    def is_active(self, today):
+        if self.active_from is not None and today < self.active_from:
+            return False
+        return self.active_until is None or today <= self.active_until
+
+    # Раздел ответа для водителя, найденного в таблице акции
+    def found(self, record, language):
+        render = self._found.get(language) or self._found[self.default_language]
+        return render(**record._asdict())
+
+    # Шаблон раздела «найден» до подстановки (постоянные части — в constants), для кэша ответов
+    def found_template(self, language):
+        return self._found_templates.get(language) or self._found_templates[self.default_language]
+
+    # Раздел ответа для водителя, которого в таблице акции нет
+    def not_found(self, language):
+        return self._not_found.get(language) or self._not_found[self.default_language]
+
+
+# Реестр акций из campaigns.json в порядке объявления
+class CampaignRegistry:
+    def __init__(self, data):
+        default_language = data.get("default_language", "ru")
+        self._campaigns = {campaign_id: Campaign(campaign_id, campaign, default_language)
+                           for campaign_id, campaign in data["campaigns"].items()}
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def __iter__(self):
+        return iter(self._campaigns.values())
+
+    def __getitem__(self, campaign_id):
+        return self._campaigns[campaign_id]
+
+    def __len__(self):
+        return len(self._campaigns)
+
+    def active(self, today=None):
+        today = today or datetime.date.today()
+        return [campaign for campaign in self._campaigns.values() if campaign.is_active(today)]
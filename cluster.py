@@ -0,0 +1,327 @@
+import asyncio
+import datetime
+import json
+import logging
+import os
+import secrets
+import signal
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+from dotenv import load_dotenv
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+
+from config import (BOT_API_URL, CAMPAIGNS_FILE, TEMPLATES_FILE, WEBHOOK_LISTEN, WEBHOOK_MAX_PENDING, WEBHOOK_PORT,
+                    WEBHOOK_SECRET, WEBHOOK_URL, campaigns, load_campaign_index, templates,
+                    webhook_ssl_context)
+from lifecycle import Backoff, ConnectionMonitor, MonitoredRequest, call_with_retry, poll_updates
+from log_pipeline import setup_logging
+from metrics import registry
+from packed_index import write_packed
+from reloader import stop_watching, watch_campaign_files
+from reply_cache import build_reply_cache, source_files
+from update_processor import ChatOrderedUpdateProcessor, worker_for
+from vu_index import current_index
+from webhook import HttpClient, HttpServer, WebhookServer
+
+# Кластер из нескольких процессов на одной машине: ingress получает обновления (polling или вебхук)
+# и раздаёт их N рабочим процессам bot3.py по chat_id, так что все обновления одного чата
+# обрабатывает один процесс и строго по порядку. Рабочие процессы открывают общий упакованный индекс
+# (packed_index, mmap) только для чтения и хранят сессии в общей базе SQLite.
+# Обновление забывается только после ответа рабочего процесса «обработано»; пока процесс
+# перезапускается, его обновления ждут в ingress и доставляются повторно (доставка «хотя бы один раз»).
+# Запуск: python cluster.py, SIGHUP — поочерёдный перезапуск рабочих процессов, SIGTERM — остановка
+
+load_dotenv()
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+log_handler = setup_logging(secrets=[BOT_TOKEN])
+if not BOT_TOKEN:
+    logging.critical("Токен бота не найден! Проверьте файл .env.")
+    sys.exit(1)
+
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+if BOT_MODE not in ("polling", "webhook"):
+    BOT_MODE = "polling"  # BOT_MODE=worker выставляется только рабочим процессам
+if BOT_MODE == "webhook" and not WEBHOOK_URL:
+    logging.critical("Для режима webhook нужен WEBHOOK_URL. Проверьте файл .env.")
+    sys.exit(1)
+
+CLUSTER_WORKERS = int(os.getenv("CLUSTER_WORKERS") or os.cpu_count() or 1)
+CLUSTER_PORT = int(os.getenv("CLUSTER_PORT", 8600))  # Рабочий процесс i слушает 127.0.0.1:CLUSTER_PORT + i
+CLUSTER_INFLIGHT = int(os.getenv("CLUSTER_INFLIGHT", 32))  # Обновлений в доставке одному процессу одновременно
+CLUSTER_DRAIN_TIMEOUT = float(os.getenv("CLUSTER_DRAIN_TIMEOUT", 30))  # Сколько ждать доставки при остановке
+PACKED_INDEX = os.path.abspath(os.getenv("PACKED_INDEX", "coupons.idx"))
+# Кэш готовых ответов (reply_cache.py) собирается вместе с упакованным индексом; пусто — без кэша
+REPLY_CACHE = os.path.abspath(os.getenv("REPLY_CACHE")) if os.getenv("REPLY_CACHE") else None
+WORKER_SECRET = secrets.token_urlsafe(32)
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot3.py")
+RETRY_MIN, RETRY_MAX = 0.1, 5.0
+# Bot API ограничивает бота целиком, поэтому общий лимит отправки делится между процессами
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", 30))
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9108))  # Рабочий процесс i отдаёт метрики на METRICS_PORT + 1 + i
+LOG_FILE = os.getenv("LOG_FILE", "bot.log")
+
+FORWARDED = registry.counter("vu_cluster_forwarded_total", "Доставка обновлений рабочим процессам",
+                             ("worker", "result"))
+RESTARTS = registry.counter("vu_cluster_worker_restarts_total", "Перезапуски рабочих процессов", ("worker",))
+registry.gauge("vu_cluster_pending", "Обновления, ожидающие подтверждения рабочего процесса",
+               lambda: {str(worker.index): worker.pending for worker in workers}, ("worker",))
+
+_write_lock = threading.Lock()
+_reply_cache_until = None  # Последний день, на который собран кэш ответов
+
+# Упакованный индекс пересобирается из текущего общего индекса после каждой перезагрузки таблицы;
+# рабочие процессы замечают подмену файла и открывают его заново
+def write_index(_published=None):
+    with _write_lock:
+        try:
+            started = time.perf_counter()
+            index = current_index()
+            write_packed(PACKED_INDEX, index)
+            logging.info(f"Упакованный индекс {PACKED_INDEX} записан: {len(index)} ключей, "
+                         f"поколение {index.generation}, {time.perf_counter() - started:.3f} с.")
+        except Exception as e:
+            logging.error(f"Не удалось записать упакованный индекс {PACKED_INDEX}: {e}")
+            return
+        if REPLY_CACHE:
+            write_reply_cache(index)
+
+# Кэш ответов помечается файлом индекса, по которому собран: рабочий процесс не возьмёт ответы
+# к индексу, который ещё не открыл
+def write_reply_cache(index):
+    global _reply_cache_until
+    try:
+        stat = os.stat(PACKED_INDEX)
+        cache = build_reply_cache(REPLY_CACHE, index, campaigns, templates,
+                                  source_files(campaigns, CAMPAIGNS_FILE, TEMPLATES_FILE),
+                                  extra={"index": [stat.st_ino, stat.st_mtime_ns, stat.st_size]})
+        _reply_cache_until = cache.valid_until or datetime.date.max
+    except Exception as e:
+        logging.error(f"Не удалось собрать кэш ответов {REPLY_CACHE}: {e}")
+
+def rewrite_reply_cache():
+    with _write_lock:
+        write_reply_cache(current_index())
+
+# Пересборка кэша ответов, когда сменился набор идущих акций (начало или конец акции)
+async def refresh_reply_cache(stopped):
+    while not stopped.is_set():
+        if _reply_cache_until is None or datetime.date.today() > _reply_cache_until:
+            await asyncio.to_thread(rewrite_reply_cache)
+        try:
+            await asyncio.wait_for(stopped.wait(), 60)
+        except asyncio.TimeoutError:
+            pass
+
+# Рабочий процесс кластера: запуск и перезапуск bot3.py, доставка ему обновлений с повтором до подтверждения
+class WorkerProcess:
+    def __init__(self, index, count, port, env, inflight):
+        self.index = index
+        self.port = port
+        self.env = {
+            **env,
+            "BOT_MODE": "worker",
+            "WORKER_INDEX": str(index),
+            "WORKER_COUNT": str(count),
+            "WORKER_PORT": str(port),
+        }
+        self.process = None
+        self.pending = 0  # Обновления, ожидающие подтверждения
+        self._client = HttpClient("127.0.0.1", port)
+        self._slots = asyncio.Semaphore(inflight)
+        self._stopping = False
+        self._abandon = False
+        self._restarting = False
+        self._restarted = asyncio.Event()
+
+    async def supervise(self):
+        backoff = 1
+        while not self._stopping:
+            started = time.monotonic()
+            self.process = await asyncio.create_subprocess_exec(sys.executable, WORKER_SCRIPT, env=self.env)
+            logging.info(f"Рабочий процесс {self.index} запущен, pid {self.process.pid}, порт {self.port}")
+            self._restarted.set()
+            code = await self.process.wait()
+            self._client.close()
+            if self._stopping:
+                break
+            RESTARTS.inc(str(self.index))
+            if self._restarting:
+                self._restarting = False
+                logging.info(f"Рабочий процесс {self.index} остановлен для перезапуска, ожидают доставки: {self.pending}")
+                continue
+            if time.monotonic() - started > 60:
+                backoff = 1
+            logging.error(f"Рабочий процесс {self.index} завершился с кодом {code}, перезапуск через {backoff} с, "
+                          f"ожидают доставки: {self.pending}")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+    # Доставка обновления; ответ 200 приходит, когда рабочий процесс его обработал.
+    # Пока процесс недоступен, доставка повторяется с растущей паузой
+    async def deliver(self, body, headers):
+        self.pending += 1
+        delay = RETRY_MIN
+        try:
+            async with self._slots:
+                while not self._abandon:
+                    try:
+                        status, _ = await self._client.post("/update", body, headers)
+                    except (OSError, asyncio.IncompleteReadError) as e:
+                        status = e
+                    if status == 200:
+                        FORWARDED.inc(str(self.index), "ok")
+                        return True
+                    if isinstance(status, int) and 400 <= status < 500:
+                        FORWARDED.inc(str(self.index), "rejected")
+                        logging.error(f"Рабочий процесс {self.index} отклонил обновление: {status}")
+                        return False
+                    FORWARDED.inc(str(self.index), "retry")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, RETRY_MAX)
+            FORWARDED.inc(str(self.index), "abandoned")
+            logging.error(f"Обновление для рабочего процесса {self.index} не доставлено до остановки кластера.")
+            return False
+        finally:
+            self.pending -= 1
+
+    # Перезапуск: процесс завершает обработку принятых обновлений и выходит, supervise запускает новый
+    async def restart(self):
+        if self.process is None or self.process.returncode is not None:
+            return
+        self._restarted.clear()
+        self._restarting = True
+        self.process.terminate()
+        await self._restarted.wait()
+
+    async def stop(self, timeout=30):
+        self._stopping = True
+        if self.process is None or self.process.returncode is not None:
+            return
+        self.process.terminate()
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout)
+        except asyncio.TimeoutError:
+            logging.error(f"Рабочий процесс {self.index} не завершился за {timeout} с, принудительная остановка.")
+            self.process.kill()
+            await self.process.wait()
+
+    def abandon(self):
+        self._abandon = True
+
+
+def _worker_log_file(log_file, index):
+    stem, extension = os.path.splitext(log_file)
+    return f"{stem}.worker{index}{extension}"
+
+
+workers = []
+
+
+async def run_ingress():
+    env = {
+        **os.environ,
+        "PACKED_INDEX": PACKED_INDEX,
+        "REPLY_CACHE": REPLY_CACHE or "",
+        "WORKER_SECRET": WORKER_SECRET,
+        "SESSION_STORE": "sqlite",  # Сессии общие: рабочий процесс после перезапуска читает их с диска
+        "OUTBOUND_GLOBAL_RATE": str(OUTBOUND_GLOBAL_RATE / CLUSTER_WORKERS),
+    }
+    for i in range(CLUSTER_WORKERS):
+        worker_env = {**env, "LOG_FILE": _worker_log_file(LOG_FILE, i),
+                      "METRICS_PORT": str(METRICS_PORT + 1 + i if METRICS_PORT else 0)}
+        workers.append(WorkerProcess(i, CLUSTER_WORKERS, CLUSTER_PORT + i, worker_env, CLUSTER_INFLIGHT))
+    headers = {"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": WORKER_SECRET}
+
+    async def forward(update, context):
+        chat = update.effective_chat
+        worker = workers[worker_for(chat.id if chat else 0, len(workers))]
+        await worker.deliver(json.dumps(update.to_dict()).encode(), headers)
+
+    # Порядок внутри чата соблюдает ChatOrderedUpdateProcessor, ограничение на процесс — WorkerProcess
+    monitor = ConnectionMonitor()
+    builder = (Application.builder().token(BOT_TOKEN)
+               .concurrent_updates(ChatOrderedUpdateProcessor(CLUSTER_WORKERS * CLUSTER_INFLIGHT))
+               .request(MonitoredRequest(monitor, connection_pool_size=8))
+               .get_updates_request(MonitoredRequest(monitor, connection_pool_size=1)))
+    if BOT_API_URL:
+        builder = builder.base_url(BOT_API_URL)
+    application = builder.build()
+    application.add_handler(TypeHandler(Update, forward))
+
+    loop = asyncio.get_running_loop()
+    stopped = asyncio.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopped.set)
+
+    async def rolling_restart():
+        for worker in workers:
+            logging.info(f"Перезапуск рабочего процесса {worker.index}...")
+            await worker.restart()
+    loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(rolling_restart()))
+
+    supervisors = [asyncio.create_task(worker.supervise()) for worker in workers]
+    if REPLY_CACHE:
+        supervisors.append(asyncio.create_task(refresh_reply_cache(stopped)))
+    watcher = watch_campaign_files(campaigns, on_publish=write_index)
+    metrics_server = None
+    server = poller = None
+    backoff = Backoff()
+    try:
+        if not await call_with_retry(application.initialize, "Подключение к Telegram", stopped, backoff):
+            return
+        if METRICS_PORT:
+            metrics_server = HttpServer(registry.serve)
+            await metrics_server.start(METRICS_LISTEN, METRICS_PORT)
+        if BOT_MODE == "webhook":
+            server = WebhookServer(application, urlsplit(WEBHOOK_URL).path or "/", WEBHOOK_SECRET,
+                                   max_pending=WEBHOOK_MAX_PENDING)
+            await server.start(WEBHOOK_LISTEN, WEBHOOK_PORT, webhook_ssl_context())
+            await application.start()
+            await call_with_retry(lambda: application.bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET,
+                                                                      allowed_updates=Update.ALL_TYPES),
+                                  "Установка вебхука", stopped, backoff)
+        else:
+            await application.start()
+            await call_with_retry(application.bot.delete_webhook, "Отключение вебхука", stopped, backoff)
+            poller = asyncio.create_task(poll_updates(application, stopped, backoff))
+        logging.info(f"Ingress в режиме {BOT_MODE} раздаёт обновления {CLUSTER_WORKERS} рабочим процессам.")
+        waiter = asyncio.create_task(stopped.wait())
+        await asyncio.wait([waiter, poller] if poller else [waiter], return_when=asyncio.FIRST_COMPLETED)
+        waiter.cancel()
+        if poller is not None and poller.done():
+            poller.result()  # Polling завершился сам — только из-за ошибки
+    except Exception as e:
+        logging.critical(f"Критическая ошибка ingress: {e}", exc_info=True)
+        raise
+    finally:
+        logging.info("Остановка кластера: прекращаем приём обновлений и дожидаемся доставки принятых.")
+        stopped.set()
+        if server is not None:
+            await server.stop()
+        if poller is not None:
+            await asyncio.gather(poller, return_exceptions=True)
+        if application.running:
+            drain = asyncio.create_task(application.stop())
+            done, _ = await asyncio.wait([drain], timeout=CLUSTER_DRAIN_TIMEOUT)
+            if not done:
+                for worker in workers:
+                    worker.abandon()
+                await drain
+        await application.shutdown()
+        await asyncio.gather(*(worker.stop() for worker in workers))
+        await asyncio.gather(*supervisors, return_exceptions=True)
+        await asyncio.to_thread(stop_watching, watcher)
+        if metrics_server is not None:
+            await metrics_server.stop()
+        logging.info("Кластер остановлен.")
+
+
+if __name__ == "__main__":
+    load_campaign_index()
+    write_index()
+    asyncio.run(run_ingress())
@@ -0,0 +1,64 @@
+import logging
+import os
+import secrets
+import ssl
+
+from dotenv import load_dotenv
+
+from campaigns import CampaignRegistry
+from snapshot import load_index
+from templates import TemplateCatalog
+from vu_index import CampaignIndex, publish_index
+
+# Настройки и данные, общие для одиночного бота (bot3.py) и ingress кластера (cluster.py):
+# адрес Bot API, параметры вебхука, реестр акций, шаблоны и загрузка таблиц акций
+load_dotenv()
+
+# Адрес Bot API (по умолчанию api.telegram.org), например локальный telegram-bot-api: http://127.0.0.1:8081/bot
+BOT_API_URL = os.getenv("BOT_API_URL")
+
+# Режим webhook. Telegram доставляет вебхуки только по HTTPS: TLS завершает обратный прокси (nginx и т.п.),
+# который передаёт запросы на WEBHOOK_LISTEN:WEBHOOK_PORT, поэтому по умолчанию порт открыт только на 127.0.0.1.
+# Без прокси бот принимает HTTPS сам: WEBHOOK_CERT и WEBHOOK_KEY — сертификат (выданный удостоверяющим центром)
+# и ключ, WEBHOOK_LISTEN=0.0.0.0
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # Публичный адрес, например https://example.com/telegram
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8443))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEBHOOK_MAX_PENDING = int(os.getenv("WEBHOOK_MAX_PENDING", 100))
+WEBHOOK_CERT = os.getenv("WEBHOOK_CERT")
+WEBHOOK_KEY = os.getenv("WEBHOOK_KEY")
+
+
+# TLS для приёма вебхука (None — обычный HTTP за обратным прокси)
+def webhook_ssl_context():
+    if not WEBHOOK_CERT:
+        return None
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(WEBHOOK_CERT, WEBHOOK_KEY)
+    return context
+
+# Реестр акций: у каждой своя таблица, колонки, периоды и тексты
+CAMPAIGNS_FILE = os.getenv("CAMPAIGNS_FILE", "campaigns.json")
+campaigns = CampaignRegistry.load(CAMPAIGNS_FILE)
+
+# Локализованные ответы и клавиатуры
+TEMPLATES_FILE = "templates.json"
+templates = TemplateCatalog.load(TEMPLATES_FILE)
+
+
+# Загрузка таблиц всех акций в общий индекс
+# (таблица каждой акции берётся из бинарного снимка, если он актуален).
+# Акция, таблицу которой не удалось загрузить, пропускается
+def load_campaign_index():
+    sources = {}
+    for campaign in campaigns:
+        try:
+            sources[campaign.id] = load_index(campaign.source, **campaign.index_options)
+            logging.info(f"Акция {campaign.id}: данные успешно загружены из файла {campaign.source}")
+        except FileNotFoundError:
+            logging.error(f"Акция {campaign.id}: файл {campaign.source} не найден. Бот продолжит работать без неё.")
+        except ValueError as e:
+            logging.error(f"Акция {campaign.id}: файл {campaign.source} имеет неверный формат: {e}. "
+                          f"Бот продолжит работать без неё.")
+    return publish_index(CampaignIndex(sources))
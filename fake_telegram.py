@@ -0,0 +1,183 @@
+import asyncio
+import itertools
+import json
+import random
+import time
+from http import HTTPStatus
+from urllib.parse import parse_qsl, urlsplit
+
+from webhook import HttpClient, HttpServer
+
+FAKE_BOT = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot",
+            "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+# Методы, к которым применяются задержка и флуд-контроль
+SEND_METHODS = frozenset(("sendMessage", "editMessageText", "answerCallbackQuery"))
+
+
+def _parse_params(headers, body):
+    if headers.get("content-type", "").startswith("application/json"):
+        return json.loads(body) if body else {}
+    params = {}
+    for name, value in parse_qsl(body.decode("utf-8")):
+        try:
+            params[name] = json.loads(value)
+        except ValueError:
+            params[name] = value
+    return params
+
+
+# Локальная замена Bot API для тестов и замеров: приложение направляется на неё через base_url.
+# Обновления добавляются через push_update() и отдаются через getUpdates либо отправляются на вебхук,
+# отправленные ботом сообщения сохраняются в sent (если record_sent) и передаются в on_send.
+# Для нагрузочных тестов можно добавить задержку ответа на отправку и случайные ответы 429
+class FakeTelegram:
+    def __init__(self, on_send=None, latency=0.0, jitter=0.0, flood_rate=0.0, retry_after=1, record_sent=True, seed=None):
+        self.on_send = on_send  # Вызывается с (chat_id, method, params, время получения)
+        self.latency = latency  # Задержка ответа на отправку, с
+        self.jitter = jitter  # Случайная добавка к задержке, от 0 до jitter секунд
+        self.flood_rate = flood_rate  # Доля отправок, на которые отвечаем 429 Too Many Requests
+        self.retry_after = retry_after
+        self.record_sent = record_sent
+        self.flooded = 0
+        self.failed = 0  # Запросы, отклонённые во время имитации сбоя
+        self._down_until = 0.0
+        self._random = random.Random(seed)
+        self.sent = []
+        self.webhook_url = None
+        self.webhook_secret = None
+        self._updates = asyncio.Queue()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._http = HttpServer(self._handle)
+        self._client = None  # Соединения с вебхуком
+        self.port = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        self.port = await self._http.start(host, port)
+        return self.port
+
+    async def stop(self):
+        await self._http.stop()
+        if self._client is not None:
+            self._client.close()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    # Обновления-заготовки в формате Bot API
+    def message_update(self, chat_id, text):
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Driver"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"message": message}
+
+    def callback_update(self, chat_id, data):
+        return {"callback_query": {
+            "id": str(next(self._message_ids)),
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Driver"},
+            "chat_instance": str(chat_id),
+            "data": data,
+            "message": {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": "…",
+            },
+        }}
+
+    async def push_update(self, update):
+        update = {"update_id": next(self._update_ids), **update}
+        if self.webhook_url is None:
+            self._updates.put_nowait(update)
+            return
+        await self._post_webhook(update)
+
+    async def _post_webhook(self, update):
+        url = urlsplit(self.webhook_url)
+        if self._client is None or (self._client.host, self._client.port) != (url.hostname, url.port):
+            self._client = HttpClient(url.hostname, url.port)
+        status, _ = await self._client.post(url.path, json.dumps(update).encode(), {
+            "Content-Type": "application/json",
+            "X-Telegram-Bot-Api-Secret-Token": self.webhook_secret or "",
+        })
+        if status != 200:
+            raise RuntimeError(f"Вебхук ответил {status}")
+
+    def _message(self, chat_id, text):
+        return {"message_id": next(self._message_ids), "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "text": text}
+
+    async def _get_updates(self, params):
+        timeout = float(params.get("timeout", 0))
+        offset = int(params.get("offset", 0))
+        updates = []
+        try:
+            updates.append(await asyncio.wait_for(self._updates.get(), timeout) if timeout else self._updates.get_nowait())
+        except (asyncio.TimeoutError, asyncio.QueueEmpty):
+            return []
+        while not self._updates.empty():
+            updates.append(self._updates.get_nowait())
+        return [update for update in updates if update["update_id"] >= offset]
+
+    async def _delay(self):
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self._random.random() * self.jitter)
+
+    # Имитация сетевого сбоя: seconds секунд на все запросы отвечаем 502 Bad Gateway
+    def outage(self, seconds):
+        self._down_until = time.monotonic() + seconds
+
+    # Ответ флуд-контроля в формате Bot API: PTB превращает его в RetryAfter
+    def _flood(self):
+        if not self.flood_rate or self._random.random() >= self.flood_rate:
+            return None
+        self.flooded += 1
+        body = json.dumps({"ok": False, "error_code": 429, "description": f"Too Many Requests: retry after {self.retry_after}",
+                           "parameters": {"retry_after": self.retry_after}}).encode()
+        return HTTPStatus.TOO_MANY_REQUESTS, body, "application/json"
+
+    async def _handle(self, method, path, headers, body):
+        received = time.monotonic()
+        if received < self._down_until:
+            self.failed += 1
+            return HTTPStatus.BAD_GATEWAY, b"", "text/plain"
+        api_method = path.rsplit("/", 1)[-1]
+        params = _parse_params(headers, body)
+        if api_method in SEND_METHODS:
+            flood = self._flood()
+            if flood is not None:
+                return flood
+            await self._delay()
+            received = time.monotonic()
+        if api_method == "getMe":
+            result = FAKE_BOT
+        elif api_method == "getUpdates":
+            result = await self._get_updates(params)
+        elif api_method == "setWebhook":
+            self.webhook_url = params.get("url") or None
+            self.webhook_secret = str(params.get("secret_token", ""))
+            result = True
+        elif api_method == "deleteWebhook":
+            self.webhook_url = None
+            result = True
+        elif api_method in ("sendMessage", "editMessageText"):
+            chat_id = params.get("chat_id")
+            if self.record_sent:
+                self.sent.append((chat_id, api_method, params, received))
+            if self.on_send is not None:
+                self.on_send(chat_id, api_method, params, received)
+            result = self._message(chat_id, str(params.get("text")))
+        elif api_method == "answerCallbackQuery":
+            result = True
+        else:
+            body = json.dumps({"ok": False, "error_code": 404, "description": "Not Found"}).encode()
+            return HTTPStatus.NOT_FOUND, body, "application/json"
+        return HTTPStatus.OK, json.dumps({"ok": True, "result": result}).encode(), "application/json"
@@ -0,0 +1,61 @@
+import asyncio
+import heapq
+import logging
+import time
+
+
+# Планировщик напоминаний о неактивности: min-куча дедлайнов.
+# Поток просыпается только к ближайшему дедлайну, а при новой активности
+# старая запись в куче не удаляется, а просто считается устаревшей (ленивая отмена)
+class InactivityScheduler:
+    def __init__(self, timeout, on_expire):
+        self.timeout = timeout
+        self.on_expire = on_expire  # Вызывается с chat_id, когда пользователь неактивен timeout секунд
+        self._heap = []
+        self._deadlines = {}
+        self._wakeup = asyncio.Event()
+
+    # Отметка активности; last_activity — время по time.time(), если активность была раньше (например, до перезапуска)
+    def touch(self, chat_id, last_activity=None):
+        now = time.monotonic()
+        deadline = now + self.timeout
+        if last_activity is not None:
+            deadline -= time.time() - last_activity
+        self._deadlines[chat_id] = deadline
+        heapq.heappush(self._heap, (deadline, chat_id))
+        if self._heap[0][1] == chat_id:
+            self._wakeup.set()  # Новый дедлайн оказался ближайшим
+        # Устаревших записей накопилось слишком много — перестраиваем кучу
+        if len(self._heap) > 2 * len(self._deadlines) + 1024:
+            self._heap = [(deadline, chat_id) for chat_id, deadline in self._deadlines.items()]
+            heapq.heapify(self._heap)
+
+    def cancel(self, chat_id):
+        self._deadlines.pop(chat_id, None)
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    async def run(self):
+        while True:
+            heap = self._heap
+            # Выбрасываем устаревшие записи с вершины кучи
+            while heap and self._deadlines.get(heap[0][1]) != heap[0][0]:
+                heapq.heappop(heap)
+            self._wakeup.clear()
+            if not heap:
+                await self._wakeup.wait()
+                continue
+            delay = heap[0][0] - time.monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            deadline, chat_id = heapq.heappop(heap)
+            del self._deadlines[chat_id]
+            try:
+                self.on_expire(chat_id)
+            except Exception as e:
+                logging.error(f"Ошибка при обработке неактивности {chat_id}: {e}")
@@ -0,0 +1,74 @@
+import csv
+import os
+
+from vu_index import COLUMNS, VU_COLUMN, VuIndex
+
+# Потоковое чтение таблиц водителей без DataFrame: строки читаются по одной (CSV, XLSX)
+# или пакетами (Parquet) и сразу складываются в индекс, вся таблица в памяти не держится
+SUPPORTED_FORMATS = (".csv", ".parquet", ".xlsx")
+BATCH_SIZE = 50000
+
+
+# Каждый читатель — генератор: первым отдаёт заголовок, затем строки.
+# Файл закрывается, когда генератор дочитан или закрыт
+def _csv_rows(path, wanted, batch_size):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        first_line = f.readline()
+        f.seek(0)
+        delimiter = max(",;\t", key=first_line.count)  # Выгрузки бывают и через запятую, и через точку с запятой
+        # Пустые строки (csv.reader отдаёт для них []) пропускаются
+        yield from filter(None, csv.reader(f, delimiter=delimiter))
+
+
+# Excel в режиме read_only: openpyxl разбирает первый лист (как pandas с sheet_name=0,
+# независимо от того, какой лист был выбран при сохранении) потоково, строка за строкой
+def _xlsx_rows(path, wanted, batch_size):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from workbook.worksheets[0].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+# Parquet: читаются только нужные колонки, пакетами по batch_size строк
+def _parquet_rows(path, wanted, batch_size):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ValueError(f"Для чтения {path} нужен пакет pyarrow") from e
+
+    parquet = pq.ParquetFile(path)
+    header = [name for name in parquet.schema_arrow.names if name in wanted]
+    yield header
+    for batch in parquet.iter_batches(batch_size=batch_size, columns=header):
+        yield from zip(*(column.to_pylist() for column in batch.columns))
+
+
+_READERS = {".csv": _csv_rows, ".xlsx": _xlsx_rows, ".parquet": _parquet_rows}
+
+
+# Заголовок и итератор строк таблицы; формат определяется по расширению файла
+def open_rows(path, wanted=(), batch_size=BATCH_SIZE):
+    extension = os.path.splitext(path)[1].lower()
+    reader = _READERS.get(extension)
+    if reader is None:
+        raise ValueError(f"Неподдерживаемый формат {extension or path}, ожидается один из {', '.join(SUPPORTED_FORMATS)}")
+    rows = reader(path, set(wanted), batch_size)
+    try:
+        header = next(rows, ())
+    except BaseException:
+        rows.close()
+        raise
+    return header, rows
+
+
+# Индекс по таблице любого поддерживаемого формата (параметры колонок — как в VuIndex.from_rows)
+def read_index(path, columns=None, vu_column=VU_COLUMN, orders_per_coupon=None, batch_size=BATCH_SIZE):
+    wanted = [vu_column, *(COLUMNS if columns is None else columns).values()]
+    header, rows = open_rows(path, wanted, batch_size)
+    try:
+        return VuIndex.from_rows(header, rows, columns, vu_column, orders_per_coupon)
+    finally:
+        rows.close()
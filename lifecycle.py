@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import random
+import time
+from datetime import timedelta
+
+from telegram import Update
+from telegram.error import BadRequest, NetworkError, RetryAfter
+from telegram.request import HTTPXRequest
+
+from metrics import registry
+
+OUTAGES = registry.counter("vu_bot_telegram_outages_total", "Потери связи с Bot API")
+RECOVERY = registry.histogram("vu_bot_telegram_recovery_seconds",
+                              "Время от первой ошибки связи с Bot API до первого успешного запроса",
+                              buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 900.0)).labels()
+
+
+# Экспоненциальная пауза между попытками со случайной добавкой: после сбоя у Telegram
+# перезапущенные боты не приходят на переподключение одновременно
+class Backoff:
+    def __init__(self, initial=1.0, maximum=60.0, factor=2.0, jitter=0.5, rng=None):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter  # Доля паузы, которая выбирается случайно
+        self.attempts = 0
+        self._random = rng or random.Random()
+
+    def next(self):
+        delay = min(self.maximum, self.initial * self.factor ** self.attempts)
+        self.attempts += 1
+        return delay * (1 - self.jitter * self._random.random())
+
+    def reset(self):
+        self.attempts = 0
+
+
+# Учёт потерь связи с Bot API: простой начинается с первой сетевой ошибки (или ответа 5xx)
+# и заканчивается первым успешным запросом, отправленным уже после её начала (запросы, ушедшие
+# до сбоя, могут успешно завершиться и во время него); время восстановления — в метриках и журнале
+class ConnectionMonitor:
+    def __init__(self):
+        self.down_since = None
+        self.last_error = None
+
+    def failed(self, error):
+        self.last_error = error
+        if self.down_since is None:
+            self.down_since = time.monotonic()
+            OUTAGES.inc()
+            logging.warning(f"Потеряна связь с Telegram: {error}")
+
+    def succeeded(self, started):
+        if self.down_since is None or started < self.down_since:
+            return
+        duration = time.monotonic() - self.down_since
+        self.down_since = None
+        RECOVERY.observe(duration)
+        logging.info(f"Связь с Telegram восстановлена за {duration:.1f} с, среднее время восстановления "
+                     f"{self.mean_recovery:.1f} с за {RECOVERY.count} потерь связи.")
+
+    @property
+    def mean_recovery(self):
+        return RECOVERY.sum / RECOVERY.count if RECOVERY.count else 0.0
+
+
+# Запросы к Bot API с отметкой результата в ConnectionMonitor
+class MonitoredRequest(HTTPXRequest):
+    def __init__(self, monitor, **kwargs):
+        super().__init__(**kwargs)
+        self.monitor = monitor
+
+    async def do_request(self, *args, **kwargs):
+        started = time.monotonic()
+        try:
+            status, payload = await super().do_request(*args, **kwargs)
+        except NetworkError as e:
+            self.monitor.failed(e)
+            raise
+        if status >= 500:
+            self.monitor.failed(f"ответ {status}")
+        else:
+            self.monitor.succeeded(started)
+        return status, payload
+
+
+def retry_after_seconds(error):
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if isinstance(retry_after, timedelta) else retry_after
+
+
+# Ожидание coroutine или события stopped; None, если остановка наступила раньше
+async def until_stopped(coroutine, stopped):
+    task = asyncio.ensure_future(coroutine)
+    waiter = asyncio.ensure_future(stopped.wait())
+    await asyncio.wait((task, waiter), return_when=asyncio.FIRST_COMPLETED)
+    waiter.cancel()
+    if not task.done():
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return None
+    return task.result()
+
+
+# Вызов API с повтором при сетевых ошибках и флуд-контроле; True — успех, False — остановка раньше успеха.
+# BadRequest (подкласс NetworkError) не повторяется: ошибка в запросе не исправится сама
+async def call_with_retry(action, description, stopped, backoff):
+    backoff.reset()
+    while not stopped.is_set():
+        try:
+            await until_stopped(action(), stopped)
+            return not stopped.is_set()
+        except RetryAfter as e:
+            delay = retry_after_seconds(e)
+        except BadRequest:
+            raise
+        except NetworkError as e:
+            delay = backoff.next()
+            logging.warning(f"{description}: {e}. Повтор через {delay:.1f} с (попытка {backoff.attempts}).")
+        await until_stopped(asyncio.sleep(delay), stopped)
+    return False
+
+
+# Long polling без Updater: обновления складываются в update_queue приложения,
+# при потере связи — переподключение с паузами Backoff, всё в одном цикле событий.
+# После остановки Telegram получает подтверждение уже принятых обновлений
+async def poll_updates(application, stopped, backoff=None, timeout=10, allowed_updates=Update.ALL_TYPES):
+    bot = application.bot
+    backoff = backoff or Backoff()
+    offset = None
+    while not stopped.is_set():
+        try:
+            updates = await until_stopped(bot.get_updates(offset=offset, timeout=timeout,
+                                                          allowed_updates=allowed_updates), stopped)
+        except RetryAfter as e:
+            delay = retry_after_seconds(e)
+        except BadRequest:
+            raise
+        except NetworkError as e:
+            delay = backoff.next()
+            logging.warning(f"Ошибка получения обновлений: {e}. Повтор через {delay:.1f} с (попытка {backoff.attempts}).")
+        else:
+            backoff.reset()
+            for update in updates or ():
+                await application.update_queue.put(update)
+                offset = update.update_id + 1
+            continue
+        await until_stopped(asyncio.sleep(delay), stopped)
+    if offset is not None:
+        try:
+            await bot.get_updates(offset=offset, timeout=0, limit=1, allowed_updates=allowed_updates)
+        except Exception as e:
+            logging.warning(f"Не удалось подтвердить полученные обновления: {e}")
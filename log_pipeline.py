@@ -0,0 +1,140 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import re
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Токен бота в URL Bot API: .../bot<id>:<secret>/method
+TOKEN_PATTERN = re.compile(r"\d{5,}:[A-Za-z0-9_-]{30,}")
+
+# Частые строки, которые пишутся не каждый раз: (логгер, подстрока сообщения) -> 1 из N
+DEFAULT_SAMPLING = {("httpx", "getUpdates"): 100}
+
+# Поля LogRecord, которые не являются пользовательскими extra
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+# Запись в JSON: одна строка на событие, все extra-поля переносятся как есть
+class JsonFormatter(logging.Formatter):
+    def __init__(self, secrets=()):
+        super().__init__()
+        self.secrets = [secret for secret in secrets if secret]
+
+    def redact(self, text):
+        for secret in self.secrets:
+            text = text.replace(secret, "<redacted>")
+        return TOKEN_PATTERN.sub("<redacted>", text)
+
+    def format(self, record):
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": self.redact(record.getMessage()),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = self.redact(record.exc_text)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+# Пропуск 1 из N записей для частых событий; в оставшиеся добавляется поле sample_rate
+class SamplingFilter(logging.Filter):
+    def __init__(self, rules):
+        super().__init__()
+        self.rules = {}  # логгер -> [(подстрока, N, счётчик)]
+        for (name, substring), rate in rules.items():
+            self.rules.setdefault(name, []).append([substring, rate, 0])
+
+    def filter(self, record):
+        rules = self.rules.get(record.name)
+        if not rules:
+            return True
+        message = record.getMessage()
+        for rule in rules:
+            if rule[0] in message:
+                rule[2] += 1
+                if (rule[2] - 1) % rule[1]:
+                    return False
+                record.sample_rate = rule[1]
+                return True
+        return True
+
+
+# QueueHandler, который не блокирует вызывающий поток: при переполнении очереди запись
+# отбрасывается и учитывается, а форматирование JSON и запись в файл идут в потоке QueueListener
+class NonBlockingQueueHandler(QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    # В отличие от базового prepare, трассировка не склеивается с сообщением, а идёт в отдельное поле
+    def prepare(self, record):
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+# Разбор "httpx=WARNING,telegram.ext=INFO" в словарь уровней
+def parse_levels(value):
+    levels = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, level = item.partition("=")
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+# Разбор "httpx:getUpdates=100" в правила выборки
+def parse_sampling(value):
+    rules = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        target, _, rate = item.rpartition("=")
+        name, _, substring = target.partition(":")
+        rules[(name.strip(), substring.strip())] = int(rate)
+    return rules
+
+
+# Настройка логирования: корневой логгер пишет в очередь, поток-слушатель — в файл.
+# Параметры по умолчанию берутся из LOG_FILE, LOG_LEVEL, LOG_LEVELS и LOG_SAMPLING
+def setup_logging(path=None, level=None, levels=None, sampling=None, secrets=(), queue_size=10000):
+    path = path or os.getenv("LOG_FILE", "bot.log")
+    level = level or os.getenv("LOG_LEVEL", "INFO")
+    if levels is None:
+        levels = parse_levels(os.getenv("LOG_LEVELS", "httpx=INFO,apscheduler=WARNING"))
+    if sampling is None:
+        sampling = parse_sampling(os.getenv("LOG_SAMPLING", "")) or DEFAULT_SAMPLING
+
+    file_handler = RotatingFileHandler(path, maxBytes=5000000, backupCount=3, encoding="utf-8")  # 5 MB на лог-файл, 3 копии
+    file_handler.setFormatter(JsonFormatter(secrets))
+
+    log_queue = queue.Queue(queue_size)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(sampling))
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    for name, logger_level in levels.items():
+        logging.getLogger(name).setLevel(logger_level)
+
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return queue_handler
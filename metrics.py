@@ -0,0 +1,148 @@
+import functools
+import time
+from bisect import bisect_left
+from http import HTTPStatus
+
+# Границы корзин гистограммы задержек, секунды
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+# Гистограмма с фиксированными корзинами: запись значения — один bisect и два сложения
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Последняя корзина — всё, что больше последней границы
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # Оценка квантиля сверху: граница корзины, в которую он попадает
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+# Счётчик с метками: значение хранится в словаре по кортежу значений меток
+class Counter(dict):
+    __slots__ = ()
+
+    def inc(self, *labels, amount=1):
+        self[labels] = self.get(labels, 0) + amount
+
+
+# Набор гистограмм с метками; гистограмма для новых значений меток создаётся при первом обращении
+class HistogramFamily(dict):
+    __slots__ = ("bucket_bounds",)
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        super().__init__()
+        self.bucket_bounds = buckets
+
+    def labels(self, *labels):
+        histogram = self.get(labels)
+        if histogram is None:
+            histogram = self[labels] = Histogram(self.bucket_bounds)
+        return histogram
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+
+# Реестр метрик в текстовом формате Prometheus. Запись значений не проходит через реестр:
+# горячий путь обновляет Counter/Histogram напрямую, реестр обходит их только при запросе /metrics.
+# Вместо значения можно передать функцию: она вызывается при каждом запросе (для размеров очередей и т.п.)
+class Registry:
+    def __init__(self):
+        self._metrics = []  # (имя, тип, описание, имена меток, значения или функция)
+
+    def register(self, name, kind, description, label_names, source):
+        self._metrics.append((name, kind, description, tuple(label_names), source))
+        return source
+
+    def counter(self, name, description, label_names=()):
+        return self.register(name, "counter", description, label_names, Counter())
+
+    def histogram(self, name, description, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self.register(name, "histogram", description, label_names, HistogramFamily(buckets))
+
+    def gauge(self, name, description, source, label_names=()):
+        return self.register(name, "gauge", description, label_names, source)
+
+    def render(self):
+        lines = []
+        for name, kind, description, label_names, source in self._metrics:
+            values = source() if callable(source) else source
+            if not isinstance(values, dict):
+                values = {(): values}
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in list(values.items()):
+                if not isinstance(labels, tuple):
+                    labels = (labels,)
+                if kind != "histogram":
+                    lines.append(f"{name}{_format_labels(label_names, labels)} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(value.buckets + (float("inf"),), value.counts):
+                    cumulative += count
+                    le = 'le="' + _format_value(bound) + '"'
+                    lines.append(f"{name}_bucket{_format_labels(label_names, labels, le)} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(label_names, labels)} {_format_value(value.sum)}")
+                lines.append(f"{name}_count{_format_labels(label_names, labels)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+    # Обработчик для webhook.HttpServer: GET /metrics
+    async def serve(self, method, path, headers, body):
+        if path.split("?", 1)[0] != "/metrics":
+            return HTTPStatus.NOT_FOUND, b"", "text/plain"
+        return HTTPStatus.OK, self.render().encode(), "text/plain; version=0.0.4; charset=utf-8"
+
+
+# Общий реестр процесса
+registry = Registry()
+
+# Задержки обработчиков обновлений по имени обработчика
+handler_latency = registry.histogram("vu_bot_handler_duration_seconds", "Время выполнения обработчиков обновлений",
+                                     ("handler",))
+
+
+# Обёртка обработчика PTB, записывающая время его выполнения в handler_latency
+def timed(callback, name=None):
+    histogram = handler_latency.labels(name or callback.__name__)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        finally:
+            histogram.observe(time.perf_counter() - started)
+
+    return wrapper
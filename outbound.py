@@ -0,0 +1,235 @@
+import asyncio
+import itertools
+import logging
+import random
+import time
+
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+from lifecycle import retry_after_seconds
+from metrics import Histogram
+
+# Очереди по приоритету: ответы пользователям идут раньше напоминаний и рассылок
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NUDGE = 1
+PRIORITY_BROADCAST = 2
+LANES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_NUDGE: "nudge", PRIORITY_BROADCAST: "broadcast"}
+
+
+# Ведро токенов: rate токенов в секунду, не больше capacity подряд.
+# reserve() сразу списывает токен и возвращает, сколько нужно подождать до отправки
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now):
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = ("chat_id", "method", "args", "kwargs", "priority", "future", "enqueued", "attempts", "chat_slot")
+
+    def __init__(self, chat_id, method, args, kwargs, priority, future):
+        self.chat_id = chat_id
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.future = future
+        self.enqueued = time.monotonic()
+        self.attempts = 0
+        self.chat_slot = False  # Место в лимите чата уже занято, запрос ждал его вне очереди
+
+
+def _consume_exception(future):
+    # Ошибка уже залогирована диспетчером; помечаем её полученной, если результат никто не ждёт
+    if not future.cancelled():
+        future.exception()
+
+
+# Центральная очередь исходящих запросов к Telegram: общий лимит бота и лимит на чат,
+# приоритетные очереди и повтор с учётом retry_after при флуд-контроле
+class OutboundDispatcher:
+    def __init__(self, bot, workers=8, global_rate=30, chat_rate=1, chat_burst=3, max_attempts=3):
+        self.bot = bot
+        self.workers = workers
+        self.max_attempts = max_attempts  # Для сетевых ошибок; RetryAfter повторяется всегда
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = {}
+        self._queue = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+        self._tasks = []
+        self.depth = dict.fromkeys(LANES, 0)
+        self.latency = {priority: Histogram() for priority in LANES}  # От постановки в очередь до ответа Telegram, с
+        self.sent = dict.fromkeys(LANES, 0)
+        self.failed = dict.fromkeys(LANES, 0)
+        self.retried = 0
+        self._delayed = 0  # Запросы, ожидающие вне очереди: повтора после сетевой ошибки или места в лимите чата
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # Ожидание отправки всего, что уже поставлено в очередь (включая отложенные повторы),
+    # не дольше timeout секунд; возвращает число запросов, которые так и не ушли
+    async def drain(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(self._queue.join(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if not self._delayed:
+                return 0
+            await asyncio.sleep(min(0.1, max(0.0, deadline - time.monotonic())))
+        return self._queue.qsize() + self._delayed
+
+    # Постановка произвольного вызова API в очередь; возвращает future с результатом вызова
+    def submit(self, chat_id, method, *args, priority=PRIORITY_INTERACTIVE, **kwargs):
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_consume_exception)
+        self._put(_Job(chat_id, method, args, kwargs, priority, future))
+        return future
+
+    def send_message(self, chat_id, text, priority=PRIORITY_INTERACTIVE, **kwargs):
+        return self.submit(chat_id, self.bot.send_message, chat_id, text, priority=priority, **kwargs)
+
+    def _put(self, job):
+        self.depth[job.priority] += 1
+        self._queue.put_nowait((job.priority, next(self._seq), job))
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            # Полные вёдра ничем не отличаются от новых: периодически выбрасываем их
+            if len(self._chat_buckets) >= 10000:
+                self._chat_buckets = {key: value for key, value in self._chat_buckets.items() if not value.is_full(now)}
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    # Место в лимите чата: если его нужно ждать, запрос откладывается через call_later и вернётся
+    # в очередь к нужному моменту, а обработчик берёт следующий — чаты на пределе лимита не занимают
+    # обработчики и не задерживают ответы другим чатам. False — запрос отложен
+    def _take_chat_slot(self, job, seq):
+        if job.chat_slot:
+            job.chat_slot = False
+            return True
+        now = time.monotonic()
+        delay = self._chat_bucket(job.chat_id, now).reserve(now)
+        if delay <= 0:
+            return True
+        job.chat_slot = True
+        self._delayed += 1
+        asyncio.get_running_loop().call_later(delay, self._requeue_delayed, job, seq)
+        return False
+
+    # Общий лимит бота и пауза флуд-контроля действуют на все чаты, их ждёт сам обработчик
+    async def _wait_for_slot(self):
+        while True:
+            now = time.monotonic()
+            if now >= self._paused_until:
+                break
+            await asyncio.sleep(self._paused_until - now)
+        delay = self._global_bucket.reserve(now)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _worker(self):
+        while True:
+            priority, seq, job = await self._queue.get()
+            self.depth[priority] -= 1
+            try:
+                await self._process(job, seq)
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, job, seq):
+        if job.future.done():  # Ожидающий отменил запрос
+            return
+        if not self._take_chat_slot(job, seq):
+            return
+        await self._wait_for_slot()
+        job.attempts += 1
+        try:
+            result = await job.method(*job.args, **job.kwargs)
+        except RetryAfter as e:
+            retry_after = retry_after_seconds(e)
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            self.retried += 1
+            logging.warning(f"Флуд-контроль Telegram: отправка приостановлена на {retry_after} с.")
+            self._requeue(job, seq)
+        except BadRequest as e:
+            self._fail(job, e)
+        except NetworkError as e:
+            if job.attempts < self.max_attempts:
+                self.retried += 1
+                self._delayed += 1
+                # Пауза растёт экспоненциально, случайная добавка разводит повторы разных запросов
+                delay = 2 ** job.attempts * (0.5 + random.random() / 2)
+                asyncio.get_running_loop().call_later(delay, self._requeue_delayed, job, seq)
+            else:
+                self._fail(job, e)
+        except Exception as e:
+            self._fail(job, e)
+        else:
+            self.sent[job.priority] += 1
+            self.latency[job.priority].observe(time.monotonic() - job.enqueued)
+            if not job.future.done():
+                job.future.set_result(result)
+
+    # Возврат в очередь с прежним номером, чтобы запрос ушёл первым в своей очереди
+    def _requeue(self, job, seq):
+        self.depth[job.priority] += 1
+        self._queue.put_nowait((job.priority, seq, job))
+
+    def _requeue_delayed(self, job, seq):
+        self._delayed -= 1
+        self._requeue(job, seq)
+
+    def _fail(self, job, error):
+        self.failed[job.priority] += 1
+        logging.error(f"Ошибка при отправке сообщения для {job.chat_id}: {error}")
+        if not job.future.done():
+            job.future.set_exception(error)
+
+    # Глубина очередей и задержки отправки (оценки сверху медианы и 99-го перцентиля)
+    def stats(self):
+        result = {"retried": self.retried, "paused_for": max(0.0, self._paused_until - time.monotonic())}
+        for priority, lane in LANES.items():
+            result[lane] = {
+                "depth": self.depth[priority],
+                "sent": self.sent[priority],
+                "failed": self.failed[priority],
+                "p50": self.latency[priority].quantile(0.5),
+                "p99": self.latency[priority].quantile(0.99),
+            }
+        return result
@@ -0,0 +1,201 @@
+import json
+import logging
+import marshal
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+
+from vu_index import CampaignEntry, DriverRecord
+
+# Упакованные таблицы «ключ -> значение» для отображения в память (mmap): несколько процессов
+# читают один файл через общий страничный кэш, не разбирая таблицы и не копируя записи.
+# Формат: заголовок, JSON с описанием, смещения ключей, отсортированные ключи (UTF-8),
+# хеш-таблица (номер ключа + 1 в ячейке crc32(ключ) с линейным пробированием, 0 — пусто),
+# смещения значений и значения. На ключ приходится width значений подряд (meta["width"])
+_HEADER = struct.Struct("<4sII6Q")  # magic, версия, число ключей, смещения и размеры разделов
+_OFFSET = struct.Struct("<Q")
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+# Число ячеек хеш-таблицы: степень двойки, заполнение не больше половины
+def _buckets(count):
+    return 1 << max(count * 2 - 1, 1).bit_length()
+
+
+def _hash_table(keys):
+    mask = _buckets(len(keys)) - 1
+    table = array("I", bytes(4 * (mask + 1)))
+    for position, key in enumerate(keys, 1):
+        slot = zlib.crc32(key) & mask
+        while table[slot]:
+            slot = (slot + 1) & mask
+        table[slot] = position
+    return table
+
+
+# Запись таблицы: ключи (bytes) уже отсортированы, values — поток из len(keys) * width значений
+# в том же порядке. Значения пишутся по мере получения, смещения — в конце.
+# Во временный файл и атомарная подмена, поэтому читатели видят либо старый, либо новый файл целиком
+def write_table(path, magic, version, meta, keys, values, width=1):
+    meta = json.dumps({**meta, "width": width}).encode()
+    count = len(keys)
+    hash_table = _hash_table(keys)
+    meta_offset = _HEADER.size
+    key_index_offset = _align(meta_offset + len(meta))
+    keys_offset = key_index_offset + (count + 1) * _OFFSET.size
+    hash_offset = _align(keys_offset + sum(map(len, keys)))
+    value_index_offset = _align(hash_offset + len(hash_table) * hash_table.itemsize)
+    values_offset = value_index_offset + (count * width + 1) * _OFFSET.size
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(_HEADER.pack(magic, version, count, meta_offset, len(meta), key_index_offset, keys_offset,
+                                 value_index_offset, values_offset))
+            f.write(meta)
+            f.write(b"\0" * (key_index_offset - f.tell()))
+            position = 0
+            for key in keys:
+                f.write(_OFFSET.pack(position))
+                position += len(key)
+            f.write(_OFFSET.pack(position))
+            f.writelines(keys)
+            f.write(b"\0" * (hash_offset - f.tell()))
+            f.write(hash_table.tobytes())
+            f.write(b"\0" * (value_index_offset - f.tell()))
+            offsets = array("Q", [0])
+            f.seek(values_offset)
+            for value in values:
+                f.write(value)
+                offsets.append(offsets[-1] + len(value))
+            if len(offsets) != count * width + 1:
+                raise ValueError(f"Ожидалось {count * width} значений, получено {len(offsets) - 1}")
+            f.seek(value_index_offset)
+            f.write(offsets.tobytes())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# Таблица только для чтения поверх mmap: поиск — по хеш-таблице (обычно одно сравнение ключа),
+# значение копируется из отображения только для найденного ключа
+class MappedTable:
+    __slots__ = ("path", "signature", "meta", "_map", "_count", "_width", "_key_offsets", "_keys",
+                 "_hash_table", "_mask", "_value_offsets", "_values")
+
+    def __init__(self, path, magic, version):
+        self.path = path
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self.signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (file_magic, file_version, self._count, meta_offset, meta_size, key_index_offset, keys_offset,
+         value_index_offset, values_offset) = _HEADER.unpack_from(self._map)
+        if file_magic != magic or file_version != version:
+            raise ValueError(f"{path} не является файлом {magic.decode()} версии {version}")
+        self.meta = json.loads(self._map[meta_offset:meta_offset + meta_size])
+        self._width = self.meta.get("width", 1)
+        view = memoryview(self._map)
+        self._key_offsets = view[key_index_offset:keys_offset].cast("Q")
+        self._keys = keys_offset
+        hash_offset = _align(keys_offset + self._key_offsets[self._count])
+        buckets = _buckets(self._count)
+        self._hash_table = view[hash_offset:hash_offset + buckets * 4].cast("I")
+        self._mask = buckets - 1
+        self._value_offsets = view[value_index_offset:values_offset].cast("Q")
+        self._values = values_offset
+
+    def _key(self, position):
+        start = self._keys + self._key_offsets[position]
+        return self._map[start:self._keys + self._key_offsets[position + 1]]
+
+    # Номер ключа (bytes) в таблице или -1
+    def find(self, target):
+        slot = zlib.crc32(target) & self._mask
+        while True:
+            position = self._hash_table[slot]
+            if not position:
+                return -1
+            if self._key(position - 1) == target:
+                return position - 1
+            slot = (slot + 1) & self._mask
+
+    # Значение номер slot (0..width-1) ключа с номером position
+    def value(self, position, slot=0):
+        item = position * self._width + slot
+        return self._map[self._values + self._value_offsets[item]:self._values + self._value_offsets[item + 1]]
+
+    # Подсказка ядру заранее прочитать файл в страничный кэш (прогрев перед приёмом обновлений)
+    def prefetch(self):
+        if hasattr(self._map, "madvise"):
+            self._map.madvise(mmap.MADV_WILLNEED)
+
+    # Файл подменён (пересборка в другом процессе) — пора открыть новый
+    def is_stale(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size) != self.signature
+
+    def __len__(self):
+        return self._count
+
+
+# Упакованный общий индекс акций: значение ключа — кортежи (id акции, поля записи), сериализованные marshal
+MAGIC = b"VUIX"
+VERSION = 2
+
+
+# Запись индекса CampaignIndex в файл
+def write_packed(path, index):
+    keys = sorted(index.entries, key=str.encode)
+    values = (marshal.dumps(tuple((entry.campaign_id, tuple(entry.record)) for entry in index.entries[key]))
+              for key in keys)
+    meta = {
+        "campaigns": index.campaign_sizes(),
+        "marshal_version": marshal.version,
+        "python": list(sys.version_info[:2]),
+    }
+    write_table(path, MAGIC, VERSION, meta, [key.encode() for key in keys], values)
+
+
+# Индекс только для чтения поверх mmap: запись декодируется только для найденного ключа.
+# Интерфейс как у CampaignIndex
+class PackedIndex(MappedTable):
+    __slots__ = ("generation",)
+
+    def __init__(self, path):
+        super().__init__(path, MAGIC, VERSION)
+        self.generation = 0
+        if self.meta["marshal_version"] != marshal.version or tuple(self.meta["python"]) != sys.version_info[:2]:
+            raise ValueError(f"{path} собран другой версией Python {self.meta['python']}, пересоберите его")
+
+    def lookup(self, key):
+        position = self.find(key.encode())
+        if position < 0:
+            return ()
+        value = marshal.loads(self.value(position))
+        return tuple(CampaignEntry(campaign_id, DriverRecord(*fields)) for campaign_id, fields in value)
+
+    def campaign_sizes(self):
+        return dict(self.meta["campaigns"])
+
+
+# Повторное открытие файла (индекса или кэша ответов), если его подменили; None, если файл прежний или не читается
+def reopen_if_stale(table):
+    if not table.is_stale():
+        return None
+    try:
+        return type(table)(table.path)
+    except Exception as e:
+        logging.error(f"Не удалось открыть обновлённый файл {table.path}: {e}")
+        return None
@@ -0,0 +1,67 @@
+import time
+from collections import OrderedDict
+
+
+# Защита от перебора ВУ номеров.
+# Недавние промахи хранятся в ограниченном LRU-кэше с TTL (привязан к поколению индекса),
+# чтобы повторные промахи не искались и не логировались заново. По каждому чату считаются
+# различные промахи за окно window: при превышении max_distinct_misses чат блокируется на block_for секунд
+class ProbeGuard:
+    def __init__(self, window=600, max_distinct_misses=10, block_for=1800, cache_size=10000, cache_ttl=300):
+        self.window = window
+        self.max_distinct_misses = max_distinct_misses
+        self.block_for = block_for
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._misses = OrderedDict()  # ключ -> (поколение индекса, срок годности)
+        self._chats = {}  # chat_id -> (начало окна, множество ключей-промахов)
+        self._blocked = {}  # chat_id -> время окончания блокировки
+        self.blocked_total = 0
+
+    def is_blocked(self, chat_id):
+        until = self._blocked.get(chat_id)
+        if until is None:
+            return False
+        if until > time.monotonic():
+            return True
+        del self._blocked[chat_id]
+        return False
+
+    def is_known_miss(self, key, generation):
+        entry = self._misses.get(key)
+        if entry is None:
+            return False
+        if entry[0] != generation or entry[1] < time.monotonic():
+            del self._misses[key]
+            return False
+        return True
+
+    # Учёт промаха; возвращает True, если чат только что заблокирован
+    def record_miss(self, chat_id, key, generation):
+        now = time.monotonic()
+        self._misses[key] = (generation, now + self.cache_ttl)
+        self._misses.move_to_end(key)
+        if len(self._misses) > self.cache_size:
+            self._misses.popitem(last=False)
+
+        window_start, keys = self._chats.get(chat_id, (now, None))
+        if keys is None or now - window_start > self.window:
+            window_start, keys = now, set()
+            self._chats[chat_id] = (window_start, keys)
+        keys.add(key)
+        if len(keys) > self.max_distinct_misses:
+            del self._chats[chat_id]
+            self._blocked[chat_id] = now + self.block_for
+            self.blocked_total += 1
+            return True
+        return False
+
+    # Удаление истёкших окон и блокировок
+    def prune(self):
+        now = time.monotonic()
+        self._chats = {chat_id: entry for chat_id, entry in self._chats.items() if now - entry[0] <= self.window}
+        self._blocked = {chat_id: until for chat_id, until in self._blocked.items() if until > now}
+
+    def stats(self):
+        return {"cached_misses": len(self._misses), "tracked_chats": len(self._chats),
+                "blocked_chats": len(self._blocked), "blocked_total": self.blocked_total}
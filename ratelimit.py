@@ -0,0 +1,62 @@
+import time
+
+
+# Ограничение частоты по алгоритму GCRA: на каждый ключ хранится одно число —
+# теоретическое время прибытия следующего запроса (TAT). Запрос пропускается,
+# если TAT опережает текущее время не больше чем на допустимый запас (burst - 1 интервал)
+class Gcra:
+    __slots__ = ("interval", "tolerance", "_tat")
+
+    def __init__(self, count, period, burst=1):
+        self.interval = period / count  # Один запрос раз в interval секунд в среднем
+        self.tolerance = self.interval * (burst - 1)
+        self._tat = {}
+
+    def allow(self, key, now):
+        tat = self._tat.get(key, now)
+        if tat < now:
+            tat = now
+        if tat - now > self.tolerance:
+            return False
+        self._tat[key] = tat + self.interval
+        return True
+
+    # Ключи с TAT в прошлом ничем не отличаются от отсутствующих — удаляем их
+    def prune(self, now):
+        expired = [key for key, tat in self._tat.items() if tat <= now]
+        for key in expired:
+            del self._tat[key]
+        return len(expired)
+
+    def __len__(self):
+        return len(self._tat)
+
+
+# Набор лимитов по видам запросов (поиск ВУ, кнопки, непонятный текст и т.д.) со счётчиками отказов
+class RateLimiter:
+    def __init__(self, limits):
+        # limits: вид запроса -> (количество, период в секундах, допустимый всплеск)
+        self._limits = {kind: Gcra(*limit) for kind, limit in limits.items()}
+        self.allowed = dict.fromkeys(limits, 0)
+        self.rejected = dict.fromkeys(limits, 0)
+
+    def allow(self, kind, key):
+        limit = self._limits.get(kind)
+        if limit is None:
+            return True
+        if limit.allow(key, time.monotonic()):
+            self.allowed[kind] += 1
+            return True
+        self.rejected[kind] += 1
+        return False
+
+    def prune(self):
+        now = time.monotonic()
+        return sum(limit.prune(now) for limit in self._limits.values())
+
+    def __len__(self):
+        return sum(len(limit) for limit in self._limits.values())
+
+    def stats(self):
+        return {kind: {"allowed": self.allowed[kind], "rejected": self.rejected[kind], "tracked": len(self._limits[kind])}
+                for kind in self._limits}
@@ -0,0 +1,156 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+from metrics import registry
+from snapshot import load_index
+from vu_index import current_index, publish_source
+
+RELOADS = registry.counter("vu_bot_reloads_total", "Перезагрузки таблиц акций по результату", ("campaign", "result"))
+RELOAD_DURATION = registry.histogram("vu_bot_reload_duration_seconds", "Время загрузки и проверки таблицы акции",
+                                     ("campaign",), buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+
+
+# Перезагрузка таблицы одной акции: события сохранения Excel склеиваются (debounce),
+# файл разбирается в отдельном потоке, новая таблица проверяется и подменяется в общем индексе атомарно.
+# Таблицы других акций при этом не перечитываются. on_publish(index) вызывается с новым общим индексом
+class ExcelReloader:
+    def __init__(self, campaign, debounce=2.0, settle_interval=0.5, min_rows_ratio=0.5, on_publish=None):
+        self.campaign = campaign
+        self.on_publish = on_publish
+        self.excel_path = campaign.source
+        self.debounce = debounce  # Сколько секунд ждать тишины после последнего события
+        self.settle_interval = settle_interval  # Пауза для проверки, что файл дописан
+        self.min_rows_ratio = min_rows_ratio  # Защита от обрезанного файла
+        self._timer = None
+        self._stopped = False
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="excel-reload")
+
+    # Вызывается из потока watchdog на каждое событие (и из reload, если файл ещё пишется):
+    # только перезапускает таймер. После stop() ничего не планируется
+    def schedule(self):
+        with self._lock:
+            if self._stopped:
+                return
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.debounce, self._submit)
+            self._timer.daemon = True
+            self._timer.start()
+
+    # Таймер мог сработать одновременно с stop(): проверка и постановка в пул идут под той же блокировкой,
+    # поэтому в остановленный пул ничего не отправляется
+    def _submit(self):
+        with self._lock:
+            self._timer = None
+            if not self._stopped:
+                self._executor.submit(self.reload)
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        self._executor.shutdown(wait=True)
+
+    # Файл считается дописанным, если его размер и время изменения не меняются
+    def _is_settled(self):
+        before = os.stat(self.excel_path)
+        time.sleep(self.settle_interval)
+        after = os.stat(self.excel_path)
+        return (before.st_size, before.st_mtime_ns) == (after.st_size, after.st_mtime_ns)
+
+    def reload(self):
+        try:
+            if not self._is_settled():
+                logging.info(f"Файл {self.excel_path} ещё записывается, перезагрузка отложена.")
+                RELOADS.inc(self.campaign.id, "deferred")
+                self.schedule()
+                return None
+            started = time.perf_counter()
+            index = load_index(self.excel_path, **self.campaign.index_options)
+        except Exception as e:
+            RELOADS.inc(self.campaign.id, "error")
+            logging.error(f"Ошибка при обновлении данных: {e}")
+            return None
+
+        current = current_index()
+        previous = current.sources.get(self.campaign.id)
+        previous_rows = len(previous) if previous is not None else 0
+        if len(index) == 0:
+            RELOADS.inc(self.campaign.id, "rejected")
+            logging.error(f"Файл {self.excel_path} не содержит записей, остаётся поколение {current.generation}.")
+            return None
+        if len(index) < previous_rows * self.min_rows_ratio:
+            RELOADS.inc(self.campaign.id, "rejected")
+            logging.error(f"В файле {self.excel_path} {len(index)} записей вместо {previous_rows}, "
+                          f"похоже на обрезанный файл. Остаётся поколение {current.generation}.")
+            return None
+
+        published = publish_source(self.campaign.id, index)
+        if self.on_publish is not None:
+            self.on_publish(published)
+        duration = time.perf_counter() - started
+        RELOADS.inc(self.campaign.id, "ok")
+        RELOAD_DURATION.labels(self.campaign.id).observe(duration)
+        logging.info(f"Акция {self.campaign.id}: файл {self.excel_path} обновлён и перезагружен, "
+                     f"поколение {published.generation}, {len(index)} записей, {duration:.3f} с.")
+        return index
+
+
+# Наблюдатель за обновлением таблиц акций: файл разбирается в ExcelReloader своей акции вне цикла событий
+class ExcelUpdateHandler(FileSystemEventHandler):
+    def __init__(self, reloaders):
+        self.reloaders = reloaders  # Абсолютный путь к таблице -> ExcelReloader акций, которые её используют
+
+    def _check(self, path):
+        for reloader in self.reloaders.get(os.path.abspath(path), ()):
+            reloader.schedule()
+
+    def on_modified(self, event):
+        self._check(event.src_path)
+
+    def on_created(self, event):
+        self._check(event.src_path)
+
+    # Excel сохраняет файл через временный файл и переименование
+    def on_moved(self, event):
+        self._check(event.dest_path)
+
+    # Отмена отложенных перезагрузок и ожидание текущей (после остановки Observer)
+    def stop(self):
+        for reloaders in self.reloaders.values():
+            for reloader in reloaders:
+                reloader.stop()
+
+
+# Наблюдение за таблицами всех акций (одиночный бот и ingress кластера): у каждой акции свой ExcelReloader,
+# on_publish(index) вызывается после каждой перезагрузки. Возвращает (Observer, ExcelUpdateHandler)
+def watch_campaign_files(campaigns, on_publish=None):
+    observer = Observer()
+    reloaders = {}
+    for campaign in campaigns:
+        reloader = ExcelReloader(campaign, on_publish=on_publish)
+        reloaders.setdefault(os.path.abspath(campaign.source), []).append(reloader)
+    handler = ExcelUpdateHandler(reloaders)
+    for directory in {os.path.dirname(path) for path in reloaders}:
+        observer.schedule(handler, path=directory, recursive=False)
+    observer.start()
+    logging.info("Наблюдение за обновлением таблиц акций запущено.")
+    return observer, handler
+
+
+# Остановка наблюдения: новые события не принимаются, затем отменяются отложенные перезагрузки
+# и дожидается текущая (блокирует, из цикла событий — через asyncio.to_thread)
+def stop_watching(watcher):
+    observer, handler = watcher
+    observer.stop()
+    observer.join()
+    handler.stop()
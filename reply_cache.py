@@ -0,0 +1,273 @@
+import argparse
+import datetime
+import logging
+import math
+import os
+import string
+import sys
+import time
+
+from packed_index import MappedTable, write_table
+
+# Кэш готовых ответов: ответ водителю полностью определяется таблицами акций, реестром акций,
+# шаблонами и языком, поэтому для каждого ВУ номера и каждого языка он собирается заранее
+# и хранится в упакованной таблице (packed_index.write_table) — поиск ответа сводится к поиску
+# по хеш-таблице в mmap (crc32, линейное пробирование) и склейке строк, без разбора шаблонов
+# и форматирования на каждый запрос.
+# Общий текст ответа (заголовок, разделы акций с периодами и правилами, подпись) одинаков для всех
+# водителей с тем же набором акций, поэтому хранится один раз в описании таблицы как «раскладка»
+# (постоянные куски между полями), а на ВУ номер и язык — только номер раскладки и отформатированные
+# поля записи: так кэш на 200 тыс. водителей занимает десятки мегабайт, а не сотни.
+# В кэш попадают только номера, найденные хотя бы в одной идущей акции; промах по кэшу
+# обрабатывается обычным путём (поиск в индексе, защита от перебора, ответ «не найден»)
+MAGIC = b"VURC"
+VERSION = 2
+_SEPARATOR = "\0"  # Между номером раскладки и полями в значении таблицы
+_formatter = string.Formatter()
+
+
+# Ответ для водителя, найденного в акциях entries: заголовок, по разделу на акцию, подпись
+def render_found(entries, language, campaigns, templates):
+    sections = [campaigns[entry.campaign_id].found(entry.record, language) for entry in entries]
+    header = templates.text("found_header", language).format(name=entries[0].record.name)
+    return "\n\n".join([header, *sections, templates.text("found_footer", language)])
+
+
+# Последний день, до которого набор идущих акций не меняется (None — не меняется никогда)
+def active_until(campaigns, today):
+    boundaries = [campaign.active_from - datetime.timedelta(days=1) for campaign in campaigns
+                  if campaign.active_from is not None and campaign.active_from > today]
+    boundaries += [campaign.active_until for campaign in campaigns
+                   if campaign.active_until is not None and campaign.active_until >= today]
+    return min(boundaries, default=None)
+
+
+# Отпечаток исходных файлов (таблицы акций, реестр, шаблоны): кэш, собранный заранее,
+# подходит, только если ни один из них не менялся
+def fingerprint(paths):
+    result = []
+    for path in sorted(set(paths)):
+        try:
+            stat = os.stat(path)
+            result.append([os.path.basename(path), stat.st_size, stat.st_mtime_ns])
+        except FileNotFoundError:
+            result.append([os.path.basename(path), None, None])
+    return result
+
+
+def _format_field(field_name, spec, conversion, values):
+    value, _ = _formatter.get_field(field_name, (), values)
+    return _formatter.format_field(_formatter.convert_field(value, conversion), spec)
+
+
+# Шаблон str.format, разобранный на постоянный текст и поля: literals на один длиннее fields.
+# Поля из constants подставляются сразу и становятся частью постоянного текста
+def split_template(text, constants=None):
+    literals, fields = [""], []
+    for literal, field_name, spec, conversion in _formatter.parse(text):
+        literals[-1] += literal
+        if field_name is None:
+            continue
+        if "{" in spec:
+            raise ValueError(f"Вложенные поля в формате {field_name} не поддерживаются кэшем ответов")
+        if constants and field_name.partition(".")[0].partition("[")[0] in constants:
+            literals[-1] += _format_field(field_name, spec, conversion, constants)
+        else:
+            fields.append((field_name, spec, conversion))
+            literals.append("")
+    return literals, fields
+
+
+# Раскладка ответа render_found для набора акций и языка: постоянные куски всего ответа
+# и поля по частям — (номер части: 0 — заголовок, i — раздел i-й акции, поля части)
+def _layout(campaign_ids, language, campaigns, templates):
+    parts = [split_template(templates.text("found_header", language))]
+    for campaign_id in campaign_ids:
+        campaign = campaigns[campaign_id]
+        parts.append(split_template(campaign.found_template(language), campaign.constants))
+    parts.append(([templates.text("found_footer", language)], []))
+    literals, fields = [""], []
+    for number, (part_literals, part_fields) in enumerate(parts):
+        literals[-1] += ("\n\n" if number else "") + part_literals[0]
+        literals.extend(part_literals[1:])
+        fields.extend((number, field) for field in part_fields)
+    return literals, fields
+
+
+# Поля ответа для водителя, найденного в акциях entries, по раскладке
+def _layout_values(fields, entries):
+    header = {"name": entries[0].record.name}
+    records = [header, *(entry.record._asdict() for entry in entries)]
+    return [_format_field(*field, records[number]) for number, field in fields]
+
+
+# Сборка кэша по общему индексу CampaignIndex для всех языков каталога шаблонов; extra — дополнительные
+# поля описания. Ответ, который не удалось отформатировать, не сохраняется (пустое значение) — его соберёт
+# обычный путь; первая такая ошибка логируется с ВУ номером и трассировкой
+def write_reply_cache(path, index, campaigns, templates, sources=(), today=None, extra=None):
+    today = today or datetime.date.today()
+    active = {campaign.id for campaign in campaigns.active(today)}
+    languages = templates.languages
+    keys = []
+    combinations = {}  # Ключ -> id идущих акций, в которых он есть
+    for key in sorted(index.entries, key=str.encode):
+        campaign_ids = tuple(entry.campaign_id for entry in index.entries[key] if entry.campaign_id in active)
+        if campaign_ids:
+            keys.append(key)
+            combinations[key] = campaign_ids
+
+    # Раскладки на каждый встретившийся набор акций и язык: (номер, поля) или ошибка разбора шаблонов
+    layouts = {}
+    literals = []
+    for campaign_ids in dict.fromkeys(combinations.values()):
+        for language in languages:
+            try:
+                layout_literals, fields = _layout(campaign_ids, language, campaigns, templates)
+            except Exception as e:
+                layouts[campaign_ids, language] = e
+                continue
+            layouts[campaign_ids, language] = (len(literals), fields)
+            literals.append(layout_literals)
+    failed = 0
+
+    def replies():
+        nonlocal failed
+        for key in keys:
+            campaign_ids = combinations[key]
+            entries = tuple(entry for entry in index.entries[key] if entry.campaign_id in active)
+            for language in languages:
+                try:
+                    layout = layouts[campaign_ids, language]
+                    if isinstance(layout, Exception):
+                        raise layout
+                    number, fields = layout
+                    values = _layout_values(fields, entries)
+                    if any(_SEPARATOR in value for value in values):
+                        raise ValueError("Поле записи содержит символ NUL")
+                    yield _SEPARATOR.join([str(number), *values]).encode()
+                except Exception:
+                    if not failed:
+                        logging.exception(f"Кэш ответов {path}: ответ для ВУ номера {key} ({language}) не отформатировался")
+                    failed += 1
+                    yield b""
+
+    until = active_until(campaigns, today)
+    meta = {
+        "languages": languages,
+        "default_language": templates.default_language,
+        "valid_from": today.isoformat(),
+        "valid_until": until.isoformat() if until else None,
+        "sources": fingerprint(sources),
+        "layouts": literals,
+        **(extra or {}),
+    }
+    write_table(path, MAGIC, VERSION, meta, [key.encode() for key in keys], replies(), width=len(languages))
+    if failed:
+        logging.error(f"Кэш ответов {path}: {failed} ответов не отформатировались, они будут собираться при запросе")
+    return len(keys)
+
+
+# Местная полночь в начале дня day (время Unix)
+def _midnight(day):
+    return time.mktime(day.timetuple())
+
+
+# Кэш ответов только для чтения: ответ по нормализованному ВУ номеру и языку или None
+class ReplyCache(MappedTable):
+    __slots__ = ("generation", "valid_from", "valid_until", "_since", "_expires", "_slots", "_default_slot", "_layouts")
+
+    def __init__(self, path):
+        super().__init__(path, MAGIC, VERSION)
+        self.generation = 0  # Поколение общего индекса, по которому собран кэш (в этом процессе)
+        self.valid_from = datetime.date.fromisoformat(self.meta["valid_from"])
+        until = self.meta["valid_until"]
+        self.valid_until = datetime.date.fromisoformat(until) if until else None
+        # Границы в секундах: проверка на каждый запрос дешевле, чем date.today()
+        self._since = _midnight(self.valid_from)
+        self._expires = _midnight(self.valid_until + datetime.timedelta(days=1)) if self.valid_until else math.inf
+        self._slots = {language: slot for slot, language in enumerate(self.meta["languages"])}
+        self._default_slot = self._slots[self.meta["default_language"]]
+        self._layouts = [tuple(literals) for literals in self.meta["layouts"]]
+
+    # Набор идущих акций тот же, что при сборке
+    def is_current(self, now=None):
+        now = time.time() if now is None else now
+        return self._since <= now < self._expires
+
+    def matches(self, sources):
+        return self.meta["sources"] == fingerprint(sources)
+
+    def reply(self, key, language):
+        position = self.find(key.encode())
+        if position < 0:
+            return None
+        value = self.value(position, self._slots.get(language, self._default_slot))
+        if not value:
+            return None
+        number, *values = value.decode().split(_SEPARATOR)
+        literals = self._layouts[int(number)]
+        parts = [None] * (len(literals) + len(values))
+        parts[::2] = literals
+        parts[1::2] = values
+        return "".join(parts)
+
+
+# Открытие кэша, собранного заранее, или пересборка, если он устарел или не читается
+def open_reply_cache(path, index, campaigns, templates, sources=(), today=None):
+    try:
+        cache = ReplyCache(path)
+        if cache.is_current(_midnight(today) if today else None) and cache.matches(sources):
+            logging.info(f"Кэш ответов {path} актуален: {len(cache)} ВУ номеров")
+            return cache
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logging.warning(f"Кэш ответов {path} не читается и будет пересобран: {e}")
+    return build_reply_cache(path, index, campaigns, templates, sources, today)
+
+
+def build_reply_cache(path, index, campaigns, templates, sources=(), today=None, extra=None):
+    started = time.perf_counter()
+    count = write_reply_cache(path, index, campaigns, templates, sources, today, extra)
+    cache = ReplyCache(path)
+    logging.info(f"Кэш ответов {path} собран: {count} ВУ номеров, языки {', '.join(cache.meta['languages'])}, "
+                 f"{os.path.getsize(path) / 1024 / 1024:.1f} МБ, {time.perf_counter() - started:.3f} с")
+    return cache
+
+
+# Исходные файлы кэша для отпечатка
+def source_files(campaigns, campaigns_path, templates_path):
+    return [campaign.source for campaign in campaigns] + [campaigns_path, templates_path]
+
+
+# Сборка кэша перед деплоем: python reply_cache.py (таблицы берутся через снимки, как при запуске бота)
+def main(argv=None):
+    from campaigns import CampaignRegistry
+    from snapshot import load_index
+    from templates import TemplateCatalog
+    from vu_index import CampaignIndex
+
+    parser = argparse.ArgumentParser(description="Сборка кэша готовых ответов для всех ВУ номеров")
+    parser.add_argument("--campaigns", default="campaigns.json", help="реестр акций")
+    parser.add_argument("--templates", default="templates.json", help="каталог шаблонов")
+    parser.add_argument("--output", default="replies.cache", help="файл кэша (REPLY_CACHE бота)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    campaigns = CampaignRegistry.load(args.campaigns)
+    templates = TemplateCatalog.load(args.templates)
+    sources = {}
+    for campaign in campaigns:
+        try:
+            sources[campaign.id] = load_index(campaign.source, **campaign.index_options)
+        except (FileNotFoundError, ValueError) as e:
+            print(f"Акция {campaign.id}: файл {campaign.source} не загружен: {e}", file=sys.stderr)
+            return 1
+    cache = build_reply_cache(args.output, CampaignIndex(sources), campaigns, templates,
+                              source_files(campaigns, args.campaigns, args.templates))
+    print(f"{args.output}: {len(cache)} ВУ номеров, действителен до {cache.valid_until or 'смены данных'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
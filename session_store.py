@@ -0,0 +1,283 @@
+import asyncio
+import heapq
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+# Состояние одного пользователя (по chat_id)
+class Session:
+    __slots__ = ("language", "last_activity", "last_seen")
+
+    def __init__(self, language=None, last_activity=None, last_seen=0.0):
+        self.language = language
+        self.last_activity = last_activity  # Время последней активности для напоминаний (None — напоминать не нужно)
+        self.last_seen = last_seen  # Время последнего обращения к сессии, по нему работает TTL
+
+
+# Хранилище сессий в памяти. Сессии упорядочены по last_seen,
+# поэтому вытеснение устаревших проходит только по устаревшим записям
+class MemorySessionStore:
+    def __init__(self, ttl=24 * 60 * 60):
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Бэкенд может подгрузить сессию, которой нет в памяти
+    def _load(self, chat_id):
+        return None
+
+    # Подготовка сессии до обработчиков обновления (вызывается из цикла событий)
+    async def preload(self, chat_id):
+        pass
+
+    def _mark_dirty(self, chat_id):
+        pass
+
+    def _session(self, chat_id):
+        session = self._sessions.get(chat_id)
+        if session is None:
+            session = self._load(chat_id) or Session()
+            self._sessions[chat_id] = session
+        else:
+            self._sessions.move_to_end(chat_id)
+        session.last_seen = time.time()
+        return session
+
+    def get_language(self, chat_id, default=None):
+        with self._lock:
+            session = self._session(chat_id)
+        return session.language or default
+
+    def set_language(self, chat_id, language):
+        with self._lock:
+            self._session(chat_id).language = language
+            self._mark_dirty(chat_id)
+
+    def touch(self, chat_id, when=None):
+        with self._lock:
+            self._session(chat_id).last_activity = when or time.time()
+            self._mark_dirty(chat_id)
+
+    def clear_activity(self, chat_id):
+        with self._lock:
+            session = self._sessions.get(chat_id)
+            if session is not None and session.last_activity is not None:
+                session.last_activity = None
+                self._mark_dirty(chat_id)
+
+    # Снимок (chat_id, время последней активности) для проверки неактивности
+    def activities(self):
+        with self._lock:
+            return [(chat_id, session.last_activity) for chat_id, session in self._sessions.items()
+                    if session.last_activity is not None]
+
+    # Регистрация чата (например, после /start), чтобы он попадал в рассылки
+    def register(self, chat_id):
+        with self._lock:
+            self._session(chat_id)
+            self._mark_dirty(chat_id)
+
+    # Очередная порция известных chat_id по возрастанию, начиная после after (для рассылок)
+    def chat_ids(self, after=None, limit=500):
+        with self._lock:
+            keys = list(self._sessions)
+        if after is not None:
+            keys = [chat_id for chat_id in keys if chat_id > after]
+        return heapq.nsmallest(limit, keys)
+
+    def _can_evict(self, chat_id):
+        return True
+
+    # Вытеснение сессий, к которым не обращались дольше ttl секунд
+    def evict_expired(self, now=None):
+        deadline = (now or time.time()) - self.ttl
+        evicted = 0
+        with self._lock:
+            skipped = []
+            while self._sessions:
+                chat_id, session = next(iter(self._sessions.items()))
+                if session.last_seen > deadline:
+                    break
+                self._sessions.popitem(last=False)
+                if self._can_evict(chat_id):
+                    evicted += 1
+                else:
+                    skipped.append((chat_id, session))
+            # Ещё не записанные сессии возвращаем в начало, они будут вытеснены после записи
+            for chat_id, session in reversed(skipped):
+                self._sessions[chat_id] = session
+                self._sessions.move_to_end(chat_id, last=False)
+        return evicted
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# Хранилище сессий в SQLite (WAL) с отложенной пакетной записью:
+# обработчики меняют только память, фоновый поток раз в flush_interval секунд пишет изменения на диск
+class SqliteSessionStore(MemorySessionStore):
+    def __init__(self, path, ttl=24 * 60 * 60, flush_interval=1.0, owns=None):
+        super().__init__(ttl)
+        self.path = path
+        self.owns = owns  # Фильтр chat_id для прогрева, когда базу делят несколько процессов
+        self.flush_interval = flush_interval
+        self._dirty = set()
+        self._inflight = set()  # Сессии, которые сейчас записываются на диск
+        self._flush_lock = threading.Lock()
+        self._closed = threading.Event()
+
+        # Отдельные соединения для записи (фоновый поток) и чтения (обработчики):
+        # в режиме WAL чтение не ждёт, пока идёт запись
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                chat_id INTEGER PRIMARY KEY,
+                language TEXT,
+                last_activity REAL,
+                last_seen REAL NOT NULL
+            )
+        """)
+        self._db_lock = threading.Lock()
+        self._reader = sqlite3.connect(path, check_same_thread=False)
+        self._reader_lock = threading.Lock()
+        self._warm_up()
+
+        self._flusher = threading.Thread(target=self._flush_loop, name="session-flush", daemon=True)
+        self._flusher.start()
+
+    # При старте в память поднимаются только сессии, активные в пределах ttl
+    def _warm_up(self):
+        rows = self._db.execute(
+            "SELECT chat_id, language, last_activity, last_seen FROM sessions "
+            "WHERE last_seen > ? ORDER BY last_seen",
+            (time.time() - self.ttl,),
+        ).fetchall()
+        if self.owns is not None:
+            rows = [row for row in rows if self.owns(row[0])]
+        for chat_id, language, last_activity, last_seen in rows:
+            self._sessions[chat_id] = Session(language, last_activity, last_seen)
+        logging.info(f"Загружено сессий из {self.path}: {len(rows)}")
+
+    def _read(self, chat_id):
+        with self._reader_lock:
+            return self._reader.execute(
+                "SELECT language, last_activity, last_seen FROM sessions WHERE chat_id = ?",
+                (chat_id,),
+            ).fetchone()
+
+    # Сессия, вытесненная из памяти, или новый чат: чтение с диска в отдельном потоке, чтобы
+    # занятая база (контрольная точка WAL, запись другого процесса кластера) не останавливала цикл событий.
+    # Для чата, которого нет на диске, в памяти сразу создаётся пустая сессия — повторно диск не читается
+    async def preload(self, chat_id):
+        if chat_id in self._sessions:
+            return
+        row = await asyncio.to_thread(self._read, chat_id)
+        with self._lock:
+            if chat_id not in self._sessions:
+                self._sessions[chat_id] = Session(*row) if row else Session(last_seen=time.time())
+
+    # Запасной путь для вызовов без preload: чтение по первичному ключу (вызывается под self._lock)
+    def _load(self, chat_id):
+        row = self._read(chat_id)
+        return Session(*row) if row else None
+
+    def _mark_dirty(self, chat_id):
+        self._dirty.add(chat_id)
+
+    def _can_evict(self, chat_id):
+        return chat_id not in self._dirty and chat_id not in self._inflight
+
+    # Записи из фонового потока, chat_ids (рассылка) и close идут по одной: иначе вторая запись
+    # подменила бы _inflight первой, а при ошибке вернула бы в _dirty чужой пакет
+    def flush(self):
+        with self._flush_lock:
+            return self._write_dirty()
+
+    def _write_dirty(self):
+        with self._lock:
+            if not self._dirty:
+                return 0
+            rows = []
+            for chat_id in self._dirty:
+                session = self._sessions.get(chat_id)
+                if session is not None:
+                    rows.append((chat_id, session.language, session.last_activity, session.last_seen))
+            self._inflight, self._dirty = self._dirty, set()
+        try:
+            with self._db_lock:
+                self._db.execute("BEGIN IMMEDIATE")  # Базу могут делить процессы кластера
+                try:
+                    self._db.executemany("""
+                        INSERT INTO sessions (chat_id, language, last_activity, last_seen)
+                        VALUES (?, ?, ?, ?)
+                        ON CONFLICT(chat_id) DO UPDATE SET
+                            language = excluded.language,
+                            last_activity = excluded.last_activity,
+                            last_seen = excluded.last_seen
+                    """, rows)
+                    self._db.execute("COMMIT")
+                except BaseException:
+                    if self._db.in_transaction:
+                        self._db.execute("ROLLBACK")
+                    raise
+        except BaseException:
+            # Запись не удалась (например, database is locked): сессии снова помечаются изменёнными
+            # и попадут в следующую запись
+            with self._lock:
+                self._dirty |= self._inflight
+            raise
+        finally:
+            with self._lock:
+                self._inflight = set()
+        return len(rows)
+
+    # Все чаты берутся с диска, включая вытесненные из памяти
+    def chat_ids(self, after=None, limit=500):
+        self.flush()
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT chat_id FROM sessions WHERE chat_id > ? ORDER BY chat_id LIMIT ?",
+                (after if after is not None else -2 ** 63, limit),
+            ).fetchall()
+        return [chat_id for chat_id, in rows]
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Ошибка при записи сессий в {self.path}: {e}")
+
+    def close(self):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._flusher.join()
+        self.flush()
+        with self._reader_lock:
+            self._reader.close()
+        with self._db_lock:
+            self._db.close()
+
+
+# Выбор хранилища по переменным окружения SESSION_STORE (sqlite/memory), SESSION_DB и SESSION_TTL
+def create_session_store(owns=None):
+    backend = os.getenv("SESSION_STORE", "sqlite")
+    ttl = float(os.getenv("SESSION_TTL", 24 * 60 * 60))
+    if backend == "memory":
+        return MemorySessionStore(ttl=ttl)
+    if backend == "sqlite":
+        return SqliteSessionStore(os.getenv("SESSION_DB", "sessions.db"), ttl=ttl, owns=owns)
+    raise ValueError(f"Неизвестное хранилище сессий: {backend}")
@@ -0,0 +1,150 @@
+import argparse
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import time
+
+from ingest import read_index
+from vu_index import COLUMNS, VU_COLUMN, VuIndex
+
+# Бинарный снимок индекса рядом с таблицей (xlsx, csv, parquet), чтобы не разбирать её при каждом запуске
+SNAPSHOT_SUFFIX = ".snapshot"
+SNAPSHOT_VERSION = 4
+
+
+def snapshot_path(excel_path):
+    return excel_path + SNAPSHOT_SUFFIX
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Описание разбора таблицы: снимок, собранный с другими колонками, не подходит
+def _mapping(columns, vu_column, orders_per_coupon):
+    return {"vu": vu_column, "columns": dict(COLUMNS if columns is None else columns),
+            "orders_per_coupon": orders_per_coupon}
+
+
+# Заголовок снимка: по нему определяем, соответствует ли снимок текущему файлу Excel
+def _source_header(excel_path, stat, sha256, mapping):
+    return {
+        "version": SNAPSHOT_VERSION,
+        "source": os.path.basename(excel_path),
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "sha256": sha256,
+        "mapping": mapping,
+    }
+
+
+def read_snapshot(path):
+    with open(path, "rb") as f:
+        header = pickle.load(f)
+        records = pickle.load(f)
+    return header, records
+
+
+def write_snapshot(path, header, records):
+    # Пишем во временный файл и атомарно подменяем, чтобы не оставить полузаписанный снимок
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(records, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+# Таблица (xlsx, csv или parquet) читается потоково, без DataFrame
+def build_snapshot(excel_path, stat=None, sha256=None, columns=None, vu_column=VU_COLUMN, orders_per_coupon=None):
+    stat = stat or os.stat(excel_path)
+    sha256 = sha256 or file_sha256(excel_path)
+    index = read_index(excel_path, columns, vu_column, orders_per_coupon)
+    header = _source_header(excel_path, stat, sha256, _mapping(columns, vu_column, orders_per_coupon))
+    write_snapshot(snapshot_path(excel_path), header, index.records)
+    return index
+
+
+# Загрузка индекса: из снимка, если он актуален, иначе из Excel с пересборкой снимка.
+# columns, vu_column и orders_per_coupon описывают колонки таблицы (см. VuIndex.from_rows)
+def load_index(excel_path, columns=None, vu_column=VU_COLUMN, orders_per_coupon=None):
+    started = time.perf_counter()
+    mapping = _mapping(columns, vu_column, orders_per_coupon)
+    stat = os.stat(excel_path)  # FileNotFoundError, если файла Excel нет
+    path = snapshot_path(excel_path)
+    sha256 = None
+    try:
+        header, records = read_snapshot(path)
+    except FileNotFoundError:
+        header, records = None, None
+    except Exception as e:
+        logging.warning(f"Снимок {path} повреждён и будет пересобран: {e}")
+        header, records = None, None
+
+    if header is not None and header.get("version") == SNAPSHOT_VERSION and header.get("mapping") == mapping:
+        if header["mtime_ns"] == stat.st_mtime_ns and header["size"] == stat.st_size:
+            index = VuIndex(records)
+            logging.info(f"Индекс загружен из снимка {path} за {time.perf_counter() - started:.3f} с ({len(index)} записей)")
+            return index
+        # Файл могли просто перезаписать без изменений: сверяем содержимое
+        sha256 = file_sha256(excel_path)
+        if header["sha256"] == sha256:
+            write_snapshot(path, _source_header(excel_path, stat, sha256, mapping), records)
+            index = VuIndex(records)
+            logging.info(f"Индекс загружен из снимка {path} за {time.perf_counter() - started:.3f} с ({len(index)} записей)")
+            return index
+
+    index = build_snapshot(excel_path, stat, sha256, columns, vu_column, orders_per_coupon)
+    logging.info(f"Снимок {path} пересобран из {excel_path} за {time.perf_counter() - started:.3f} с ({len(index)} записей)")
+    return index
+
+
+# Параметры разбора для отдельного файла: как у акции из реестра с этой таблицей (иначе снимок,
+# собранный с другими параметрами, бот счёл бы устаревшим), для прочих файлов — стандартные колонки
+def _file_options(paths, campaigns_path):
+    from campaigns import CampaignRegistry
+
+    try:
+        campaigns = CampaignRegistry.load(campaigns_path)
+    except FileNotFoundError:
+        campaigns = ()
+    options = {os.path.realpath(campaign.source): campaign.index_options for campaign in campaigns}
+    return [(path, options.get(os.path.realpath(path), {})) for path in paths]
+
+
+# Предварительная сборка снимков перед деплоем: python snapshot.py (таблицы всех акций из campaigns.json)
+# или python snapshot.py result_with_ids.xlsx (отдельные файлы; колонки — как у акции с этой таблицей)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сборка бинарных снимков таблиц акций")
+    parser.add_argument("files", nargs="*", help="файлы Excel; по умолчанию — таблицы всех акций")
+    parser.add_argument("--campaigns", default="campaigns.json", help="реестр акций")
+    parser.add_argument("--force", action="store_true", help="пересобрать, даже если снимок актуален")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.files:
+        sources = _file_options(args.files, args.campaigns)
+    else:
+        from campaigns import CampaignRegistry
+        sources = [(campaign.source, campaign.index_options) for campaign in CampaignRegistry.load(args.campaigns)]
+    status = 0
+    for excel_path, options in sources:
+        try:
+            if args.force:
+                index = build_snapshot(excel_path, **options)
+            else:
+                index = load_index(excel_path, **options)
+            print(f"{snapshot_path(excel_path)}: {len(index)} записей")
+        except Exception as e:
+            print(f"Ошибка при сборке снимка для {excel_path}: {e}", file=sys.stderr)
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,40 @@
+import json
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+
+def _build_keyboard(rows):
+    return InlineKeyboardMarkup([[InlineKeyboardButton(**button) for button in row] for row in rows])
+
+
+# Каталог локализованных ответов, загружается один раз при старте:
+# статические тексты и клавиатуры собираются заранее (тексты акций — в campaigns.json).
+# Отсутствующие в языке ключи берутся из языка по умолчанию
+class TemplateCatalog:
+    def __init__(self, data):
+        self.default_language = data["default_language"]
+        common = data.get("common", {})
+        languages = data["languages"]
+        default = languages[self.default_language]
+
+        self._texts = {}
+        self._keyboards = {}
+        for language, catalog in languages.items():
+            self._texts[language] = {**common.get("texts", {}), **default.get("texts", {}), **catalog.get("texts", {})}
+            keyboards = {**common.get("keyboards", {}), **default.get("keyboards", {}), **catalog.get("keyboards", {})}
+            self._keyboards[language] = {name: _build_keyboard(rows) for name, rows in keyboards.items()}
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    @property
+    def languages(self):
+        return list(self._texts)
+
+    def text(self, key, language):
+        return (self._texts.get(language) or self._texts[self.default_language])[key]
+
+    def keyboard(self, name, language):
+        return (self._keyboards.get(language) or self._keyboards[self.default_language])[name]
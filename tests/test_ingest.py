@@ -0,0 +1,25 @@
+from ingest import read_index
+from vu_index import DriverRecord
+
+HEADER = "ВУ номер;Имя;Город;Количество заказов;Количество купонов;Номер купона\n"
+
+
+# Пустая строка в выгрузке пропускается, короткая строка дополняется пустыми ячейками
+def test_csv_with_blank_and_short_rows(tmp_path):
+    path = tmp_path / "drivers.csv"
+    path.write_text(HEADER + "AB 123;Иван;Алматы;250;2;1, 2\n\n\nCD456;Пётр;Астана\n", encoding="utf-8")
+
+    index = read_index(str(path))
+    assert len(index) == 2
+    assert index.get("ab123") == DriverRecord("Иван", "Алматы", 250, 2, "1, 2")
+    assert index.get("CD456") == DriverRecord("Пётр", "Астана", None, None, None)
+
+
+# Купоны без своей колонки для короткой строки не считаются
+def test_csv_short_row_without_orders(tmp_path):
+    path = tmp_path / "drivers.csv"
+    path.write_text("ВУ номер;Имя;Количество заказов\nEF789\nGH012;Анна;300\n", encoding="utf-8")
+
+    index = read_index(str(path), {"name": "Имя", "orders": "Количество заказов"}, orders_per_coupon=100)
+    assert index.get("EF789") == DriverRecord(None, None, None, None, None)
+    assert index.get("GH012") == DriverRecord("Анна", None, 300, 3, None)
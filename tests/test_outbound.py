@@ -0,0 +1,122 @@
+import asyncio
+import time
+import types
+from datetime import timedelta
+
+import pytest
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+import outbound
+from lifecycle import retry_after_seconds
+from outbound import PRIORITY_BROADCAST, PRIORITY_INTERACTIVE, PRIORITY_NUDGE, OutboundDispatcher
+
+
+# Bot API для диспетчера: запоминает отправки (chat_id, текст, время), ошибки берёт из очереди errors
+class FakeBot:
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        if self.errors:
+            error = self.errors.pop(0)
+            if error is not None:
+                raise error
+        self.sent.append((chat_id, text, time.monotonic()))
+        return text
+
+
+async def _run(dispatcher, *messages):
+    dispatcher.start()
+    try:
+        futures = [dispatcher.send_message(chat_id, text, priority=priority) for chat_id, text, priority in messages]
+        results = await asyncio.wait_for(asyncio.gather(*futures, return_exceptions=True), 5)
+        return results, await dispatcher.drain(1)
+    finally:
+        await dispatcher.stop()
+
+
+def _dispatcher(bot, **kwargs):
+    return OutboundDispatcher(bot, **{"workers": 2, "global_rate": 1000, "chat_rate": 1000, "chat_burst": 100, **kwargs})
+
+
+# Флуд-контроль: отправка приостанавливается на retry_after, запрос повторяется первым в своей очереди
+def test_retry_after_pauses_and_requeues():
+    bot = FakeBot(RetryAfter(timedelta(milliseconds=200)))
+    dispatcher = _dispatcher(bot, workers=1)
+    started = time.monotonic()
+    results, left = asyncio.run(_run(dispatcher, (1, "first", PRIORITY_INTERACTIVE), (2, "second", PRIORITY_INTERACTIVE)))
+
+    assert results == ["first", "second"] and left == 0
+    assert [text for _, text, _ in bot.sent] == ["first", "second"]
+    assert bot.sent[0][2] - started >= 0.2
+    assert dispatcher.retried == 1 and dispatcher.sent[PRIORITY_INTERACTIVE] == 2
+
+
+# Сетевая ошибка: повтор после паузы вне очереди; drain ждёт и отложенный запрос
+def test_network_error_is_retried_with_backoff(monkeypatch):
+    monkeypatch.setattr(outbound, "random", types.SimpleNamespace(random=lambda: 0.0))  # Пауза без добавки: 1 с
+    bot = FakeBot(NetworkError("timed out"))
+    dispatcher = _dispatcher(bot)
+
+    async def scenario():
+        dispatcher.start()
+        try:
+            future = dispatcher.send_message(1, "hello")
+            await asyncio.sleep(0.1)
+            assert dispatcher._delayed == 1 and not future.done()
+            assert await dispatcher.drain(0.1) == 1  # Не успел уйти
+            assert await dispatcher.drain(5) == 0
+            return await future
+        finally:
+            await dispatcher.stop()
+
+    started = time.monotonic()
+    assert asyncio.run(scenario()) == "hello"
+    assert bot.sent[0][2] - started >= 1.0
+    assert dispatcher.retried == 1 and dispatcher._delayed == 0
+
+
+# После max_attempts сетевых ошибок и сразу при BadRequest запрос завершается ошибкой
+def test_failures_are_reported_to_the_caller():
+    bot = FakeBot(NetworkError("timed out"), BadRequest("Chat not found"))
+    dispatcher = _dispatcher(bot, workers=1, max_attempts=1)
+    results, left = asyncio.run(_run(dispatcher, (1, "lost", PRIORITY_INTERACTIVE), (2, "bad", PRIORITY_BROADCAST),
+                                     (3, "ok", PRIORITY_BROADCAST)))
+
+    assert isinstance(results[0], NetworkError) and isinstance(results[1], BadRequest) and results[2] == "ok"
+    assert left == 0 and dispatcher.retried == 0
+    assert dispatcher.failed == {PRIORITY_INTERACTIVE: 1, PRIORITY_NUDGE: 0, PRIORITY_BROADCAST: 1}
+
+
+# Лимит чата: запросы чата на пределе ждут вне очереди, обработчики тем временем отвечают другим
+# чатам; порядок внутри чата сохраняется
+def test_chat_limit_does_not_block_other_chats():
+    bot = FakeBot()
+    dispatcher = _dispatcher(bot, chat_rate=10, chat_burst=1)
+    messages = [(1, "1a", PRIORITY_INTERACTIVE), (1, "1b", PRIORITY_INTERACTIVE), (1, "1c", PRIORITY_INTERACTIVE),
+                (2, "2a", PRIORITY_INTERACTIVE)]
+    results, left = asyncio.run(_run(dispatcher, *messages))
+
+    assert results == ["1a", "1b", "1c", "2a"] and left == 0
+    order = [text for _, text, _ in bot.sent]
+    assert order.index("2a") < order.index("1b")
+    assert [text for text in order if text.startswith("1")] == ["1a", "1b", "1c"]
+    times = [sent_at for chat_id, _, sent_at in bot.sent if chat_id == 1]
+    assert all(later - earlier >= 0.09 for earlier, later in zip(times, times[1:]))
+
+
+# Интерактивные ответы уходят раньше рассылки, поставленной в очередь до них
+def test_interactive_lane_goes_first():
+    bot = FakeBot()
+    dispatcher = _dispatcher(bot, workers=1)
+    results, _ = asyncio.run(_run(dispatcher, (1, "broadcast", PRIORITY_BROADCAST), (2, "reply", PRIORITY_INTERACTIVE)))
+
+    assert results == ["broadcast", "reply"]
+    assert [text for _, text, _ in bot.sent] == ["reply", "broadcast"]
+
+
+# retry_after приходит в секундах или как timedelta (в зависимости от версии PTB)
+@pytest.mark.parametrize("retry_after", [2, timedelta(seconds=2)])
+def test_retry_after_seconds(retry_after):
+    assert retry_after_seconds(RetryAfter(retry_after)) == 2
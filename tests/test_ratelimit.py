@@ -0,0 +1,66 @@
+import types
+
+import pytest
+
+import ratelimit
+from ratelimit import Gcra, RateLimiter
+
+
+# 1 запрос в секунду, всплеск до 3: три подряд проходят, четвёртый — нет,
+# дальше место освобождается раз в секунду
+def test_gcra_burst_then_steady_rate():
+    limit = Gcra(1, 1.0, burst=3)
+    assert [limit.allow("chat", 0.0) for _ in range(4)] == [True, True, True, False]
+    assert not limit.allow("chat", 0.5)
+    assert limit.allow("chat", 1.0)
+    assert not limit.allow("chat", 1.0)
+    assert limit.allow("chat", 2.0)
+
+
+# Отказ не сдвигает TAT: частые попытки не отодвигают следующее разрешённое время
+def test_gcra_denied_requests_are_free():
+    limit = Gcra(1, 1.0)
+    assert limit.allow("chat", 0.0)
+    assert not any(limit.allow("chat", t / 10) for t in range(1, 10))
+    assert limit.allow("chat", 1.0)
+
+
+# У каждого ключа свой лимит; после паузы ключ снова получает полный всплеск
+def test_gcra_keys_are_independent_and_recover():
+    limit = Gcra(2, 1.0, burst=2)
+    assert limit.allow(1, 0.0) and limit.allow(1, 0.0) and not limit.allow(1, 0.0)
+    assert limit.allow(2, 0.0)
+    assert limit.allow(1, 10.0) and limit.allow(1, 10.0) and not limit.allow(1, 10.0)
+
+
+def test_gcra_prune_forgets_idle_keys():
+    limit = Gcra(1, 1.0, burst=2)
+    limit.allow(1, 0.0)
+    limit.allow(2, 5.0)
+    assert len(limit) == 2
+    assert limit.prune(1.0) == 1
+    assert len(limit) == 1
+    assert limit.prune(6.0) == 1 and len(limit) == 0
+
+
+# Часы RateLimiter (time.monotonic) подменяются, чтобы проверить счётчики без ожидания
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(ratelimit, "time", types.SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def test_rate_limiter_counts_by_kind(clock):
+    limiter = RateLimiter({"lookup": (1, 1.0, 2), "text": (1, 10.0, 1)})
+    assert [limiter.allow("lookup", 7) for _ in range(3)] == [True, True, False]
+    assert limiter.allow("text", 7) and not limiter.allow("text", 7)
+    assert limiter.allow("callback", 7)  # Вид без лимита
+    assert limiter.stats() == {"lookup": {"allowed": 2, "rejected": 1, "tracked": 1},
+                               "text": {"allowed": 1, "rejected": 1, "tracked": 1}}
+
+    clock[0] += 2.0
+    assert limiter.allow("lookup", 7)
+    assert limiter.prune() == 0  # TAT lookup ещё впереди, text — тоже
+    clock[0] += 20.0
+    assert limiter.prune() == 2 and len(limiter) == 0
@@ -0,0 +1,40 @@
+import threading
+import time
+import types
+
+from reloader import ExcelReloader
+
+
+def _reloader(path):
+    campaign = types.SimpleNamespace(id="umra", source=str(path), index_options={})
+    return ExcelReloader(campaign, debounce=0.01, settle_interval=0.0)
+
+
+# События watchdog и сработавший таймер после stop() не отправляют перезагрузку в остановленный пул
+def test_schedule_after_stop_is_ignored(tmp_path, monkeypatch):
+    reloader = _reloader(tmp_path / "drivers.csv")
+    errors = []
+    monkeypatch.setattr(threading, "excepthook", errors.append)  # Ошибки в потоке таймера
+    reloader.stop()
+    reloader.schedule()
+    reloader._submit()  # Таймер, сработавший одновременно с остановкой
+    time.sleep(0.05)
+    assert reloader._timer is None and errors == []
+
+
+# Файл ещё пишется, а бот уже останавливается: отложенная перезагрузка не планируется заново
+def test_deferred_reload_after_stop(tmp_path, monkeypatch):
+    reloader = _reloader(tmp_path / "drivers.csv")
+    errors = []
+    monkeypatch.setattr(threading, "excepthook", errors.append)  # Ошибки в потоке таймера
+    writing = threading.Event()
+    monkeypatch.setattr(reloader, "_is_settled", lambda: writing.wait(5) and False)
+    future = reloader._executor.submit(reloader.reload)
+    stopping = threading.Thread(target=reloader.stop)
+    stopping.start()
+    time.sleep(0.05)  # stop() уже ждёт текущую перезагрузку
+    writing.set()
+    stopping.join(5)
+    assert future.result() is None
+    time.sleep(0.05)
+    assert reloader._timer is None and errors == []
@@ -0,0 +1,71 @@
+import datetime
+import logging
+
+from campaigns import CampaignRegistry
+from reply_cache import ReplyCache, render_found, write_reply_cache
+from templates import TemplateCatalog
+from vu_index import CampaignIndex, DriverRecord, VuIndex
+
+TODAY = datetime.date(2025, 3, 1)
+
+TEMPLATES = TemplateCatalog({
+    "default_language": "ru",
+    "languages": {
+        "ru": {"texts": {"found_header": "Здравствуйте, {name}!", "found_footer": "Удачи {в розыгрыше}!"}},
+        "kz": {"texts": {"found_header": "Сәлем, {name!r}!"}},
+    },
+})
+
+
+def _campaign(found, **extra):
+    return {"source": "drivers.xlsx", "orders_per_coupon": 100, "periods": [["2025-02-21", "2025-02-28"]],
+            "templates": {"ru": {"found": found, "not_found": "-"}}, **extra}
+
+
+CAMPAIGNS = CampaignRegistry({"campaigns": {
+    "umra": _campaign("Периоды:\n{periods}\nЗаказов {orders:,}, купонов {coupons} (по {orders_per_coupon}), "
+                      "номера {coupon_numbers}, {{скобки}}"),
+    "bonus": _campaign("{city}: {orders} заказов"),
+    "past": _campaign("{name}", active={"until": "2025-02-01"}),
+}})
+
+
+def _index(**sources):
+    return CampaignIndex({campaign_id: VuIndex(records) for campaign_id, records in sources.items()})
+
+
+# Ответ из кэша совпадает с обычным путём для каждого ВУ номера, набора акций и языка;
+# номера только из прошедших акций в кэш не попадают
+def test_cached_reply_matches_render_found(tmp_path):
+    ivan = DriverRecord("Иван", "Алматы", 12345, 123, "1-123")
+    anna = DriverRecord("Анна", None, 250, 2, None)
+    index = _index(umra={"AB1": ivan, "CD2": anna}, bonus={"AB1": ivan, "EF3": anna}, past={"GH4": anna})
+    path = str(tmp_path / "replies.cache")
+    assert write_reply_cache(path, index, CAMPAIGNS, TEMPLATES, today=TODAY) == 3
+
+    cache = ReplyCache(path)
+    assert len(cache.meta["layouts"]) == 3 * 2  # Три набора акций на два языка
+    for key in ("AB1", "CD2", "EF3"):
+        entries = tuple(entry for entry in index.lookup(key) if entry.campaign_id != "past")
+        for language in ("ru", "kz", "en"):
+            assert cache.reply(key, language) == render_found(entries, language, CAMPAIGNS, TEMPLATES)
+    assert "Заказов 12,345" in cache.reply("AB1", "ru")
+    assert cache.reply("GH4", "ru") is None and cache.reply("ZZ9", "ru") is None
+
+
+# Ответ, который не форматируется, в кэш не попадает; первая ошибка логируется с ВУ номером
+def test_broken_template_is_logged_once(tmp_path, caplog):
+    campaigns = CampaignRegistry({"campaigns": {"umra": _campaign("{orders:d} заказов")}})
+    index = _index(umra={"AB1": DriverRecord("Иван", None, "много", None, None),
+                         "CD2": DriverRecord("Анна", None, "мало", None, None),
+                         "EF3": DriverRecord("Пётр", None, 300, 3, None)})
+    path = str(tmp_path / "replies.cache")
+    with caplog.at_level(logging.ERROR):
+        write_reply_cache(path, index, campaigns, TEMPLATES, today=TODAY)
+
+    cache = ReplyCache(path)
+    assert cache.reply("AB1", "ru") is None and cache.reply("CD2", "kz") is None
+    assert cache.reply("EF3", "ru") == "Здравствуйте, Пётр!\n\n300 заказов\n\nУдачи {в розыгрыше}!"
+    traced = [record for record in caplog.records if record.exc_info]
+    assert len(traced) == 1 and "AB1" in traced[0].getMessage()
+    assert "4 ответов не отформатировались" in caplog.records[-1].getMessage()
@@ -0,0 +1,109 @@
+import asyncio
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from session_store import SqliteSessionStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SqliteSessionStore(str(tmp_path / "sessions.db"), flush_interval=3600)
+    store._db.execute("PRAGMA busy_timeout = 0")
+    yield store
+    store.close()
+
+
+# Запись при заблокированной базе (другой процесс кластера держит транзакцию записи)
+# не теряет изменения: транзакция откатывается, сессии попадают в следующую запись
+def test_flush_retries_after_locked_database(store, tmp_path):
+    store.set_language(1, "kz")
+    store.touch(2, when=100.0)
+
+    other = sqlite3.connect(str(tmp_path / "sessions.db"), isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    with pytest.raises(sqlite3.OperationalError, match="locked"):
+        store.flush()
+    assert not store._db.in_transaction
+    assert not store._can_evict(1) and not store._can_evict(2)
+    other.execute("ROLLBACK")
+    other.close()
+
+    assert store.flush() == 2
+    assert store._can_evict(1) and store._can_evict(2)
+    rows = dict(store._db.execute("SELECT chat_id, language FROM sessions").fetchall())
+    assert rows == {1: "kz", 2: None}
+
+
+# Вытесненная сессия поднимается с диска в preload, обработчик читает её из памяти
+def test_preload_restores_evicted_session(store):
+    store.set_language(1, "kz")
+    store.flush()
+    assert store.evict_expired(now=store._sessions[1].last_seen + store.ttl + 1) == 1
+
+    asyncio.run(store.preload(1))
+    asyncio.run(store.preload(2))
+    assert set(store._sessions) == {1, 2}
+    reader, store._reader = store._reader, None  # Дальше диск не нужен
+    try:
+        assert store.get_language(1) == "kz"
+        assert store.get_language(2, "ru") == "ru"
+    finally:
+        store._reader = reader
+
+
+# Соединение записи, первая транзакция которого ждёт сигнала и падает, как при занятой базе
+class _FailingOnce:
+    def __init__(self, db):
+        self.db = db
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        self.failed = False
+
+    def execute(self, sql, *args):
+        if sql == "BEGIN IMMEDIATE" and not self.failed:
+            self.failed = True
+            self.entered.set()
+            self.release.wait(5)
+            raise sqlite3.OperationalError("database is locked")
+        return self.db.execute(sql, *args)
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+
+# Запись из фонового потока и запись из chat_ids (рассылка) одновременно: неудачная запись
+# возвращает в очередь свой пакет, а не пакет второй записи, и ни одна сессия не теряется
+def test_concurrent_flush_keeps_failed_batch(store, tmp_path, monkeypatch):
+    db = _FailingOnce(store._db)
+    monkeypatch.setattr(store, "_db", db)
+    errors = []
+
+    def flush():
+        try:
+            store.flush()
+        except sqlite3.OperationalError as e:
+            errors.append(e)
+
+    store.set_language(1, "kz")
+    store.set_language(2, "ru")
+    first = threading.Thread(target=flush)
+    first.start()
+    assert db.entered.wait(5)
+    store.set_language(3, "kz")
+    second = threading.Thread(target=store.chat_ids)
+    second.start()
+    time.sleep(0.1)  # Вторая запись успевает начаться, пока первая ждёт базу
+    db.release.set()
+    first.join(5)
+    second.join(5)
+
+    assert len(errors) == 1
+    store.flush()
+    other = sqlite3.connect(str(tmp_path / "sessions.db"))
+    rows = dict(other.execute("SELECT chat_id, language FROM sessions").fetchall())
+    other.close()
+    assert rows == {1: "kz", 2: "ru", 3: "kz"}
+    assert all(store._can_evict(chat_id) for chat_id in rows)
@@ -0,0 +1,76 @@
+import asyncio
+import datetime
+
+import pytest
+from telegram import Chat, Message, Update
+
+from update_processor import ChatOrderedUpdateProcessor, worker_for
+
+
+def _update(update_id, chat_id):
+    message = Message(update_id, datetime.datetime.now(datetime.timezone.utc), Chat(chat_id, Chat.PRIVATE), text="x")
+    return Update(update_id, message=message)
+
+
+# Обработчик, который записывает начало и конец обработки и занимает duration секунд
+def _handler(log, name, duration):
+    async def handle():
+        log.append(("start", name))
+        await asyncio.sleep(duration)
+        log.append(("end", name))
+    return handle()
+
+
+async def _process(processor, updates):
+    log = []
+    await processor.initialize()
+    await asyncio.gather(*(processor.process_update(_update(update_id, chat_id), _handler(log, name, duration))
+                           for update_id, (chat_id, name, duration) in enumerate(updates, 1)))
+    return log
+
+
+# Обновления одного чата обрабатываются по одному в порядке поступления, даже если первое самое долгое;
+# другой чат в это время не ждёт
+def test_same_chat_in_order_other_chats_concurrently():
+    processor = ChatOrderedUpdateProcessor(max_concurrent_updates=4)
+    log = asyncio.run(_process(processor, [(1, "1a", 0.05), (1, "1b", 0.01), (2, "2a", 0.01), (1, "1c", 0.0)]))
+
+    chat_1 = [event for event in log if event[1].startswith("1")]
+    assert chat_1 == [("start", "1a"), ("end", "1a"), ("start", "1b"), ("end", "1b"), ("start", "1c"), ("end", "1c")]
+    assert log.index(("end", "2a")) < log.index(("end", "1a"))
+    assert len(processor) == 0  # Хвосты завершённых чатов не копятся
+
+
+# Не больше max_concurrent_updates обработчиков одновременно
+def test_concurrency_limit():
+    processor = ChatOrderedUpdateProcessor(max_concurrent_updates=2)
+    log = asyncio.run(_process(processor, [(chat_id, str(chat_id), 0.01) for chat_id in range(6)]))
+
+    running = peak = 0
+    for event, _ in log:
+        running += 1 if event == "start" else -1
+        peak = max(peak, running)
+    assert peak == 2
+
+
+# Ошибка обработчика не останавливает следующие обновления чата
+def test_failed_update_releases_the_chat():
+    processor = ChatOrderedUpdateProcessor(max_concurrent_updates=2)
+    log = []
+
+    async def fail():
+        raise RuntimeError("boom")
+
+    async def scenario():
+        first = asyncio.ensure_future(processor.process_update(_update(1, 1), fail()))
+        second = asyncio.ensure_future(processor.process_update(_update(2, 1), _handler(log, "1b", 0.0)))
+        return await asyncio.gather(first, second, return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert isinstance(results[0], RuntimeError) and results[1] is None
+    assert log == [("start", "1b"), ("end", "1b")]
+
+
+@pytest.mark.parametrize("chat_id, count, worker", [(10, 1, 0), (10, 3, 1), (-1001, 4, 3), (7, 0, 0)])
+def test_worker_for(chat_id, count, worker):
+    assert worker_for(chat_id, count) == worker
@@ -0,0 +1,43 @@
+import pytest
+
+from vu_index import VU_PATTERN, normalize_vu
+
+
+# Что водители пишут вместо номера из таблицы «NV000216»
+@pytest.mark.parametrize("text, key", [
+    ("NV000216", "NV000216"),
+    ("nv000216", "NV000216"),
+    ("  NV 000 216 ", "NV000216"),
+    ("NV\t000216\n", "NV000216"),
+    ("NV-000216", "NV000216"),
+    ("NV–000216", "NV000216"),
+    ("NV.000.216", "NV000216"),
+    ("NV_000216", "NV000216"),
+    ("NV/000216", "NV000216"),
+    ("№NV000216", "NV000216"),
+    ("(NV) 000216,", "NV000216"),
+    ("АВ123456", "AB123456"),  # Кириллические А и В
+    ("ав 123456", "AB123456"),
+    ("Aв-123456", "AB123456"),  # Латиница вперемешку с кириллицей
+    ("ЕНКМОРТХУС1", "EHKMOPTXYC1"),
+    (727, "727"),
+])
+def test_normalize_vu(text, key):
+    assert normalize_vu(text) == key
+
+
+@pytest.mark.parametrize("text, is_vu", [
+    ("NV000216", True),
+    ("nv-000216", True),
+    ("АВ 123456", True),
+    ("1A", True),
+    ("000216", False),  # Нет букв
+    ("NV", False),  # Нет цифр
+    ("Привет", False),
+    ("ЖД123", False),  # Кириллица без латинского двойника
+    ("NV000216!", False),
+    ("", False),
+    ("-", False),
+])
+def test_vu_pattern(text, is_vu):
+    assert bool(VU_PATTERN.match(normalize_vu(text))) is is_vu
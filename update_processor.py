@@ -0,0 +1,61 @@
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+# Параллельная обработка обновлений из разных чатов при строгом порядке внутри одного чата:
+# каждое обновление ждёт завершения предыдущего обновления своего чата, а затем занимает
+# одно из max_concurrent_updates мест обработки. Базовый семафор PTB ограничивает
+# общее число принятых, но ещё не обработанных обновлений (max_pending)
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates, max_pending=10000):
+        super().__init__(max_pending)
+        self.limit = max_concurrent_updates
+        self._running = asyncio.Semaphore(max_concurrent_updates)
+        self._tails = {}  # chat_id -> future последнего обновления чата
+
+    @staticmethod
+    def _chat_id(update):
+        if isinstance(update, Update) and update.effective_chat is not None:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        chat_id = self._chat_id(update)
+        if chat_id is None:
+            async with self._running:
+                await coroutine
+            return
+
+        previous = self._tails.get(chat_id)
+        done = asyncio.get_running_loop().create_future()
+        self._tails[chat_id] = done
+        try:
+            if previous is not None:
+                await asyncio.shield(previous)
+            async with self._running:
+                await coroutine
+        except asyncio.CancelledError:
+            coroutine.close()  # Отменено до начала обработки
+            raise
+        finally:
+            done.set_result(None)
+            if self._tails.get(chat_id) is done:
+                del self._tails[chat_id]
+
+    # Сколько чатов сейчас ждут или обрабатываются
+    def __len__(self):
+        return len(self._tails)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+# Номер рабочего процесса кластера, которому принадлежит чат: все обновления чата
+# обрабатывает один процесс, поэтому порядок и сессия чата остаются в одном месте
+def worker_for(chat_id, count):
+    return chat_id % count if count > 1 else 0
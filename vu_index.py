@@ -0,0 +1,188 @@
+import re
+import threading
+from collections import namedtuple
+
+# Компактная запись о водителе (вместо строки DataFrame)
+DriverRecord = namedtuple("DriverRecord", ["name", "city", "orders", "coupons", "coupon_numbers"])
+
+# Соответствие колонок Excel полям записи
+COLUMNS = {
+    "name": "Имя",
+    "city": "Город",
+    "orders": "Количество заказов",
+    "coupons": "Количество купонов",
+    "coupon_numbers": "Номер купона",
+}
+VU_COLUMN = "ВУ номер"
+
+# Запись о водителе в одной из кампаний
+CampaignEntry = namedtuple("CampaignEntry", ["campaign_id", "record"])
+
+
+# Кириллические буквы, которые водители путают с латинскими, и разделители, которые они ставят
+# внутри номера («NV-000216», «NV.000216», «№NV000216»): разделители удаляются
+_LOOKALIKES = str.maketrans("АВСЕНКМОРТХУ", "ABCEHKMOPTXY", "-‐‑–—_./\\,:;#№'\"()")
+
+# Формат ВУ номера (латинские буквы и цифры), проверяется на нормализованном ключе
+VU_PATTERN = re.compile(r'^(?=.*[A-Z])(?=.*\d)[A-Z0-9]+$')
+
+
+# Ключ для поиска по ВУ номеру: без пробелов и разделителей, в верхнем регистре, только латиница
+def normalize_vu(vu_number):
+    return "".join(str(vu_number).upper().translate(_LOOKALIKES).split())
+
+
+# Пустые ячейки: None из openpyxl, "" из CSV, NaN из pandas
+def _is_empty(value):
+    return value is None or value == "" or value != value
+
+
+def _compact_value(value, strings):
+    return None if _is_empty(value) else value
+
+
+def _int_value(value, strings):
+    if _is_empty(value):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        try:
+            return int(float(value))  # "727.0" из CSV
+        except (TypeError, ValueError):
+            return value
+
+
+def _interned_value(value, strings):
+    value = _compact_value(value, strings)
+    return strings.setdefault(value, value) if isinstance(value, str) else value
+
+
+# Приведение значений полей: числа из CSV — в int, города — в общий экземпляр строки
+_FIELD_CONVERTERS = {"orders": _int_value, "coupons": _int_value, "city": _interned_value}
+
+
+# Неизменяемый индекс ВУ номер -> запись одной таблицы, поиск за O(1)
+class VuIndex:
+    __slots__ = ("records", "generation")
+
+    def __init__(self, records=None):
+        self.records = records or {}
+        self.generation = 0  # Номер поколения присваивается при публикации
+
+    # Построение индекса по потоку строк таблицы (кортежи в порядке header), без промежуточного DataFrame.
+    # columns: поле записи -> колонка таблицы; поля без колонки остаются None,
+    # а количество купонов без своей колонки считается как orders // orders_per_coupon.
+    # Недостающие ячейки в конце короткой строки (CSV) считаются пустыми
+    @classmethod
+    def from_rows(cls, header, rows, columns=None, vu_column=VU_COLUMN, orders_per_coupon=None):
+        columns = COLUMNS if columns is None else columns
+        unknown = [field for field in columns if field not in DriverRecord._fields]
+        if unknown:
+            raise ValueError(f"Неизвестные поля записи: {', '.join(unknown)}")
+        header = [str(name).strip() if name is not None else "" for name in header]
+        missing = [column for column in [vu_column, *columns.values()] if column not in header]
+        if missing:
+            raise ValueError(f"В таблице нет колонок: {', '.join(missing)}")
+
+        vu_position = header.index(vu_column)
+        positions = [header.index(columns[field]) if field in columns else None for field in DriverRecord._fields]
+        converters = [_FIELD_CONVERTERS.get(field, _compact_value) for field in DriverRecord._fields]
+        width = max([vu_position, *(position for position in positions if position is not None)]) + 1
+        count_coupons = "coupons" not in columns and "orders" in columns and orders_per_coupon
+        orders_slot, coupons_slot = DriverRecord._fields.index("orders"), DriverRecord._fields.index("coupons")
+        strings = {}  # Повторяющиеся строки (города) хранятся в одном экземпляре
+        records = {}
+        for row in rows:
+            if len(row) < width:
+                row = (*row, *(None,) * (width - len(row)))
+            vu_number = row[vu_position]
+            if _is_empty(vu_number):
+                continue
+            key = normalize_vu(vu_number)
+            # Как и раньше при фильтрации DataFrame, берём первое совпадение
+            if key in records:
+                continue
+            values = [None if position is None else convert(row[position], strings)
+                      for position, convert in zip(positions, converters)]
+            if count_coupons and values[orders_slot] is not None:
+                values[coupons_slot] = values[orders_slot] // orders_per_coupon
+            records[key] = DriverRecord(*values)
+        return cls(records)
+
+    @classmethod
+    def from_dataframe(cls, data, columns=None, vu_column=VU_COLUMN, orders_per_coupon=None):
+        header = list(data.columns)
+        return cls.from_rows(header, zip(*(data[name].tolist() for name in header)), columns, vu_column, orders_per_coupon)
+
+    def get(self, vu_number):
+        return self.records.get(normalize_vu(vu_number))
+
+    # Поиск по уже нормализованному ключу
+    def get_normalized(self, key):
+        return self.records.get(key)
+
+    def __len__(self):
+        return len(self.records)
+
+
+# Общий индекс всех кампаний: ВУ номер -> записи водителя во всех кампаниях за один поиск.
+# Таблица каждой кампании хранится отдельно и заменяется независимо (with_source),
+# общий словарь при этом пересобирается целиком и публикуется как новое поколение
+class CampaignIndex:
+    __slots__ = ("sources", "entries", "generation")
+
+    def __init__(self, sources=None):
+        self.sources = sources or {}  # id кампании -> VuIndex, в порядке реестра кампаний
+        entries = {}
+        for campaign_id, index in self.sources.items():
+            for key, record in index.records.items():
+                entry = CampaignEntry(campaign_id, record)
+                existing = entries.get(key)
+                entries[key] = (entry,) if existing is None else existing + (entry,)
+        self.entries = entries
+        self.generation = 0
+
+    def with_source(self, campaign_id, index):
+        return CampaignIndex({**self.sources, campaign_id: index})
+
+    # Все записи по уже нормализованному ключу (пустой кортеж, если номера нет ни в одной кампании)
+    def lookup(self, key):
+        return self.entries.get(key, ())
+
+    # Число записей в таблице каждой акции
+    def campaign_sizes(self):
+        return {campaign_id: len(index) for campaign_id, index in self.sources.items()}
+
+    # Прогрев (warm_up) вызывает prefetch у любого индекса, чтобы упакованный индекс (packed_index)
+    # заранее прочитался с диска; этот индекс уже целиком в памяти процесса, поэтому делать нечего
+    def prefetch(self):
+        return None
+
+    def __len__(self):
+        return len(self.entries)
+
+
+# Текущий индекс подменяется целиком одной операцией присваивания,
+# поэтому обработчики никогда не видят частично построенный индекс
+_current = VuIndex()
+_publish_lock = threading.RLock()
+
+
+def current_index():
+    return _current
+
+
+def publish_index(index):
+    global _current
+    with _publish_lock:
+        index.generation = _current.generation + 1
+        _current = index
+    return index
+
+
+# Замена таблицы одной кампании в общем индексе; блокировка не даёт перезагрузкам
+# разных кампаний из разных потоков потерять изменения друг друга
+def publish_source(campaign_id, index):
+    with _publish_lock:
+        return publish_index(current_index().with_source(campaign_id, index))
@@ -0,0 +1,191 @@
+import asyncio
+import hmac
+import json
+import logging
+from http import HTTPStatus
+
+from telegram import Update
+
+MAX_BODY_SIZE = 1024 * 1024
+
+
+# Минимальный разбор HTTP/1.1-запроса: строка запроса, заголовки и тело по Content-Length
+async def read_http_request(reader):
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length > MAX_BODY_SIZE:
+        raise ValueError(f"Слишком большое тело запроса: {length} байт")
+    body = await reader.readexactly(length) if length else b""
+    return method, path, headers, body
+
+
+def write_http_response(writer, status, body=b"", content_type="text/plain; charset=utf-8", keep_alive=True):
+    status = HTTPStatus(status)
+    head = (f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    writer.write(head.encode("latin-1") + body)
+
+
+# Простой HTTP-сервер на asyncio: handler(method, path, headers, body) -> (status, body, content_type)
+class HttpServer:
+    def __init__(self, handler):
+        self.handler = handler
+        self._server = None
+        self._connections = set()
+        self._idle = set()  # Соединения, ожидающие следующего запроса
+        self._closing = False
+
+    # ssl — ssl.SSLContext для приёма HTTPS (None — обычный HTTP)
+    async def start(self, host, port, ssl=None):
+        self._server = await asyncio.start_server(self._serve, host, port, ssl=ssl)
+        return self._server.sockets[0].getsockname()[1]
+
+    # Новые соединения не принимаются, простаивающие keep-alive соединения закрываются,
+    # а запросы, которые уже обрабатываются, получают ответ
+    async def stop(self):
+        if self._server is not None:
+            self._closing = True
+            self._server.close()
+            for task in list(self._idle):
+                task.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+            self._closing = False
+
+    async def _serve(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while not self._closing:
+                self._idle.add(task)
+                try:
+                    request = await read_http_request(reader)
+                finally:
+                    self._idle.discard(task)
+                if request is None:
+                    break
+                status, body, content_type = await self.handler(*request)
+                keep_alive = request[2].get("connection", "").lower() != "close" and not self._closing
+                write_http_response(writer, status, body, content_type, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            logging.error(f"Ошибка при обработке HTTP-запроса: {e}")
+            write_http_response(writer, HTTPStatus.BAD_REQUEST, keep_alive=False)
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+
+# Клиент HTTP/1.1 для одного адреса с пулом keep-alive соединений.
+# Ошибка соединения (в том числе закрытого сервером простаивающего) пробрасывается вызывающему
+class HttpClient:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._idle = []
+
+    async def post(self, path, body, headers=None):
+        if self._idle:
+            reader, writer = self._idle.pop()
+        else:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            head = "".join(f"{name}: {value}\r\n" for name, value in (headers or {}).items())
+            writer.write((f"POST {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+                          f"Content-Length: {len(body)}\r\n{head}\r\n").encode("latin-1") + body)
+            await writer.drain()
+            status_line = await reader.readline()
+            if not status_line:
+                raise ConnectionResetError("Сервер закрыл соединение")
+            response_headers = {}
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, _, value = line.decode("latin-1").partition(":")
+                response_headers[name.strip().lower()] = value.strip()
+            length = int(response_headers.get("content-length", 0))
+            response = await reader.readexactly(length) if length else b""
+        except BaseException:
+            writer.close()
+            raise
+        if response_headers.get("connection", "").lower() == "close":
+            writer.close()
+        else:
+            self._idle.append((reader, writer))
+        return int(status_line.split()[1]), response
+
+    def close(self):
+        for reader, writer in self._idle:
+            writer.close()
+        self._idle = []
+
+
+# Приём обновлений от Telegram через вебхук. Запрос проверяется по секретному токену,
+# обновление обрабатывается через update_processor приложения (как и при polling).
+# В обработке одновременно не больше max_pending обновлений: когда все места заняты,
+# ответ Telegram задерживается, и он сам снижает темп отправки.
+# С wait_processed=True ответ отправляется только после обработки обновления —
+# так рабочий процесс кластера подтверждает ingress, что обновление можно забыть
+class WebhookServer:
+    def __init__(self, application, path, secret_token, max_pending=100, wait_processed=False):
+        self.application = application
+        self.path = path
+        self.secret_token = secret_token
+        self.wait_processed = wait_processed
+        self._slots = asyncio.Semaphore(max_pending)
+        self._tasks = set()
+        self._http = HttpServer(self._handle)
+
+    async def start(self, host, port, ssl=None):
+        port = await self._http.start(host, port, ssl)
+        logging.info(f"Вебхук слушает {'https' if ssl else 'http'}://{host}:{port}{self.path}")
+        return port
+
+    async def stop(self):
+        await self._http.stop()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _process(self, update):
+        try:
+            await self.application.update_processor.process_update(update, self.application.process_update(update))
+        except Exception as e:
+            logging.error(f"Ошибка при обработке обновления с вебхука: {e}")
+        finally:
+            self._slots.release()
+
+    async def _handle(self, method, path, headers, body):
+        if path != self.path:
+            return HTTPStatus.NOT_FOUND, b"", "text/plain"
+        if method != "POST":
+            return HTTPStatus.METHOD_NOT_ALLOWED, b"", "text/plain"
+        token = headers.get("x-telegram-bot-api-secret-token", "")
+        if not hmac.compare_digest(token.encode(), self.secret_token.encode()):
+            logging.warning("Запрос на вебхук с неверным секретным токеном отклонён.")
+            return HTTPStatus.FORBIDDEN, b"", "text/plain"
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except Exception as e:
+            logging.error(f"Некорректное обновление на вебхуке: {e}")
+            return HTTPStatus.BAD_REQUEST, b"", "text/plain"
+        await self._slots.acquire()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        if self.wait_processed:
+            await asyncio.shield(task)
+        return HTTPStatus.OK, b"", "text/plain"